@@ -0,0 +1,121 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# --- Controle de admissão das rotas de gravação ---
+# Duas barreiras antes de uma requisição chegar ao armazenamento:
+#   taxa       -> balde de fichas por cliente (IP): 'por_minuto' fichas por minuto, até
+#                 'rajada' acumuladas. Uma aba travada ou um robô repetindo POSTs esgota o
+#                 próprio balde e recebe 429, sem afetar os outros clientes.
+#   sobrecarga -> descarte adaptativo: se a latência recente das gravações passa de
+#                 'latencia_maxima' ou a rota já tem 'em_andamento_maximo' requisições em
+#                 andamento, a requisição nova recebe 503 na hora em vez de entrar numa
+#                 fila que só cresce.
+# As duas respostas levam Retry-After. A sobrecarga é conferida primeiro, para que uma
+# requisição recusada por ela não gaste ficha do cliente.
+#
+# A latência é uma média móvel exponencial das gravações medidas com
+# MonitorLatencia.medir(), que decai pela metade a cada 'meia_vida' segundos sem
+# gravações: enquanto tudo é recusado não há medições novas, e o descarte precisa
+# terminar sozinho.
+
+MAXIMO_CLIENTES = 10000  # Baldes guardados; o cliente mais antigo sai e volta com o balde cheio
+ALFA = 0.2               # Peso de cada gravação na média móvel
+MEIA_VIDA_LATENCIA = 10.0
+
+
+class LimitadorTaxa:
+    def __init__(self, por_minuto, rajada, maximo_clientes=MAXIMO_CLIENTES):
+        self.taxa = por_minuto / 60
+        self.rajada = max(1, rajada)
+        self.maximo_clientes = maximo_clientes
+        self._baldes = OrderedDict()  # cliente -> [fichas, instante da última atualização]
+        self._lock = threading.Lock()
+
+    def consumir(self, cliente):
+        # Retorna 0 se a requisição pode passar (e gasta uma ficha), senão os segundos até a próxima ficha
+        agora = time.monotonic()
+        with self._lock:
+            balde = self._baldes.pop(cliente, None)
+            fichas = self.rajada if balde is None else min(self.rajada, balde[0] + (agora - balde[1]) * self.taxa)
+            espera = 0
+            if fichas >= 1:
+                fichas -= 1
+            else:
+                espera = (1 - fichas) / self.taxa
+            self._baldes[cliente] = [fichas, agora]
+            if len(self._baldes) > self.maximo_clientes:
+                self._baldes.popitem(last=False)
+        return espera
+
+
+class MonitorLatencia:
+    def __init__(self, meia_vida=MEIA_VIDA_LATENCIA, alfa=ALFA):
+        self.meia_vida = meia_vida
+        self.alfa = alfa
+        self._media = 0.0
+        self._instante = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _atual(self, agora):
+        return self._media * 0.5 ** ((agora - self._instante) / self.meia_vida)
+
+    def latencia(self):
+        with self._lock:
+            return self._atual(time.monotonic())
+
+    def observar(self, duracao):
+        agora = time.monotonic()
+        with self._lock:
+            atual = self._atual(agora)
+            self._media = atual + self.alfa * (duracao - atual)
+            self._instante = agora
+
+    def ate_normalizar(self, limite):
+        # Segundos até a latência decair abaixo de 'limite' sem novas medições
+        latencia = self.latencia()
+        if latencia <= limite or limite <= 0:
+            return 0
+        return self.meia_vida * math.log2(latencia / limite)
+
+    @contextmanager
+    def medir(self):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio)
+
+
+class ControleAdmissao:
+    def __init__(self, limitador=None, em_andamento_maximo=0, monitor=None, latencia_maxima=0):
+        # Zero ou None desliga a barreira correspondente
+        self.limitador = limitador
+        self.em_andamento_maximo = em_andamento_maximo
+        self.monitor = monitor
+        self.latencia_maxima = latencia_maxima
+        self.em_andamento = 0
+        self._lock = threading.Lock()
+
+    def entrar(self, cliente):
+        # Retorna (motivo, segundos para tentar de novo). Com motivo None a requisição foi
+        # admitida e conta como em andamento até sair().
+        if self.monitor is not None and self.latencia_maxima:
+            espera = self.monitor.ate_normalizar(self.latencia_maxima)
+            if espera:
+                return 'latencia', espera
+        with self._lock:
+            if self.em_andamento_maximo and self.em_andamento >= self.em_andamento_maximo:
+                return 'em_andamento', 1
+            if self.limitador is not None:
+                espera = self.limitador.consumir(cliente)
+                if espera:
+                    return 'taxa', espera
+            self.em_andamento += 1
+        return None, 0
+
+    def sair(self):
+        with self._lock:
+            self.em_andamento -= 1
@@ -0,0 +1,353 @@
+import copy
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from horarios import FUSO, agora_utc, horario_utc_de, texto_utc, utc_de_texto
+from placas import canonica, placa_do_registro
+
+# --- Agregados diários (caminhões por dia, hora e transportadora; permanência) ---
+# Um documento por dia (horário de São Paulo) com contadores por tipo de registro,
+# por hora e por transportadora, e histogramas do tempo de permanência no pátio
+# (Entrada -> Saída da mesma placa, contado no dia da Saída). O painel lê só esses
+# documentos, então o custo de um relatório não depende do tamanho do histórico.
+#
+# O índice é mantido em memória e atualizado a cada registro aceito, como o índice de
+# ocupação: os dias alterados e o estado (cursor + entradas em aberto) são salvos
+# juntos a cada intervalo, e na inicialização os registros posteriores ao cursor são
+# reaplicados. recalcular_agregados.py refaz tudo a partir da coleção de registros;
+# o app percebe a nova 'geracao' no próximo snapshot e recarrega.
+#
+# Registros com horário anterior ao cursor gravados depois do último snapshot (ex:
+# sincronização em lote seguida de uma queda do servidor) e Saídas que chegam antes
+# da Entrada correspondente só entram na permanência depois de um recálculo.
+#
+# Cada dia é gravado inteiro a partir da memória, então só uma instância do app pode
+# salvar os agregados (o serviço roda com max-instances=1). O estado leva o id da
+# instância e o horário do último salvamento: outra instância que encontre um estado
+# recente de outra não grava e avisa no log; se o estado for antigo (a outra parou,
+# ex: numa troca de revisão), ela recarrega a partir dele e assume. Os registros que
+# a instância recusada recebeu estão na coleção e entram no próximo recálculo.
+
+BALDES_PERMANENCIA_MIN = (15, 30, 60, 120, 240, 480, 720, 1440)
+PERMANENCIA_MAXIMA = timedelta(days=3)  # Entrada sem Saída há mais tempo que isso não é pareada
+SEM_TRANSPORTADORA = 'SEM TRANSPORTADORA'
+NOME_ESTADO = 'agregados'
+VERSAO_ESTADO = 1
+
+
+def permanencia_vazia():
+    return {'baldes': [0] * (len(BALDES_PERMANENCIA_MIN) + 1), 'soma_min': 0.0, 'contagem': 0}
+
+
+def mesclar(destino, origem):
+    # Soma 'origem' em 'destino' (dicts de contadores, listas de baldes e números)
+    for chave, valor in origem.items():
+        if chave not in destino:
+            destino[chave] = copy.deepcopy(valor)
+        elif isinstance(valor, dict):
+            mesclar(destino[chave], valor)
+        elif isinstance(valor, list):
+            destino[chave] = [a + b for a, b in zip(destino[chave], valor)]
+        else:
+            destino[chave] += valor
+
+
+def _contar(contadores, tipo):
+    contadores[tipo] = contadores.get(tipo, 0) + 1
+
+
+def _observar(permanencia, minutos):
+    indice = len(BALDES_PERMANENCIA_MIN)
+    for i, limite in enumerate(BALDES_PERMANENCIA_MIN):
+        if minutos <= limite:
+            indice = i
+            break
+    permanencia['baldes'][indice] += 1
+    permanencia['soma_min'] += minutos
+    permanencia['contagem'] += 1
+
+
+class Agregador:
+    # Estado dos agregados sem lock: usado pelo índice do app e, um por bloco, pelo recálculo.
+    # Com blocos=True também guarda o que é preciso para emendar blocos processados em paralelo.
+    def __init__(self, blocos=False):
+        self.dias = {}
+        self.abertas = {}  # placa canônica -> [horario_utc da Entrada em texto, transportadora]
+        self.alterados = set()
+        self.blocos = blocos
+        self.vistas = set()             # placas com algum registro neste bloco
+        self.saidas_sem_entrada = {}    # placa -> [horario_utc, transportadora] da 1ª Saída sem Entrada no bloco
+
+    def _dia(self, dia):
+        self.alterados.add(dia)
+        if dia not in self.dias:
+            self.dias[dia] = {'total': {}, 'horas': {}, 'transportadoras': {}, 'permanencia': permanencia_vazia()}
+        return self.dias[dia]
+
+    def _transportadora(self, dados_dia, transportadora):
+        if transportadora not in dados_dia['transportadoras']:
+            dados_dia['transportadoras'][transportadora] = {'total': {}, 'horas': {},
+                                                            'permanencia': permanencia_vazia()}
+        return dados_dia['transportadoras'][transportadora]
+
+    def aplicar(self, registro):
+        momento = horario_utc_de(registro)
+        local = momento.astimezone(FUSO)
+        tipo = registro.get('tipo') or 'Desconhecido'
+        hora = local.strftime('%H')
+        transportadora = registro.get('Transportadora') or SEM_TRANSPORTADORA
+
+        dados_dia = self._dia(local.strftime('%Y-%m-%d'))
+        dados_transportadora = self._transportadora(dados_dia, transportadora)
+        for dados in (dados_dia, dados_transportadora):
+            _contar(dados['total'], tipo)
+            _contar(dados['horas'].setdefault(hora, {}), tipo)
+
+        if not registro.get('placa'):
+            return
+        placa = placa_do_registro(registro)
+        # Registros atrasados (ex: lote de um dispositivo que estava offline) não mexem numa
+        # Entrada aberta mais nova: não a substituem nem a encerram
+        aberta = self.abertas.get(placa)
+        if tipo == 'Entrada':
+            if aberta is None or aberta[0] <= texto_utc(momento):
+                self.abertas[placa] = [texto_utc(momento), transportadora]
+        elif tipo == 'Saída':
+            if aberta is not None:
+                if aberta[0] <= texto_utc(momento):
+                    del self.abertas[placa]
+                    self.parear(aberta, momento)
+            elif self.blocos and placa not in self.vistas:
+                self.saidas_sem_entrada[placa] = [texto_utc(momento), transportadora]
+        if self.blocos:
+            self.vistas.add(placa)
+
+    def parear(self, aberta, saida):
+        # Registra a permanência de uma Entrada em aberto encerrada por uma Saída em 'saida' (datetime UTC)
+        entrada_utc, transportadora = aberta
+        duracao = saida - utc_de_texto(entrada_utc)
+        if duracao < timedelta(0) or duracao > PERMANENCIA_MAXIMA:
+            return
+        minutos = duracao.total_seconds() / 60
+        dados_dia = self._dia(saida.astimezone(FUSO).strftime('%Y-%m-%d'))
+        _observar(dados_dia['permanencia'], minutos)
+        _observar(self._transportadora(dados_dia, transportadora)['permanencia'], minutos)
+
+    def emendar(self, bloco):
+        # Acrescenta um bloco processado à parte (o seguinte no tempo) como se fosse aplicado em sequência
+        for placa, (saida_utc, _) in bloco.saidas_sem_entrada.items():
+            aberta = self.abertas.pop(placa, None)
+            if aberta is not None:
+                self.parear(aberta, utc_de_texto(saida_utc))
+        for placa in bloco.vistas:
+            self.abertas.pop(placa, None)
+        self.abertas.update(bloco.abertas)
+        for dia, dados in bloco.dias.items():
+            if dia in self.dias:
+                mesclar(self.dias[dia], dados)
+            else:
+                self.dias[dia] = dados
+            self.alterados.add(dia)
+
+    def podar_abertas(self, agora):
+        # Entradas que já não podem ser pareadas não precisam ir para o snapshot
+        limite = texto_utc(agora - PERMANENCIA_MAXIMA)
+        for placa in [p for p, (entrada_utc, _) in self.abertas.items() if entrada_utc < limite]:
+            del self.abertas[placa]
+
+
+def _media(permanencia):
+    if not permanencia['contagem']:
+        return None
+    return round(permanencia['soma_min'] / permanencia['contagem'], 1)
+
+
+class IndiceAgregados:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._agregador = Agregador()
+        self._adiados = []   # (chave, doc_id, registro) recebidos durante uma reconstrução
+        self.cursor = None   # maior (horario_utc em texto, doc_id) aplicado
+        self.geracao = None
+        self.instancia = uuid.uuid4().hex
+        self.validade = timedelta(minutes=3)  # estado de outra instância mais recente que isso: ela está ativa
+        self.pronto = False
+
+    def aplicar(self, doc_id, registro):
+        if not registro.get('horario'):
+            return
+        chave = (texto_utc(horario_utc_de(registro)), doc_id)
+        with self._lock:
+            if not self.pronto:
+                self._adiados.append((chave, doc_id, registro))
+                return
+            self._agregador.aplicar(registro)
+            if self.cursor is None or chave > self.cursor:
+                self.cursor = chave
+
+    # --- Consulta do painel ---
+
+    def resumo(self, inicio, fim, transportadora=None):
+        # inicio/fim: 'AAAA-MM-DD' inclusivos. Lê só os agregados em memória.
+        with self._lock:
+            dias = {dia: copy.deepcopy(dados) for dia, dados in self._agregador.dias.items() if inicio <= dia <= fim}
+
+        por_dia = []
+        horas = {}
+        transportadoras = {}
+        permanencia = permanencia_vazia()
+        for dia in sorted(dias):
+            dados = dias[dia]
+            if transportadora is not None:
+                dados = dados['transportadoras'].get(transportadora)
+                if dados is None:
+                    continue
+                transportadoras_dia = {transportadora: dados}
+            else:
+                transportadoras_dia = dados['transportadoras']
+            por_dia.append({'dia': dia,
+                            'entradas': dados['total'].get('Entrada', 0),
+                            'saidas': dados['total'].get('Saída', 0),
+                            'permanencia_media_min': _media(dados['permanencia'])})
+            mesclar(horas, dados['horas'])
+            mesclar(permanencia, dados['permanencia'])
+            for nome, dados_transportadora in transportadoras_dia.items():
+                mesclar(transportadoras.setdefault(nome, {}),
+                        {'total': dados_transportadora['total'], 'permanencia': dados_transportadora['permanencia']})
+
+        por_hora = [{'hora': h,
+                     'entradas': horas.get(f'{h:02d}', {}).get('Entrada', 0),
+                     'saidas': horas.get(f'{h:02d}', {}).get('Saída', 0)} for h in range(24)]
+        pico = max(por_hora, key=lambda h: h['entradas'])
+        ranking = sorted(({'transportadora': nome,
+                           'entradas': dados['total'].get('Entrada', 0),
+                           'saidas': dados['total'].get('Saída', 0),
+                           'permanencia_media_min': _media(dados['permanencia'])}
+                          for nome, dados in transportadoras.items()),
+                         key=lambda t: (-t['entradas'], t['transportadora']))
+        limites = list(BALDES_PERMANENCIA_MIN) + [None]
+        return {
+            'pronto': self.pronto,
+            'inicio': inicio,
+            'fim': fim,
+            'entradas': sum(d['entradas'] for d in por_dia),
+            'saidas': sum(d['saidas'] for d in por_dia),
+            'permanencia': {'media_min': _media(permanencia),
+                            'contagem': permanencia['contagem'],
+                            'baldes': [{'ate_min': limite, 'contagem': contagem}
+                                       for limite, contagem in zip(limites, permanencia['baldes'])]},
+            'hora_pico': pico['hora'] if pico['entradas'] else None,
+            'dias': por_dia,
+            'horas': por_hora,
+            'transportadoras': ranking,
+        }
+
+    # --- Snapshot e reconstrução ---
+
+    def reconstruir(self, armazenamento, fila_gravacao=None):
+        with self._lock:
+            self.pronto = False  # Registros novos ficam em _adiados até o fim
+
+        agregador = Agregador()
+        estado = armazenamento.carregar_estado(NOME_ESTADO)
+        if estado and estado.get('versao') == VERSAO_ESTADO:
+            agregador.dias = armazenamento.carregar_agregados()
+            # Estados de antes da placa canônica têm as placas como digitadas
+            agregador.abertas = {canonica(placa): aberta for placa, aberta in (estado.get('abertas') or {}).items()}
+            geracao = estado.get('geracao')
+            cursor = tuple(estado['cursor']) if estado.get('cursor') else None
+        else:
+            geracao = uuid.uuid4().hex
+            cursor = None
+        # Tudo até o cursor do snapshot já está nos dias restaurados, inclusive registros
+        # que ainda estavam no journal quando o snapshot foi salvo
+        limite = cursor
+        if cursor is None:
+            cursor = (texto_utc(agora_utc()), '')
+            print("Agregados diários sem histórico: contando a partir de agora. "
+                  "Rode recalcular_agregados.py para incluir os registros anteriores.")
+
+        vistos = set()
+        for doc_id, registro in armazenamento.listar(inicio=utc_de_texto(cursor[0])):
+            chave = (texto_utc(horario_utc_de(registro)), doc_id)
+            if chave <= cursor:
+                continue
+            agregador.aplicar(registro)
+            vistos.add(doc_id)
+            cursor = max(cursor, chave)
+        # Registros aceitos pelo modo write-behind que ainda não chegaram ao armazenamento
+        pendentes = fila_gravacao.pendentes() if fila_gravacao is not None else []
+
+        with self._lock:
+            for doc_id, registro in pendentes + [(doc_id, registro) for _, doc_id, registro in self._adiados]:
+                chave = (texto_utc(horario_utc_de(registro)), doc_id)
+                if doc_id in vistos or (limite is not None and chave <= limite):
+                    continue
+                agregador.aplicar(registro)
+                vistos.add(doc_id)
+                cursor = max(cursor, chave)
+            self._adiados = []
+            self._agregador = agregador
+            self.cursor = cursor
+            self.geracao = geracao
+            self.pronto = True
+
+    def salvar(self, armazenamento, fila_gravacao=None):
+        if not self.pronto:
+            return
+        salvo = armazenamento.carregar_estado(NOME_ESTADO)
+        if salvo and salvo.get('geracao') not in (None, self.geracao):
+            print("Agregados diários recalculados fora do app; recarregando.")
+            self.reconstruir(armazenamento, fila_gravacao)
+            return
+        agora = agora_utc()
+        if salvo and salvo.get('instancia') not in (None, self.instancia):
+            salvo_em = salvo.get('salvo_em')
+            if salvo_em and agora - utc_de_texto(salvo_em) < self.validade:
+                print(f"ERRO: outra instância salvou os agregados diários às {salvo_em}; esta não vai gravá-los. "
+                      "O serviço deve rodar com no máximo uma instância (max-instances=1).")
+                return
+            print("Assumindo os agregados diários salvos por outra instância; recarregando.")
+            self.reconstruir(armazenamento, fila_gravacao)
+            salvo = None  # Grava logo em nome desta instância
+
+        with self._lock:
+            alterados = self._agregador.alterados
+            # Sem alterações, o estado só é regravado para renovar o horário antes de vencer
+            renovar = not salvo or not salvo.get('salvo_em') or agora - utc_de_texto(salvo['salvo_em']) >= self.validade / 3
+            if not alterados and not renovar:
+                return
+            self._agregador.alterados = set()
+            self._agregador.podar_abertas(agora_utc())
+            dias = {dia: copy.deepcopy(self._agregador.dias[dia]) for dia in alterados}
+            estado = {'versao': VERSAO_ESTADO, 'geracao': self.geracao,
+                      'instancia': self.instancia, 'salvo_em': texto_utc(agora),
+                      'cursor': list(self.cursor) if self.cursor else None,
+                      'abertas': dict(self._agregador.abertas)}
+        try:
+            # Dias e cursor na mesma gravação: uma queda no meio não conta registros duas vezes
+            armazenamento.salvar_agregados(dias, NOME_ESTADO, estado)
+        except Exception:
+            with self._lock:
+                self._agregador.alterados |= alterados
+            raise
+
+    def iniciar(self, armazenamento, fila_gravacao=None, intervalo_snapshot=60):
+        # Carrega em segundo plano e depois salva um snapshot a cada intervalo_snapshot segundos.
+        # Uma reconstrução que falhou (inclusive após um recálculo externo) é só repetida.
+        self.validade = timedelta(seconds=3 * intervalo_snapshot)
+
+        def loop():
+            while True:
+                try:
+                    if self.pronto:
+                        self.salvar(armazenamento, fila_gravacao)
+                    else:
+                        self.reconstruir(armazenamento, fila_gravacao)
+                except Exception as e:
+                    print(f"Falha ao atualizar os agregados diários: {e}. Nova tentativa em {intervalo_snapshot}s.")
+                time.sleep(intervalo_snapshot)
+
+        threading.Thread(target=loop, name='agregados-diarios', daemon=True).start()
@@ -0,0 +1,137 @@
+import json
+import threading
+import uuid
+from collections import deque
+
+# --- Feed ao vivo dos registros (Server-Sent Events) ---
+# Cada registro aceito é publicado no canal (é um dos indices_registro do app) e
+# entregue a todos os painéis conectados em /api/ao-vivo. Cada assinante tem uma
+# fila limitada: publicar nunca bloqueia, e se um cliente lento deixa a fila
+# encher, os eventos mais antigos dele são descartados e o cliente recebe um evento
+# 'perdidos' com a quantidade, para recarregar o que precisar.
+#
+# O canal guarda os últimos eventos publicados; um cliente que reconecta com
+# Last-Event-ID recebe o que perdeu, se ainda estiver nesse histórico. Os IDs levam
+# a época do processo, então um ID de antes de um reinício é ignorado.
+#
+# O canal é por processo: o app precisa rodar com um único worker (ver gunicorn.conf.py).
+
+TAMANHO_FILA = 100
+TAMANHO_HISTORICO = 200
+MAXIMO_ASSINANTES = 50
+INTERVALO_PING = 15  # Segundos sem eventos até mandar um comentário (mantém proxies e detecta desconexão)
+CAMPOS_EVENTO = ('nome', 'placa', 'ordem', 'tipo', 'Transportadora', 'quilometragem', 'site', 'horario')
+
+
+class Assinatura:
+    def __init__(self, tamanho_fila, site=None):
+        self.site = site
+        self.tamanho_fila = tamanho_fila
+        self.perdidos = 0
+        self.encerrada = False
+        self._fila = deque()
+        self._condicao = threading.Condition()
+
+    def entregar(self, evento):
+        # Chamado por quem publica: nunca bloqueia. Retorna quantos eventos foram descartados.
+        with self._condicao:
+            descartados = 0
+            if len(self._fila) >= self.tamanho_fila:
+                self._fila.popleft()
+                self.perdidos += 1
+                descartados = 1
+            self._fila.append(evento)
+            self._condicao.notify()
+        return descartados
+
+    def proximos(self, timeout):
+        # Espera até haver eventos (ou timeout) e esvazia a fila: (eventos, perdidos desde a última vez)
+        with self._condicao:
+            if not self._fila and not self.encerrada:
+                self._condicao.wait(timeout)
+            eventos = list(self._fila)
+            self._fila.clear()
+            perdidos, self.perdidos = self.perdidos, 0
+        return eventos, perdidos
+
+    def encerrar(self):
+        with self._condicao:
+            self.encerrada = True
+            self._condicao.notify()
+
+
+class CanalAoVivo:
+    def __init__(self, tamanho_fila=TAMANHO_FILA, tamanho_historico=TAMANHO_HISTORICO,
+                 maximo_assinantes=MAXIMO_ASSINANTES):
+        self.tamanho_fila = tamanho_fila
+        self.maximo_assinantes = maximo_assinantes
+        self.epoca = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._assinantes = set()
+        self._historico = deque(maxlen=tamanho_historico)  # (seq, dados)
+        self._seq = 0
+
+        # Contadores expostos em /metrics
+        self.publicados = 0
+        self.descartados = 0
+
+    def aplicar(self, doc_id, registro):
+        dados = {campo: registro[campo] for campo in CAMPOS_EVENTO if registro.get(campo) is not None}
+        dados['doc_id'] = doc_id
+        self.publicar(dados)
+
+    def publicar(self, dados):
+        with self._lock:
+            self._seq += 1
+            evento = (self._seq, dados)
+            self._historico.append(evento)
+            assinantes = list(self._assinantes)
+            self.publicados += 1
+        descartados = sum(a.entregar(evento) for a in assinantes if a.site is None or a.site == dados.get('site'))
+        if descartados:
+            with self._lock:
+                self.descartados += descartados
+
+    def assinar(self, site=None, ultimo_id=None):
+        # Retorna None se o limite de assinantes foi atingido
+        assinatura = Assinatura(self.tamanho_fila, site)
+        epoca, _, seq = (ultimo_id or '').partition('-')
+        with self._lock:
+            if len(self._assinantes) >= self.maximo_assinantes:
+                return None
+            if epoca == self.epoca and seq.isdigit():
+                for evento in self._historico:
+                    if evento[0] > int(seq) and (site is None or site == evento[1].get('site')):
+                        assinatura.entregar(evento)
+            self._assinantes.add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        assinatura.encerrar()
+        with self._lock:
+            self._assinantes.discard(assinatura)
+
+    def total_assinantes(self):
+        with self._lock:
+            return len(self._assinantes)
+
+    def fluxo(self, assinatura, intervalo_ping=INTERVALO_PING):
+        # Corpo da resposta text/event-stream. Quando o cliente desconecta, o servidor
+        # fecha o gerador ao falhar um envio (em geral no primeiro ou segundo ping) e o
+        # finally remove a assinatura.
+        try:
+            yield 'retry: 5000\n\n'
+            while not assinatura.encerrada:
+                eventos, perdidos = assinatura.proximos(intervalo_ping)
+                if not eventos and not perdidos:
+                    yield ': ping\n\n'
+                    continue
+                partes = []
+                if perdidos:
+                    partes.append(f'event: perdidos\ndata: {json.dumps({"quantidade": perdidos})}\n\n')
+                for seq, dados in eventos:
+                    partes.append(f'id: {self.epoca}-{seq}\nevent: registro\n'
+                                  f'data: {json.dumps(dados, ensure_ascii=False, default=str)}\n\n')
+                yield ''.join(partes)
+        finally:
+            self.cancelar(assinatura)
@@ -1,245 +1,637 @@
 import os
-import json
-import firebase_admin
-from firebase_admin import credentials, firestore
-from flask import Flask, render_template, request, jsonify, redirect, url_for, render_template_string # Adicionado render_template_string
-from datetime import datetime
-import pytz
-import re # Adicionado: Importar a biblioteca 're' para expressões regulares
-import math # Adicionado: Importar a biblioteca 'math' para cálculos matemáticos
+from flask import Flask, render_template, request, jsonify, redirect, url_for, g
+import atexit
+import math
+import secrets
+import time
+import uuid
+from datetime import date, timedelta
+from functools import wraps
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from werkzeug.middleware.proxy_fix import ProxyFix
+from admissao import ControleAdmissao, LimitadorTaxa, MonitorLatencia
+from armazenamento import LIMITE_LOTE_FIRESTORE, criar_armazenamento
+from fila_gravacao import FilaGravacao
+from carga_inicial import CargaInicial
+from paginas import PaginaEstatica
+from geofence import Geofence, carregar_sites, ler_coordenadas
+from ocupacao import IndiceOcupacao
+from agregados import IndiceAgregados
+from ao_vivo import CanalAoVivo
+from hodometro import MODOS as MODOS_HODOMETRO, IndiceHodometro, descrever as descrever_hodometro
+from perfis import CachePerfis
+from placas import DISTANCIA_MAXIMA as DISTANCIA_MAXIMA_PLACAS, IndicePlacas, canonica
+from sugestoes import CAMPOS as CAMPOS_SUGESTAO, LIMITE_MAXIMO as LIMITE_MAXIMO_SUGESTOES, Sugestoes
+from exportacao import gerar_csv, gerar_ndjson, ler_limite
+from horarios import FUSO, agora_utc
+import metricas
+from idempotencia import CacheDeduplicacao
+from validacao import montar_registro, normalizar, validar, validar_horario
 
 # --- Inicialização do Flask ---
 app = Flask(__name__)
-
-# --- Inicialização do Firebase Firestore ---
-if not firebase_admin._apps:
-    try:
-        service_account_json = os.environ.get('FIREBASE_SERVICE_ACCOUNT_KEY')
-        if service_account_json:
-            cred_dict = json.loads(service_account_json)
-            cred = credentials.Certificate(cred_dict)
-            firebase_admin.initialize_app(cred)
-            print("Firebase inicializado com sucesso via variável de ambiente!")
-        else:
-            if os.path.exists("serviceAccountKey.json"):
-                cred = credentials.Certificate("serviceAccountKey.json")
-                firebase_admin.initialize_app(cred)
-                print("Firebase inicializado com sucesso via arquivo local (APENAS PARA DESENVOLVIMENTO)!")
-            else:
-                print("ERRO CRÍTICO: Variável de ambiente 'FIREBASE_SERVICE_ACCOUNT_KEY' não encontrada e 'serviceAccountKey.json' não existe.")
-                print("Não é possível inicializar o Firebase. Verifique a configuração do Cloud Run ou o arquivo local.")
-                exit(1)
-
-    except Exception as e:
-        print(f"ERRO FATAL: Falha ao inicializar o Firebase/Firestore. Detalhes: {e}")
+# Atrás do Cloud Run o IP do cliente e o esquema (https) chegam em X-Forwarded-For/-Proto;
+# PROXIES_CONFIAVEIS diz quantos proxies confiáveis há na frente (0 sem proxy), para o
+# cliente não forjar o próprio IP.
+PROXIES_CONFIAVEIS = int(os.environ.get('PROXIES_CONFIAVEIS', '1'))
+if PROXIES_CONFIAVEIS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXIES_CONFIAVEIS, x_proto=PROXIES_CONFIAVEIS)
+
+# Chave dos cookies assinados. Sem SECRET_KEY, uma chave aleatória por processo: os cookies
+# deixam de valer a cada reinício e não são reconhecidos por outras instâncias.
+app.secret_key = os.environ.get('SECRET_KEY')
+if not app.secret_key:
+    app.secret_key = secrets.token_hex(32)
+    print("AVISO: SECRET_KEY não definida; usando uma chave temporária (o preenchimento pelo cookie não sobrevive a reinícios).")
+
+# --- Inicialização do armazenamento (Firestore ou SQLite local, ver armazenamento.py) ---
+armazenamento = criar_armazenamento()
+
+# --- Modo write-behind (opcional) ---
+# Com WRITE_BEHIND=1 os registros vão para um journal local e são enviados ao armazenamento
+# em lotes por uma thread em segundo plano, sem bloquear a requisição do motorista.
+# JOURNAL_PATH é obrigatório: o journal guarda registros já confirmados ao motorista e
+# precisa estar num disco local persistente que sobreviva ao contêiner (ex: disco
+# permanente de uma VM do Compute Engine ou PersistentVolume ReadWriteOnce no GKE). O
+# journal é SQLite em modo WAL, que depende de locks de arquivo e de memória compartilhada:
+# não use sistemas de arquivos de rede (NFS, Filestore, GCS FUSE/Cloud Storage), onde o
+# banco pode corromper. No Cloud Run não há disco desse tipo (o sistema de arquivos do
+# contêiner fica em memória e os volumes são de rede), então lá use WRITE_BEHIND=0.
+fila_gravacao = None
+if os.environ.get('WRITE_BEHIND', '0') == '1':
+    if not os.environ.get('JOURNAL_PATH'):
+        print("ERRO CRÍTICO: WRITE_BEHIND=1 exige JOURNAL_PATH apontando para um disco persistente.")
         exit(1)
-
-# Apenas inicialize o cliente Firestore UMA VEZ, após o app Firebase ser inicializado
-db = firestore.client() 
-print("Firestore client inicializado.")
-
-
-# Função para calcular distância (Haversine)
-def calcular_distancia(lat1, lon1, lat2, lon2):
-    R = 6371000 # Raio da Terra em metros
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-    a = math.sin(delta_phi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
-# --- Rota Principal com HTML incorporado ---
+    if os.environ.get('K_SERVICE'):
+        print("AVISO: WRITE_BEHIND=1 no Cloud Run: não há disco local persistente para o journal, e "
+              "registros confirmados podem se perder quando a instância parar.")
+    fila_gravacao = FilaGravacao(armazenamento, os.environ['JOURNAL_PATH'])
+    fila_gravacao.iniciar()
+    atexit.register(fila_gravacao.parar)
+    print("Modo write-behind ativo: registros serão enviados ao armazenamento em lotes.")
+
+
+# --- Geofence: pátios carregados de sites.json (ou SITES_CONFIG) ---
+# GEOFENCE_ATIVO=0 desliga a validação no servidor (útil só em desenvolvimento).
+geofence = Geofence(carregar_sites())
+GEOFENCE_ATIVO = os.environ.get('GEOFENCE_ATIVO', '1') == '1'
+
+# --- Índice dos veículos que estão no pátio agora (ver ocupacao.py) ---
+ocupacao = IndiceOcupacao()
+ocupacao.iniciar(armazenamento, fila_gravacao,
+                 janela_dias=int(os.environ.get('OCUPACAO_JANELA_DIAS', '3')),
+                 intervalo_snapshot=int(os.environ.get('OCUPACAO_SNAPSHOT_SEGUNDOS', '60')))
+
+# --- Carga inicial de sugestões, perfis, placas e hodômetro (ver carga_inicial.py) ---
+# Uma leitura só, na maior das janelas; os registros aceitos chegam a esses índices pela
+# carga, que fica em indices_registro no lugar deles.
+carga_inicial = CargaInicial(armazenamento, fila_gravacao)
+
+# --- Sugestões de motorista, placa e transportadora para o formulário (ver sugestoes.py) ---
+sugestoes = Sugestoes()
+sugestoes.iniciar(carga_inicial, janela_dias=int(os.environ.get('SUGESTOES_JANELA_DIAS', '180')))
+
+# --- Perfis de motorista para preencher o formulário (ver perfis.py) ---
+# O aparelho guarda a placa do último registro num cookie assinado; o perfil vem do
+# cache em memória, atualizado a cada registro aceito. Uma placa é fácil de adivinhar,
+# então o perfil completo (com o nome) só sai para o aparelho cuja placa está no cookie
+# ou com a credencial de API_TOKEN; para os outros, só a transportadora.
+perfis = CachePerfis(tamanho_maximo=int(os.environ.get('PERFIS_TAMANHO_MAXIMO', '20000')),
+                     ttl_dias=int(os.environ.get('PERFIS_TTL_DIAS', '30')))
+perfis.iniciar(carga_inicial)
+COOKIE_PERFIL = 'perfil_motorista'
+DURACAO_COOKIE_PERFIL = 90 * 24 * 3600
+assinador_perfil = URLSafeTimedSerializer(app.secret_key, salt='perfil-motorista')
+
+def placa_do_cookie():
+    valor = request.cookies.get(COOKIE_PERFIL)
+    if not valor:
+        return None
+    try:
+        return assinador_perfil.loads(valor, max_age=DURACAO_COOKIE_PERFIL)
+    except BadSignature:
+        return None
+
+def buscar_perfil(placa):
+    if not placa:
+        return None
+    perfil = perfis.buscar(placa)
+    metricas.consultas_perfil.inc(resultado='encontrado' if perfil else 'ausente')
+    if perfil is not None and canonica(placa) != placa_do_cookie() and not credencial_valida():
+        perfil = {'Transportadora': perfil['Transportadora']}
+    return perfil
+
+# --- Placas conhecidas para busca aproximada (ver placas.py) ---
+placas = IndicePlacas()
+placas.iniciar(carga_inicial, janela_dias=int(os.environ.get('PLACAS_JANELA_DIAS', '365')))
+
+# --- Consistência do hodômetro por placa (ver hodometro.py) ---
+# HODOMETRO_MODO: sinalizar (padrão: grava o registro marcado com 'hodometro_alerta'),
+# rejeitar (recusa como erro de validação) ou desligado.
+HODOMETRO_MODO = os.environ.get('HODOMETRO_MODO', 'sinalizar')
+if HODOMETRO_MODO not in MODOS_HODOMETRO:
+    print(f"ERRO CRÍTICO: HODOMETRO_MODO '{HODOMETRO_MODO}' desconhecido. Use um de: {', '.join(MODOS_HODOMETRO)}.")
+    exit(1)
+hodometro = IndiceHodometro(velocidade_maxima=float(os.environ.get('HODOMETRO_VELOCIDADE_MAXIMA_KMH', '120')),
+                            tolerancia_km=float(os.environ.get('HODOMETRO_TOLERANCIA_KM', '50')))
+hodometro.iniciar(carga_inicial, janela_dias=int(os.environ.get('HODOMETRO_JANELA_DIAS', '180')))
+carga_inicial.iniciar()
+
+def conferir_hodometro(campos, momento):
+    # Retorna (motivo, mensagem, campos extras do registro); com motivo, o envio é recusado
+    if HODOMETRO_MODO == 'desligado' or not campos['quilometragem']:
+        return None, None, {}
+    km = int(campos['quilometragem'])
+    motivo, referencia = hodometro.conferir(canonica(campos['placa']), km, momento)
+    if motivo is None:
+        return None, None, {}
+    if HODOMETRO_MODO == 'rejeitar':
+        metricas.alertas_hodometro.inc(motivo=motivo, acao='rejeitado')
+        return f'hodometro_{motivo}', descrever_hodometro(motivo, km, referencia), {}
+    metricas.alertas_hodometro.inc(motivo=motivo, acao='sinalizado')
+    return None, None, {'hodometro_alerta': motivo, 'hodometro_anterior': referencia['km']}
+
+# --- Agregados diários para o painel de gestão (ver agregados.py) ---
+agregados = IndiceAgregados()
+agregados.iniciar(armazenamento, fila_gravacao,
+                  intervalo_snapshot=int(os.environ.get('AGREGADOS_SNAPSHOT_SEGUNDOS', '60')))
+
+# --- Feed ao vivo (SSE) para os painéis da portaria (ver ao_vivo.py) ---
+canal_ao_vivo = CanalAoVivo(tamanho_fila=int(os.environ.get('AO_VIVO_FILA', '100')),
+                            maximo_assinantes=int(os.environ.get('AO_VIVO_MAXIMO_CLIENTES', '50')))
+
+# --- Deduplicação de envios repetidos (toque duplo, reenvio do navegador) ---
+deduplicacao = CacheDeduplicacao(janela=int(os.environ.get('DEDUP_JANELA_SEGUNDOS', '120')))
+
+# --- Controle de admissão das rotas de gravação (ver admissao.py) ---
+# Por rota: ADMISSAO_<ROTA>_POR_MINUTO e _RAJADA (balde por IP; 0 desliga) e
+# _EM_ANDAMENTO (máximo de requisições simultâneas; 0 desliga). ADMISSAO_LATENCIA_MAXIMA_MS
+# vale para todas: acima dela (média das gravações de /registrar; os lotes de até 500
+# documentos não são comparáveis), as rotas respondem 503.
+# Motoristas no Wi-Fi da portaria ou atrás do NAT da operadora saem pelo mesmo IP, e
+# numa troca de turno dezenas deles se registram no mesmo minuto: o balde por IP de
+# /registrar só segura um cliente em loop. A proteção do armazenamento fica com
+# _EM_ANDAMENTO e a latência.
+monitor_gravacao = MonitorLatencia()
+LATENCIA_MAXIMA_GRAVACAO = float(os.environ.get('ADMISSAO_LATENCIA_MAXIMA_MS', '2000')) / 1000
+
+def controle_de_ambiente(rota, por_minuto, rajada, em_andamento):
+    por_minuto = float(os.environ.get(f'ADMISSAO_{rota}_POR_MINUTO', por_minuto))
+    rajada = int(os.environ.get(f'ADMISSAO_{rota}_RAJADA', rajada))
+    return ControleAdmissao(limitador=LimitadorTaxa(por_minuto, rajada) if por_minuto > 0 else None,
+                            em_andamento_maximo=int(os.environ.get(f'ADMISSAO_{rota}_EM_ANDAMENTO', em_andamento)),
+                            monitor=monitor_gravacao, latencia_maxima=LATENCIA_MAXIMA_GRAVACAO)
+
+admissao_registrar = controle_de_ambiente('REGISTRAR', por_minuto=600, rajada=120, em_andamento=40)
+admissao_lote = controle_de_ambiente('LOTE', por_minuto=12, rajada=6, em_andamento=4)
+
+MENSAGENS_ADMISSAO = {
+    'taxa': 'Muitos envios seguidos. Aguarde alguns segundos e tente novamente.',
+    'latencia': 'O sistema está sobrecarregado. Aguarde alguns segundos e tente novamente.',
+    'em_andamento': 'O sistema está sobrecarregado. Aguarde alguns segundos e tente novamente.',
+}
+
+def admitir(controle):
+    # Aplica o controle aos POSTs da rota; GETs (ex: o formulário de /registrar) passam direto
+    def decorador(funcao):
+        @wraps(funcao)
+        def rota_controlada(*args, **kwargs):
+            if request.method != 'POST':
+                return funcao(*args, **kwargs)
+            motivo, espera = controle.entrar(request.remote_addr or 'desconhecido')
+            if motivo is not None:
+                metricas.recusas_admissao.inc(rota=request.url_rule.rule, motivo=motivo)
+                status = 429 if motivo == 'taxa' else 503
+                if request.is_json:
+                    resposta = jsonify({'erro': MENSAGENS_ADMISSAO[motivo], 'motivo': motivo})
+                    resposta.status_code = status
+                else:
+                    resposta = app.response_class(MENSAGENS_ADMISSAO[motivo], status=status,
+                                                  content_type='text/plain; charset=utf-8')
+                resposta.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+                resposta.headers['Cache-Control'] = 'no-store'
+                return resposta
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                controle.sair()
+        return rota_controlada
+    return decorador
+
+# --- Credencial das rotas que listam registros (exportação, pátio, feed ao vivo, placas) ---
+# Elas expõem nome, placa e transportadora dos motoristas. Exigem o token de API_TOKEN em
+# 'Authorization: Bearer <token>' ou em ?token= (o EventSource da página /ao-vivo não
+# envia cabeçalhos; a página repassa o ?token= do próprio endereço). Sem API_TOKEN as
+# rotas ficam desligadas.
+API_TOKEN = os.environ.get('API_TOKEN', '')
+if not API_TOKEN:
+    print("AVISO: API_TOKEN não definido; exportação, pátio e feed ao vivo ficam desligados.")
+
+def credencial_valida():
+    if not API_TOKEN:
+        return False
+    autorizacao = request.headers.get('Authorization', '')
+    token = autorizacao[7:] if autorizacao.startswith('Bearer ') else request.args.get('token', '')
+    return secrets.compare_digest(token.encode(), API_TOKEN.encode())
+
+def exigir_token(funcao):
+    @wraps(funcao)
+    def rota_protegida(*args, **kwargs):
+        if not API_TOKEN:
+            return jsonify({'erro': 'Rota desligada: defina API_TOKEN no servidor.'}), 503
+        if not credencial_valida():
+            resposta = jsonify({'erro': 'Credencial ausente ou inválida.'})
+            resposta.status_code = 401
+            resposta.headers['WWW-Authenticate'] = 'Bearer'
+            return resposta
+        return funcao(*args, **kwargs)
+    return rota_protegida
+
+# --- Índices em memória atualizados a cada registro aceito ---
+indices_registro = [ocupacao, carga_inicial, agregados, canal_ao_vivo]
+
+def publicar_registro(doc_id, registro):
+    for indice in indices_registro:
+        try:
+            indice.aplicar(doc_id, registro)
+        except Exception as e:
+            # O registro já foi gravado; um índice com problema não pode derrubar a resposta
+            print(f"Falha ao atualizar índice {type(indice).__name__}: {e}")
+
+# --- Instrumentação: latência por rota, requisições em andamento e /metrics ---
+# PERFIL_LENTO_MS liga o amostrador de pilhas para requisições mais lentas que o limite.
+amostrador_lento = None
+if os.environ.get('PERFIL_LENTO_MS'):
+    amostrador_lento = metricas.AmostradorLento(float(os.environ['PERFIL_LENTO_MS']))
+
+@app.before_request
+def inicio_requisicao():
+    g.inicio_requisicao = time.perf_counter()
+    metricas.em_andamento.inc()
+    if amostrador_lento is not None:
+        amostrador_lento.iniciar_requisicao()
+
+@app.after_request
+def registrar_metricas_requisicao(resposta):
+    # Rota pelo padrão (ex: /registrar), nunca pela URL crua, para não explodir a cardinalidade
+    rota = request.url_rule.rule if request.url_rule else 'nao_encontrada'
+    metricas.requisicoes.inc(rota=rota, metodo=request.method, status=resposta.status_code)
+    metricas.duracao_requisicao.observar(time.perf_counter() - g.inicio_requisicao, rota=rota, metodo=request.method)
+    return resposta
+
+@app.teardown_request
+def fim_requisicao(erro=None):
+    metricas.em_andamento.dec()
+    if amostrador_lento is not None:
+        amostrador_lento.finalizar_requisicao(f'{request.method} {request.path}',
+                                              time.perf_counter() - g.inicio_requisicao)
+
+profundidade_fila = metricas.REGISTRO.medidor('motoristas_fila_profundidade', 'Registros no journal aguardando envio.')
+gravados_fila = metricas.REGISTRO.medidor('motoristas_fila_gravados', 'Registros enviados pela fila desde o início.')
+falhas_fila = metricas.REGISTRO.medidor('motoristas_fila_falhas', 'Lotes da fila que falharam desde o início.')
+latencia_fila = metricas.REGISTRO.medidor('motoristas_fila_ultima_latencia_segundos', 'Duração do último lote enviado.')
+veiculos_patio = metricas.REGISTRO.medidor('motoristas_patio_veiculos', 'Veículos no pátio agora.')
+clientes_ao_vivo = metricas.REGISTRO.medidor('motoristas_ao_vivo_clientes', 'Painéis conectados ao feed ao vivo.')
+latencia_gravacao = metricas.REGISTRO.medidor('motoristas_admissao_latencia_gravacao_segundos',
+                                              'Média móvel da latência de gravação usada no descarte de carga.')
+descartados_ao_vivo = metricas.REGISTRO.medidor('motoristas_ao_vivo_descartados',
+                                                 'Eventos do feed ao vivo descartados por clientes lentos desde o início.')
+
+@metricas.REGISTRO.coletor
+def coletar_estado():
+    veiculos_patio.definir(ocupacao.total())
+    clientes_ao_vivo.definir(canal_ao_vivo.total_assinantes())
+    descartados_ao_vivo.definir(canal_ao_vivo.descartados)
+    latencia_gravacao.definir(round(monitor_gravacao.latencia(), 4))
+    if fila_gravacao is not None:
+        profundidade_fila.definir(fila_gravacao.profundidade())
+        gravados_fila.definir(fila_gravacao.gravados)
+        falhas_fila.definir(fila_gravacao.falhas)
+        latencia_fila.definir(fila_gravacao.ultima_latencia_flush)
+
+@app.route('/metrics')
+def metrics():
+    return app.response_class(metricas.REGISTRO.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# --- Páginas geradas uma vez na inicialização (templates/), servidas pré-comprimidas ---
+with app.app_context():
+    pagina_index = PaginaEstatica(app.jinja_env.get_template('index.html').render())
+    pagina_pergunta = PaginaEstatica(app.jinja_env.get_template('pergunta.html').render())
+    # A página de sucesso é resposta de POST: nunca é cacheada, mas também não passa pelo Jinja
+    pagina_sucesso = PaginaEstatica(app.jinja_env.get_template('sucesso.html').render())
+    pagina_ao_vivo = PaginaEstatica(app.jinja_env.get_template('ao_vivo.html').render())
+    # Compila o formulário de registro agora, e não no primeiro acesso
+    app.jinja_env.get_template('registro.html')
+
+# --- Rota Principal ---
 @app.route('/')
 def index():
-    return '''
-    <!DOCTYPE html>
-    <html lang="pt-BR">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Controle de Motoristas</title>
-        <style>
-            body {
-                margin: 0; padding: 0;
-                background-image: url('https://th.bing.com/th/id/R.187389868a8f8afba4822c152da9f40e?rik=w1Cy2wzxOuD6%2bQ&pid=ImgRaw&r=0');
-                background-size: cover; background-position: center;
-                height: 100vh; display: flex; justify-content: center; align-items: center;
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; color: white;
-                overflow: hidden; /* Evita scroll desnecessário */
-            }
-            .content {
-                background: rgba(0, 0, 0, 0.8); /* Fundo mais escuro para melhor contraste */
-                padding: 40px;
-                border-radius: 12px;
-                text-align: center;
-                box-shadow: 0 8px 16px rgba(0, 0, 0, 0.4); /* Sombra para profundidade */
-                animation: slideIn 0.8s ease-out; /* Animação de entrada */
-            }
-            @keyframes slideIn {
-                from { opacity: 0; transform: translateY(50px); }
-                to { opacity: 1; transform: translateY(0); }
-            }
-            h1 {
-                font-size: 2.8em;
-                margin-bottom: 15px;
-                color: #FFD700; /* Dourado */
-            }
-            p {
-                font-size: 1.1em;
-                margin-bottom: 30px;
-            }
-            button {
-                padding: 15px 35px;
-                background-color: #FFA500; /* Laranja vibrante */
-                color: #333; /* Texto escuro */
-                font-size: 1.3em;
-                font-weight: bold;
-                border: none;
-                border-radius: 30px;
-                cursor: pointer;
-                transition: transform 0.3s ease, background-color 0.3s ease; /* Transição suave */
-                box-shadow: 0 4px 8px rgba(0, 0, 0, 0.3);
-            }
-            button:hover {
-                transform: scale(1.05); /* Leve aumento no hover */
-                background-color: #FF8C00; /* Laranja mais escuro */
-            }
-            #mensagem {
-                color: #FF6347; /* Tomate */
-                margin-top: 20px;
-                font-weight: bold;
-                font-size: 1.1em;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="content">
-            <h1>Controle de Motoristas</h1>
-            <p>Registre a entrada ou saída da frota de forma rápida e segura.</p>
-            <button onclick="verificarLocalizacao()">Clique aqui para iniciar</button>
-            <p id="mensagem"></p>
-        </div>
-        <script>
-            function verificarLocalizacao() {
-                document.getElementById('mensagem').innerText = "Obtendo sua localização...";
-                if (!navigator.geolocation) {
-                    document.getElementById('mensagem').innerText = "Seu navegador não suporta geolocalização. Por favor, utilize um navegador moderno.";
-                    return;
-                }
-
-                navigator.geolocation.getCurrentPosition(function(pos) {
-                    const userLat = pos.coords.latitude;
-                    const userLon = pos.coords.longitude;
-
-                    // Coordenadas de referência (atualizadas para Itapevi/SP, conforme sua localização)
-                    // Você pode ajustar essas coordenadas para o ponto exato da sua portaria/local de controle.
-                    const refLat = -23.516185; 
-                    const refLon = -46.965741; 
-
-                    const R = 6371000; // Raio da Terra em metros
-                    const toRad = angle => angle * Math.PI / 180;
-
-                    const dLat = toRad(refLat - userLat);
-                    const dLon = toRad(refLon - userLon);
-                    const a = Math.sin(dLat / 2) ** 2 + Math.cos(toRad(userLat)) * Math.cos(toRad(refLat)) * Math.sin(dLon / 2) ** 2;
-                    const c = 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1 - a));
-                    const distancia = R * c;
-
-                    const raioPermitido = 300; // Distância em metros (300m de raio)
-
-                    if (distancia <= raioPermitido) {
-                        window.location.href = "/pergunta";
-                    } else {
-                        document.getElementById('mensagem').innerText = "Você está fora da área permitida. Distância: " + distancia.toFixed(0) + " metros.";
-                    }
-                }, function(error) {
-                    let errorMessage = "Erro ao obter localização.";
-                    switch(error.code) {
-                        case error.PERMISSION_DENIED:
-                            errorMessage += " Permissão negada. Ative a localização nas configurações do seu navegador.";
-                            break;
-                        case error.POSITION_UNAVAILABLE:
-                            errorMessage += " Localização indisponível. Tente novamente mais tarde.";
-                            break;
-                        case error.TIMEOUT:
-                            errorMessage += " Tempo limite excedido. Verifique sua conexão ou tente novamente.";
-                            break;
-                        case error.UNKNOWN_ERROR:
-                            errorMessage += " Erro desconhecido. Por favor, tente novamente.";
-                            break;
-                    }
-                    document.getElementById('mensagem').innerText = errorMessage;
-                }, { enableHighAccuracy: true, timeout: 10000, maximumAge: 0 }); // Opções para melhor precisão
-            }
-        </script>
-    </body>
-    </html>
-    '''
-
-# --- Rota para a pergunta "Entrada ou Saída" com HTML incorporado ---
+    return pagina_index.resposta(app.response_class, request)
+
+# --- Saúde / prontidão para o Cloud Run e balanceadores ---
+# Não é /healthz: o Cloud Run reserva os caminhos terminados em 'z' e não os repassa ao app.
+# Responde só com o estado em memória: nunca acessa o armazenamento, então é barato e
+# não falha nem fica lento junto com o Firestore. Os índices podem ainda estar carregando
+# em segundo plano; o app já atende registros normalmente nesse período.
+@app.route('/saude')
+def saude():
+    resposta = jsonify({
+        'status': 'ok',
+        'armazenamento': armazenamento.nome,
+        'armazenamento_inicializado': armazenamento.inicializado,
+        'indices': {'ocupacao': ocupacao.pronto, 'sugestoes': sugestoes.pronto, 'placas': placas.pronto,
+                    'perfis': perfis.pronto, 'hodometro': hodometro.pronto, 'agregados': agregados.pronto},
+    })
+    resposta.headers['Cache-Control'] = 'no-store'
+    return resposta
+
+# --- Estado da fila de gravação (write-behind) ---
+# Protegido por API_TOKEN: 'ultimo_erro' traz o texto da exceção do armazenamento.
+@app.route('/fila/status')
+@exigir_token
+def fila_status():
+    if fila_gravacao is None:
+        return jsonify({'ativo': False})
+    return jsonify(dict(ativo=True, **fila_gravacao.estatisticas()))
+
+# --- Verificação de localização usada pela página inicial ---
+@app.route('/geofence/verificar')
+def geofence_verificar():
+    coordenadas = ler_coordenadas(request.args.get('lat'), request.args.get('lon'))
+    if coordenadas is None:
+        return jsonify({'erro': 'Coordenadas inválidas.'}), 400
+    site = geofence.localizar(*coordenadas)
+    if site is not None:
+        return jsonify({'dentro': True, 'site': site.id, 'nome': site.nome,
+                        'distancia': site.distancia(*coordenadas)})
+    mais_proximo, distancia = geofence.mais_proximo(*coordenadas)
+    return jsonify({'dentro': False, 'site': mais_proximo.id, 'distancia': distancia})
+
+# --- Veículos no pátio agora ---
+@app.route('/api/patio')
+@exigir_token
+def api_patio():
+    veiculos = ocupacao.veiculos(site=request.args.get('site') or None)
+    return jsonify({'pronto': ocupacao.pronto, 'total': len(veiculos), 'veiculos': veiculos})
+
+# --- Feed ao vivo: página da portaria e o fluxo SSE que ela consome ---
+# Ex: /ao-vivo?site=itapevi&token=... (ver exigir_token). Cada conexão ocupa uma thread
+# do worker enquanto durar.
+@app.route('/ao-vivo')
+def ao_vivo():
+    return pagina_ao_vivo.resposta(app.response_class, request)
+
+@app.route('/api/ao-vivo')
+@exigir_token
+def api_ao_vivo():
+    assinatura = canal_ao_vivo.assinar(site=request.args.get('site') or None,
+                                       ultimo_id=request.headers.get('Last-Event-ID'))
+    if assinatura is None:
+        return jsonify({'erro': 'Limite de painéis conectados atingido. Tente novamente mais tarde.'}), 503
+    resposta = app.response_class(canal_ao_vivo.fluxo(assinatura), content_type='text/event-stream; charset=utf-8',
+                                  headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+    # Garante a remoção mesmo se o cliente sair antes do gerador começar
+    resposta.call_on_close(lambda: canal_ao_vivo.cancelar(assinatura))
+    return resposta
+
+# --- Painel: caminhões por dia, hora e transportadora e permanência no pátio ---
+# Lê só os agregados diários. Ex: /api/painel?inicio=2024-05-01&fim=2024-05-31&transportadora=X
+# Sem datas, mostra os últimos 7 dias. Exige API_TOKEN, como /api/patio.
+PAINEL_MAXIMO_DIAS = 366
+
+@app.route('/api/painel')
+@exigir_token
+def api_painel():
+    hoje = agora_utc().astimezone(FUSO).date()
+    try:
+        inicio = date.fromisoformat(request.args.get('inicio') or (hoje - timedelta(days=6)).isoformat())
+        fim = date.fromisoformat(request.args.get('fim') or hoje.isoformat())
+    except ValueError:
+        return jsonify({'erro': 'Datas devem estar no formato AAAA-MM-DD.'}), 400
+    if fim < inicio or (fim - inicio).days >= PAINEL_MAXIMO_DIAS:
+        return jsonify({'erro': f"Período inválido: o fim deve ser depois do início e cobrir até {PAINEL_MAXIMO_DIAS} dias."}), 400
+    transportadora = request.args.get('transportadora', '').upper().strip() or None
+    resposta = jsonify(agregados.resumo(inicio.isoformat(), fim.isoformat(), transportadora))
+    resposta.headers['Cache-Control'] = 'private, max-age=30'
+    return resposta
+
+# --- Exportação de registros (CSV ou NDJSON em streaming) ---
+# Ex: /api/registros/exportar?formato=csv&inicio=2024-05-01&fim=2024-05-31&transportadora=X&placa=ABC1234,
+# com 'Authorization: Bearer <API_TOKEN>'
+@app.route('/api/registros/exportar')
+@exigir_token
+def exportar_registros():
+    formato = request.args.get('formato', 'csv').lower()
+    if formato not in ('csv', 'ndjson'):
+        return jsonify({'erro': "Formato inválido. Use 'csv' ou 'ndjson'."}), 400
+    try:
+        inicio = ler_limite(request.args.get('inicio'))
+        fim = ler_limite(request.args.get('fim'), fim=True)
+    except ValueError:
+        return jsonify({'erro': 'Datas devem estar no formato AAAA-MM-DD ou AAAA-MM-DD HH:MM:SS.'}), 400
+
+    filtros = {}
+    if request.args.get('transportadora', '').strip():
+        filtros['Transportadora'] = request.args['transportadora'].upper().strip()
+    if request.args.get('placa', '').strip():
+        filtros['placa_canonica'] = canonica(request.args['placa'])
+
+    registros = armazenamento.listar(inicio=inicio, fim=fim, filtros=filtros)
+    if formato == 'csv':
+        corpo, content_type = gerar_csv(registros), 'text/csv; charset=utf-8'
+    else:
+        corpo, content_type = gerar_ndjson(registros), 'application/x-ndjson; charset=utf-8'
+    return app.response_class(corpo, content_type=content_type, headers={
+        'Content-Disposition': f'attachment; filename=registros.{formato}',
+        'Cache-Control': 'no-store',
+    })
+
+# --- Sugestões para o formulário (autocomplete) ---
+# Ex: /api/sugestoes?campo=placa&prefixo=ABC&limite=8
+@app.route('/api/sugestoes')
+def api_sugestoes():
+    campo = request.args.get('campo', '')
+    if campo not in CAMPOS_SUGESTAO:
+        return jsonify({'erro': f"Campo inválido. Use um de: {', '.join(CAMPOS_SUGESTAO)}."}), 400
+    try:
+        limite = min(max(int(request.args.get('limite', 8)), 1), LIMITE_MAXIMO_SUGESTOES)
+    except ValueError:
+        return jsonify({'erro': 'Limite deve ser um número inteiro.'}), 400
+    resposta = jsonify({'campo': campo, 'sugestoes': sugestoes.buscar(campo, request.args.get('prefixo'), limite)})
+    resposta.headers['Cache-Control'] = 'private, max-age=30'
+    return resposta
+
+# --- Busca aproximada de placas (digitação errada, formato antigo x Mercosul) ---
+# Ex: /api/placas/semelhantes?placa=ABC1D34&distancia=1, com a credencial (lista placas conhecidas)
+@app.route('/api/placas/semelhantes')
+@exigir_token
+def api_placas_semelhantes():
+    placa = request.args.get('placa', '')
+    if not canonica(placa):
+        return jsonify({'erro': 'Informe a placa.'}), 400
+    try:
+        distancia = min(max(int(request.args.get('distancia', 1)), 0), DISTANCIA_MAXIMA_PLACAS)
+        limite = min(max(int(request.args.get('limite', 10)), 1), 50)
+    except ValueError:
+        return jsonify({'erro': 'Distância e limite devem ser números inteiros.'}), 400
+    resposta = jsonify({'placa_canonica': canonica(placa), 'distancia': distancia,
+                        'semelhantes': placas.semelhantes(placa, distancia, limite)})
+    resposta.headers['Cache-Control'] = 'private, max-age=30'
+    return resposta
+
+# --- Perfil do motorista pela placa (preenche nome e transportadora no formulário) ---
+# Ex: /api/perfil?placa=ABC1234. Sem o cookie da placa nem a credencial, só a transportadora.
+@app.route('/api/perfil')
+def api_perfil():
+    perfil = buscar_perfil(request.args.get('placa', ''))
+    if perfil is None:
+        return jsonify({'erro': 'Nenhum registro recente para esta placa.'}), 404
+    resposta = jsonify(perfil)
+    resposta.headers['Cache-Control'] = 'private, max-age=30'
+    return resposta
+
+# --- Sincronização em lote (tablets da portaria que coletaram registros offline) ---
+# POST JSON: {"dispositivo": "tablet-portaria-1", "registros": [{"id": "...", "horario": "2024-05-01T08:00:00-03:00",
+#   "nome": ..., "placa": ..., "ordem": ..., "tipo": "Entrada", "Transportadora": ..., "quilometragem": ...,
+#   "latitude": ..., "longitude": ...}, ...]}
+# Todos os itens são validados com as regras de /registrar antes de qualquer gravação; os aceitos
+# são gravados em lotes de até 500 (WriteBatch no Firestore) e a resposta traz o resultado de cada
+# item na ordem recebida. Com 'dispositivo' e 'id' o ID do documento é fixo, então reenviar o lote
+# depois de um timeout não duplica: o item já gravado volta como 'repetido'. Itens com status
+# 'falha' podem ser reenviados.
+LOTE_MAXIMO = int(os.environ.get('LOTE_MAXIMO', '1000'))
+LOTE_IDADE_MAXIMA_DIAS = int(os.environ.get('LOTE_IDADE_MAXIMA_DIAS', '30'))  # Horário mais antigo aceito
+TOLERANCIA_RELOGIO = timedelta(minutes=5)  # Relógio do tablet um pouco adiantado
+
+@app.route('/api/registros/lote', methods=['POST'])
+@admitir(admissao_lote)
+def registrar_lote():
+    corpo = request.get_json(silent=True)
+    if not isinstance(corpo, dict) or not isinstance(corpo.get('registros'), list):
+        return jsonify({'erro': "O corpo deve ser um objeto JSON com a lista 'registros'."}), 400
+    if len(corpo['registros']) > LOTE_MAXIMO:
+        return jsonify({'erro': f"No máximo {LOTE_MAXIMO} registros por lote."}), 413
+    dispositivo = str(corpo.get('dispositivo') or '').strip()
+
+    agora = agora_utc()
+    horario_minimo = agora - timedelta(days=LOTE_IDADE_MAXIMA_DIAS)
+    horario_maximo = agora + TOLERANCIA_RELOGIO
+
+    # Uma passada valida e normaliza tudo; nada é gravado antes dela terminar
+    resultados = []
+    aceitos = []  # (resultado, doc_id, registro, chaves de deduplicação)
+    ids_fixos = set()  # doc_ids derivados de dispositivo + id local
+    for indice, item in enumerate(corpo['registros']):
+        resultado = {'indice': indice}
+        resultados.append(resultado)
+        if not isinstance(item, dict):
+            resultado.update(status='invalido', motivo='item_invalido', mensagem='Cada registro deve ser um objeto JSON.')
+            metricas.falhas_validacao.inc(motivo='item_invalido')
+            continue
+        id_local = str(item['id']) if item.get('id') is not None else None
+        if id_local is not None:
+            resultado['id'] = id_local
+
+        campos = normalizar(item)
+        motivo, mensagem, site = validar(campos, geofence if GEOFENCE_ATIVO else None,
+                                         item.get('latitude'), item.get('longitude'))
+        if motivo is None:
+            motivo, mensagem, momento = validar_horario(item.get('horario'), horario_minimo, horario_maximo)
+        if motivo is None:
+            # Compara com o que já estava gravado antes do lote; itens do mesmo lote só entram
+            # no índice depois de gravados
+            motivo, mensagem, extras_hodometro = conferir_hodometro(campos, momento)
+        if motivo is not None:
+            resultado.update(status='invalido', motivo=motivo, mensagem=mensagem)
+            metricas.falhas_validacao.inc(motivo=motivo)
+            continue
+
+        registro = montar_registro(campos, momento, site)
+        registro.update(extras_hodometro)
+        registro['origem'] = 'lote'
+        envio = (canonica(campos['placa']), campos['ordem'], campos['tipo'])
+        chaves = [('envio',) + envio]
+        if dispositivo:
+            registro['dispositivo'] = dispositivo
+        if dispositivo and id_local is not None:
+            chaves.append(('lote', dispositivo, id_local))
+            doc_id = uuid.uuid5(uuid.NAMESPACE_URL, f'{dispositivo}/{id_local}').hex
+            ids_fixos.add(doc_id)
+        else:
+            doc_id = uuid.uuid4().hex
+        if not deduplicacao.reservar(chaves, conteudo=envio):
+            resultado['status'] = 'repetido'
+            continue
+        if extras_hodometro:
+            resultado['alerta'] = extras_hodometro['hodometro_alerta']
+        aceitos.append((resultado, doc_id, registro, chaves))
+
+    # Um item com ID fixo que já foi gravado (reenvio depois da janela de deduplicação)
+    # não é gravado nem publicado de novo: os índices contariam o registro duas vezes.
+    # O journal é consultado antes do armazenamento porque o envio grava lá antes de
+    # apagar do journal.
+    if ids_fixos:
+        fixos = list(ids_fixos)
+        erro = None
+        try:
+            gravados = fila_gravacao.contem(fixos) if fila_gravacao is not None else set()
+            gravados |= armazenamento.existentes([doc_id for doc_id in fixos if doc_id not in gravados])
+        except Exception as e:
+            metricas.erros_armazenamento.inc(destino=armazenamento.nome)
+            erro = e
+        for resultado, doc_id, _, chaves in aceitos:
+            if doc_id not in ids_fixos:
+                continue
+            if erro is not None:
+                deduplicacao.liberar(chaves)
+                resultado.update(status='falha', mensagem=f"Erro ao consultar o armazenamento: {erro}")
+            elif doc_id in gravados:
+                resultado['status'] = 'repetido'
+        aceitos = [item for item in aceitos if 'status' not in item[0]]
+
+    destino = 'journal' if fila_gravacao is not None else armazenamento.nome
+    for i in range(0, len(aceitos), LIMITE_LOTE_FIRESTORE):
+        bloco = aceitos[i:i + LIMITE_LOTE_FIRESTORE]
+        itens = [(doc_id, registro) for _, doc_id, registro, _ in bloco]
+        try:
+            with metricas.duracao_gravacao.medir(destino=destino):
+                if fila_gravacao is not None:
+                    fila_gravacao.enfileirar_lote(itens)
+                else:
+                    armazenamento.adicionar_lote(itens)
+        except Exception as e:
+            metricas.erros_armazenamento.inc(destino=destino)
+            for resultado, _, _, chaves in bloco:
+                deduplicacao.liberar(chaves)
+                resultado.update(status='falha', mensagem=f"Erro ao salvar: {e}")
+            continue
+        for resultado, doc_id, registro, _ in bloco:
+            publicar_registro(doc_id, registro)
+            resultado.update(status='gravado', doc_id=doc_id)
+
+    totais = {'recebidos': len(resultados), 'gravado': 0, 'repetido': 0, 'invalido': 0, 'falha': 0}
+    for resultado in resultados:
+        totais[resultado['status']] += 1
+    for status in ('gravado', 'repetido', 'invalido', 'falha'):
+        if totais[status]:
+            metricas.registros_lote.inc(totais[status], resultado=status)
+    return jsonify(dict(totais, resultados=resultados))
+
+# --- Rota para a pergunta "Entrada ou Saída" ---
 @app.route('/pergunta')
 def pergunta():
-    return '''
-    <!DOCTYPE html>
-    <html lang="pt-BR">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Você está entrando ou saindo?</title>
-        <style>
-            body {
-                background-color: #1c1c1c; color: white;
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; display: flex;
-                justify-content: center; align-items: center;
-                height: 100vh; flex-direction: column;
-                animation: fadeIn 1s ease-out;
-            }
-            @keyframes fadeIn {
-                from { opacity: 0; transform: translateY(-20px); }
-                to { opacity: 1; transform: translateY(0); }
-            }
-            h1 {
-                font-size: 2.5em;
-                margin-bottom: 40px;
-                color: #ADD8E6; /* Azul claro */
-                text-shadow: 2px 2px 4px rgba(0,0,0,0.5);
-            }
-            .button-container {
-                display: flex;
-                gap: 20px; /* Espaço entre os botões */
-            }
-            a {
-                background-color: #FFA500; /* Laranja */
-                color: #333;
-                padding: 15px 40px;
-                margin: 10px 0; /* Ajustado para flexbox */
-                font-size: 1.2em;
-                font-weight: bold;
-                border-radius: 30px;
-                text-decoration: none;
-                transition: transform 0.3s ease, background-color 0.3s ease;
-                box-shadow: 0 4px 8px rgba(0, 0, 0, 0.3);
-            }
-            a:hover {
-                transform: scale(1.05);
-                background-color: #FF8C00;
-            }
-        </style>
-    </head>
-    <body>
-        <h1>Qual o tipo de registro?</h1>
-        <div class="button-container">
-            <a href="/registrar?tipo=Entrada">Entrada</a>
-            <a href="/registrar?tipo=Saída">Saída</a>
-        </div>
-    </body>
-    </html>
-    '''
-
-# --- Rota de Registro com HTML incorporado ---
+    return pagina_pergunta.resposta(app.response_class, request)
+
+# --- Rota de Registro ---
+def resposta_sucesso(placa):
+    # Página de sucesso + cookie com a placa, para o próximo registro já vir preenchido
+    resposta = pagina_sucesso.resposta(app.response_class, request, cache=False)
+    resposta.set_cookie(COOKIE_PERFIL, assinador_perfil.dumps(canonica(placa)), max_age=DURACAO_COOKIE_PERFIL,
+                        httponly=True, samesite='Lax', secure=request.is_secure)
+    return resposta
+
 @app.route('/registrar', methods=['GET', 'POST'])
+@admitir(admissao_registrar)
 def registrar():
     tipo_predefinido = request.args.get('tipo', '')
     
@@ -250,270 +642,86 @@ def registrar():
     transportadora_valor = ""
     quilometragem_valor = ""
 
-    # Definição do template_registro_html aqui (se você não tiver um arquivo separado)
-    template_registro_html = '''
-    <!DOCTYPE html>
-    <html lang="pt-BR">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Registro</title>
-        <style>
-            body { 
-                background-color: #2c1e1e; color: white; 
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; padding: 20px; 
-                text-align: center; display: flex; justify-content: center; align-items: center; 
-                min-height: 100vh; margin: 0;
-            }
-            .form-box {
-                background-color: #fff8f0; color: black; padding: 30px;
-                border-radius: 12px; max-width: 500px; width: 90%; margin: auto;
-                box-shadow: 0 8px 16px rgba(0, 0, 0, 0.4);
-                animation: fadeIn 0.8s ease-out;
-            }
-            @keyframes fadeIn {
-                from { opacity: 0; transform: scale(0.9); }
-                to { opacity: 1; transform: scale(1); }
-            }
-            h2 { 
-                color: #8B4513; margin-bottom: 30px; 
-                font-size: 2.2em; text-shadow: 1px 1px 2px rgba(0,0,0,0.2);
-            }
-            label { 
-                font-weight: bold; display: block; margin-top: 20px; text-align: left; 
-                color: #5a2e0e; 
-            }
-            input[type="text"], input[type="number"], select { 
-                width: calc(100% - 22px); 
-                padding: 11px; border-radius: 6px; margin-top: 8px;
-                border: 1px solid #ccc; font-size: 1em;
-                box-sizing: border-box; 
-            }
-            input[type="submit"] {
-                background-color: #8B4513; color: white; border: none; cursor: pointer; margin-top: 30px;
-                padding: 15px 30px; border-radius: 30px; font-size: 1.1em; font-weight: bold;
-                transition: background-color 0.3s ease, transform 0.3s ease;
-                box-shadow: 0 4px 8px rgba(0, 0, 0, 0.3);
-            }
-            input[type="submit"]:hover { 
-                background-color: #a0522d; 
-                transform: translateY(-2px); 
-            }
-            .error-message { 
-                color: #D32F2F; 
-                background-color: #FFCDD2; 
-                border: 1px solid #EF9A9A;
-                padding: 10px; border-radius: 5px;
-                margin-top: 15px; font-weight: bold;
-            }
-            .info-message { 
-                color: #616161; font-size: 0.85em; margin-top: 5px; text-align: left; 
-            }
-            select {
-                background-color: #f0f0f0;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="form-box">
-            <h2>📋 Registro de {{ tipo }}</h2>
-            {% if mensagem_erro %}
-                <p class="error-message">{{ mensagem_erro }}</p>
-            {% endif %}
-            <form method="post" onsubmit="return validarFormulario()">
-                <label for="nome">Nome do Motorista:</label>
-                <input type="text" name="nome" id="nome" value="{{ nome_valor }}" required>
-                
-                <label for="placa">Placa do Veículo:</label>
-                <input type="text" name="placa" id="placa" value="{{ placa_valor }}" required>
-                <p class="info-message">⚠️ Se for carreta, utilize a placa do Baú / Carreta. A placa será salva sem espaços e pontuações (ex: ABC1234).</p>
-                
-                <label for="ordem">Ordem de Coleta:</label>
-                <input type="text" name="ordem" id="ordem" value="{{ ordem_valor }}" required>
-                <p class="info-message">⚠️ Campo obrigatório. A ordem será salva sem espaços (ex: ORDEM123).</p>
-                
-                <label for="Transportadora">Transportadora:</label>
-                <input type="text" name="Transportadora" id="Transportadora" value="{{ transportadora_valor }}" required>
-
-                <label for="quilometragem">Informe a Quilometragem (Opcional):</label>
-                <input type="number" name="quilometragem" id="quilometragem" value="{{ quilometragem_valor }}" placeholder="Ex: 123456" min="0">
-                <p class="info-message">Campo opcional para controle da frota. Apenas números inteiros.</p>
-                
-                <label for="tipo">Tipo:</label>
-                <select name="tipo" id="tipo">
-                    <option value="Entrada" {% if tipo == "Entrada" %}selected{% endif %}>Entrada</option>
-                    <option value="Saída" {% if tipo == "Saída" %}selected{% endif %}>Saída</option>
-                </select>
-                <input type="submit" value="Registrar">
-            </form>
-        </div>
-
-        <script>
-            function validarFormulario() {
-                let nomeInput = document.getElementById('nome');
-                let placaInput = document.getElementById('placa');
-                let ordemInput = document.getElementById('ordem');
-                let transportadoraInput = document.getElementById('Transportadora');
-                let quilometragemInput = document.getElementById('quilometragem');
-                let errorMessageDiv = document.querySelector('.error-message');
-
-                if (!errorMessageDiv) {
-                    errorMessageDiv = document.createElement('p');
-                    errorMessageDiv.className = 'error-message';
-                    document.querySelector('.form-box form').prepend(errorMessageDiv);
-                }
-                errorMessageDiv.textContent = ''; 
-
-                if (nomeInput.value.trim() === '') {
-                    errorMessageDiv.textContent = 'O Nome do Motorista é obrigatório.';
-                    nomeInput.focus();
-                    return false;
-                }
-
-                placaInput.value = placaInput.value.replace(/[^A-Za-z0-9]/g, '').toUpperCase();
-                if (placaInput.value === '') {
-                    errorMessageDiv.textContent = 'A Placa do Veículo é obrigatória.';
-                    placaInput.focus();
-                    return false;
-                }
-                
-                ordemInput.value = ordemInput.value.trim().toUpperCase().replace(/\s+/g, '');
-                if (ordemInput.value === '') {
-                    errorMessageDiv.textContent = 'A Ordem de Coleta é obrigatória.';
-                    ordemInput.focus();
-                    return false;
-                }
-
-                if (transportadoraInput.value.trim() === '') {
-                    errorMessageDiv.textContent = 'A Transportadora é obrigatória.';
-                    transportadoraInput.focus();
-                    return false;
-                }
-
-                if (quilometragemInput.value !== '') {
-                    let quilometragem = parseInt(quilometragemInput.value);
-                    if (isNaN(quilometragem) || quilometragem < 0) {
-                        errorMessageDiv.textContent = 'A quilometragem deve ser um número inteiro positivo válido.';
-                        quilometragemInput.focus();
-                        return false;
-                    }
-                }
-                
-                return true;
-            }
-        </script>
-    </body>
-    </html>
-    '''
-
     if request.method == 'POST':
-        nome = request.form['nome'].upper().strip()
-        placa_raw = request.form['placa']
-        ordem_raw = request.form['ordem']
-        tipo = request.form['tipo']
-        transportadora = request.form['Transportadora'].upper().strip()
-        quilometragem = request.form.get('quilometragem', '').strip() 
-
-        placa = re.sub(r'[^A-Z0-9]', '', placa_raw.upper())
-        ordem = re.sub(r'\s+', '', ordem_raw.strip().upper())
-
-        nome_valor = nome
-        placa_valor = placa_raw
-        ordem_valor = ordem_raw
-        transportadora_valor = transportadora
-        quilometragem_valor = quilometragem
-
-        if not nome:
-            mensagem_erro = "O Nome do Motorista é obrigatório."
-        elif not placa:
-            mensagem_erro = "A Placa do Veículo é obrigatória e não pode estar vazia."
-        elif not ordem:
-            mensagem_erro = "A Ordem de Coleta é obrigatória e não pode estar vazia."
-        elif not transportadora:
-            mensagem_erro = "A Transportadora é obrigatória."
-        
-        if not mensagem_erro and quilometragem:
-            try:
-                quilometragem_int = int(quilometragem)
-                if quilometragem_int < 0:
-                    mensagem_erro = "A quilometragem deve ser um número positivo."
-            except ValueError:
-                mensagem_erro = "A quilometragem deve ser um número válido (apenas números inteiros)."
+        campos = normalizar(request.form)
+        placa = campos['placa']
+        ordem = campos['ordem']
+        tipo = campos['tipo']
+
+        nome_valor = campos['nome']
+        placa_valor = request.form.get('placa', '')
+        ordem_valor = request.form.get('ordem', '')
+        transportadora_valor = campos['Transportadora']
+        quilometragem_valor = campos['quilometragem']
+
+        motivo_erro, mensagem_erro, site = validar(campos, geofence if GEOFENCE_ATIVO else None,
+                                                    request.form.get('latitude'), request.form.get('longitude'))
+        agora = agora_utc()
+        extras_hodometro = {}
+        if not mensagem_erro:
+            motivo_erro, mensagem_erro, extras_hodometro = conferir_hodometro(campos, agora)
 
         if mensagem_erro:
-            return render_template_string(template_registro_html, 
-                                        tipo=tipo_predefinido, 
-                                        nome_valor=nome_valor, 
-                                        placa_valor=placa_valor, 
-                                        ordem_valor=ordem_valor, 
-                                        transportadora_valor=transportadora_valor,
-                                        quilometragem_valor=quilometragem_valor, 
-                                        mensagem_erro=mensagem_erro)
-
-        horario = datetime.now(pytz.timezone('America/Sao_Paulo')).strftime('%Y-%m-%d %H:%M:%S')
-        
+            metricas.falhas_validacao.inc(motivo=motivo_erro)
+            return render_template('registro.html',
+                                   tipo=tipo_predefinido, 
+                                   nome_valor=nome_valor, 
+                                   placa_valor=placa_valor, 
+                                   ordem_valor=ordem_valor, 
+                                   transportadora_valor=transportadora_valor,
+                                   quilometragem_valor=quilometragem_valor, 
+                                   mensagem_erro=mensagem_erro,
+                                   token=uuid.uuid4().hex)
+
+        # Repetição de um envio já aceito: responde como da primeira vez, sem gravar de novo.
+        # O token só conta como repetição com a mesma placa/ordem/tipo (ver idempotencia.py).
+        envio = (canonica(placa), ordem, tipo)
+        chaves_envio = [('envio',) + envio]
+        if request.form.get('token'):
+            chaves_envio.append(('token', request.form['token']))
+        if not deduplicacao.reservar(chaves_envio, conteudo=envio):
+            metricas.deduplicacao.inc(resultado='repetido')
+            return resposta_sucesso(placa)
+        metricas.deduplicacao.inc(resultado='novo')
+
+        destino = 'journal' if fila_gravacao is not None else armazenamento.nome
         try:
-            # Use a variável 'db' que já foi inicializada globalmente
-            registros_ref = db.collection('registros')
-            novo_registro = {
-                'nome': nome,
-                'placa': placa, 
-                'ordem': ordem, 
-                'tipo': tipo,
-                'horario': horario,
-                'Transportadora': transportadora
-            }
-            if quilometragem and not mensagem_erro:
-                novo_registro['quilometragem'] = int(quilometragem)
-
-            registros_ref.add(novo_registro)
-
-            return '''
-            <!DOCTYPE html>
-            <html lang="pt-BR">
-            <head>
-                <meta charset="UTF-8">
-                <meta http-equiv="refresh" content="2;url=/" />
-                <title>Sucesso!</title>
-                <style>
-                    body {
-                        background-color: #1e1e1e; color: white;
-                        display: flex; justify-content: center; align-items: center; height: 100vh;
-                        font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                    }
-                    div {
-                        text-align: center; background-color: #333; padding: 30px; border-radius: 10px;
-                        box-shadow: 0 4px 10px rgba(0, 0, 0, 0.5);
-                    }
-                    h2 { color: lime; font-size: 2em; margin-bottom: 10px; }
-                    p { font-size: 1.1em; }
-                </style>
-            </head>
-            <body>
-                <div>
-                    <h2>✅ Registro salvo com sucesso!</h2>
-                    <p>Você será redirecionado em instantes...</p>
-                </div>
-            </body>
-            </html>
-            '''
+            # horario (texto local), horario_utc (timestamp), dia e semana_iso; ver horarios.py
+            novo_registro = montar_registro(campos, agora, site)
+            novo_registro.update(extras_hodometro)
+
+            with metricas.duracao_gravacao.medir(destino=destino), monitor_gravacao.medir():
+                if fila_gravacao is not None:
+                    doc_id = fila_gravacao.enfileirar(novo_registro)
+                else:
+                    doc_id = armazenamento.adicionar(novo_registro)
+            publicar_registro(doc_id, novo_registro)
+
+            return resposta_sucesso(placa)
         except Exception as e:
+            deduplicacao.liberar(chaves_envio)
+            metricas.erros_armazenamento.inc(destino=destino)
             mensagem_erro = f"Erro ao salvar no Firestore: {e}. Por favor, tente novamente."
-            return render_template_string(template_registro_html, 
-                                        tipo=tipo_predefinido, 
-                                        nome_valor=nome_valor, 
-                                        placa_valor=placa_valor, 
-                                        ordem_valor=ordem_valor, 
-                                        transportadora_valor=transportadora_valor,
-                                        quilometragem_valor=quilometragem_valor,
-                                        mensagem_erro=mensagem_erro)
-
-    # Este é o bloco para a requisição GET inicial (ou POST com erro antes do Firebase)
-    return render_template_string(template_registro_html, 
-                                tipo=tipo_predefinido, 
-                                nome_valor="", 
-                                placa_valor="", 
-                                ordem_valor="", 
-                                transportadora_valor="",
-                                quilometragem_valor="",
-                                mensagem_erro=mensagem_erro)
\ No newline at end of file
+            return render_template('registro.html',
+                                   tipo=tipo_predefinido, 
+                                   nome_valor=nome_valor, 
+                                   placa_valor=placa_valor, 
+                                   ordem_valor=ordem_valor, 
+                                   transportadora_valor=transportadora_valor,
+                                   quilometragem_valor=quilometragem_valor,
+                                   mensagem_erro=mensagem_erro,
+                                   token=uuid.uuid4().hex)
+
+    # Este é o bloco para a requisição GET inicial (ou POST com erro antes do Firebase).
+    # Preenche com o perfil da placa em ?placa= ou da última placa registrada neste aparelho.
+    placa_consulta = request.args.get('placa') or placa_do_cookie()
+    perfil = buscar_perfil(placa_consulta) or {}
+    return render_template('registro.html',
+                           tipo=tipo_predefinido, 
+                           nome_valor=perfil.get('nome') or "", 
+                           placa_valor=perfil.get('placa') or placa_consulta or "", 
+                           ordem_valor="", 
+                           transportadora_valor=perfil.get('Transportadora') or "",
+                           quilometragem_valor="",
+                           mensagem_erro=mensagem_erro,
+                           token=uuid.uuid4().hex)
\ No newline at end of file
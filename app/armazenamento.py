@@ -0,0 +1,671 @@
+import heapq
+import os
+import json
+import queue
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+from horarios import texto_utc, utc_de_texto
+
+# --- Camada de armazenamento dos registros ---
+# Todo acesso à coleção 'registros' passa por um destes backends, escolhido pela
+# variável de ambiente STORAGE_BACKEND:
+#   firestore (padrão) -> Firestore real, credenciais via FIREBASE_SERVICE_ACCOUNT_KEY
+#   sqlite             -> SQLite local (SQLITE_PATH, padrão ':memory:'), para testes de
+#                         carga, benchmarks e sites com conexão ruim
+# Os dois backends têm a mesma semântica: adicionar() cria um documento com ID
+# gerado (ou informado) e adicionar_lote() grava vários documentos com set(),
+# ou seja, regravar o mesmo ID substitui o documento em vez de duplicá-lo.
+# listar() percorre os registros em ordem de horario_utc com paginação por cursor
+# (memória constante); listar_gravados() faz o mesmo pela ordem de gravação (campo
+# gravado_em, o horário do servidor em que o registro foi aceito), para achar os
+# registros de lote com horário antigo gravados depois de um snapshot.
+# salvar_estado()/carregar_estado() guardam pequenos
+# snapshots dos índices em memória do app, fora da coleção de registros.
+# salvar_agregados()/carregar_agregados() guardam um documento de agregados por dia
+# (ver agregados.py) na coleção 'agregados_diarios'.
+#
+# Com PARTICIONAR_POR_SITE=1 os registros de cada site (pátio) vão para uma coleção
+# própria, sites/{site}/registros (no SQLite, uma tabela por site), e as consultas
+# sem site percorrem todas as partições em paralelo (ver ArmazenamentoParticionado).
+
+LIMITE_LOTE_FIRESTORE = 500  # Limite de operações por WriteBatch no Firestore
+TAMANHO_PAGINA = 500
+
+
+# --- Serialização para JSON (journal do write-behind e backend SQLite) ---
+# datetimes viram {"$utc": "AAAA-MM-DDTHH:MM:SS.ffffffZ"} e voltam como datetime UTC,
+# igual ao que o Firestore devolve para campos Timestamp.
+
+def _codificar(valor):
+    if isinstance(valor, datetime):
+        return {'$utc': texto_utc(valor)}
+    raise TypeError(f'Tipo não serializável: {type(valor).__name__}')
+
+
+def _decodificar(objeto):
+    if len(objeto) == 1 and '$utc' in objeto:
+        return utc_de_texto(objeto['$utc'])
+    return objeto
+
+
+def serializar(registro):
+    return json.dumps(registro, ensure_ascii=False, default=_codificar)
+
+
+def desserializar(texto):
+    return json.loads(texto, object_hook=_decodificar)
+
+
+def credenciais_firestore():
+    # Só verifica a configuração (barato, sem importar firebase_admin); o cliente é criado
+    # depois, no primeiro uso. Retorna o dict da conta de serviço ou o caminho do arquivo.
+    service_account_json = os.environ.get('FIREBASE_SERVICE_ACCOUNT_KEY')
+    if service_account_json:
+        try:
+            return json.loads(service_account_json)
+        except Exception as e:
+            print(f"ERRO FATAL: Falha ao inicializar o Firebase/Firestore. Detalhes: {e}")
+            exit(1)
+    if os.path.exists("serviceAccountKey.json"):
+        return "serviceAccountKey.json"
+    print("ERRO CRÍTICO: Variável de ambiente 'FIREBASE_SERVICE_ACCOUNT_KEY' não encontrada e 'serviceAccountKey.json' não existe.")
+    print("Não é possível inicializar o Firebase. Verifique a configuração do Cloud Run ou o arquivo local.")
+    exit(1)
+
+
+def inicializar_firestore(credenciais):
+    # Importado aqui para que o backend SQLite funcione sem firebase_admin instalado, e
+    # para que o import do app não pague o custo do firebase_admin/gRPC
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(credenciais))
+        if isinstance(credenciais, dict):
+            print("Firebase inicializado com sucesso via variável de ambiente!")
+        else:
+            print("Firebase inicializado com sucesso via arquivo local (APENAS PARA DESENVOLVIMENTO)!")
+
+    # Apenas inicialize o cliente Firestore UMA VEZ, após o app Firebase ser inicializado
+    db = firestore.client()
+    print("Firestore client inicializado.")
+    return db
+
+
+class ArmazenamentoFirestore:
+    nome = 'firestore'
+
+    def __init__(self, db=None, colecao='registros', fabrica=None):
+        # Sem db, o cliente é criado por fabrica() no primeiro acesso: já dentro do worker
+        # (depois do fork do gunicorn) e fora do caminho do import. Um cliente por processo,
+        # compartilhado por todas as threads (o canal gRPC é reaproveitado).
+        self._db = db
+        self._fabrica = fabrica
+        self._lock_db = threading.Lock()
+        self.colecao = colecao
+
+    @property
+    def db(self):
+        if self._db is None:
+            with self._lock_db:
+                if self._db is None:
+                    self._db = self._fabrica()
+        return self._db
+
+    @property
+    def inicializado(self):
+        return self._db is not None
+
+    def adicionar(self, registro, doc_id=None):
+        registros_ref = self.db.collection(self.colecao)
+        if doc_id is None:
+            _, doc_ref = registros_ref.add(registro)
+            return doc_ref.id
+        registros_ref.document(doc_id).set(registro)
+        return doc_id
+
+    def adicionar_lote(self, itens):
+        # itens: lista de (doc_id, registro). Divide em WriteBatches de até 500.
+        registros_ref = self.db.collection(self.colecao)
+        for i in range(0, len(itens), LIMITE_LOTE_FIRESTORE):
+            lote = self.db.batch()
+            for doc_id, registro in itens[i:i + LIMITE_LOTE_FIRESTORE]:
+                lote.set(registros_ref.document(doc_id), registro)
+            lote.commit()
+
+    def listar(self, inicio=None, fim=None, filtros=None, tamanho_pagina=TAMANHO_PAGINA):
+        # Gera (doc_id, registro) com inicio <= horario_utc < fim (datetimes), página a página.
+        # Registros sem horario_utc (anteriores ao backfill_horario.py) não aparecem.
+        # filtros: {campo: valor} de igualdade (ex: {'placa_canonica': 'ABC1234'}); as combinações
+        # usadas precisam dos índices compostos de firestore.indexes.json.
+        consulta = self.db.collection(self.colecao)  # Antes do import: self.db termina de carregar o módulo
+        from google.cloud.firestore import FieldFilter, FieldPath
+
+        for campo, valor in (filtros or {}).items():
+            consulta = consulta.where(filter=FieldFilter(campo, '==', valor))
+        if inicio is not None:
+            consulta = consulta.where(filter=FieldFilter('horario_utc', '>=', inicio))
+        if fim is not None:
+            consulta = consulta.where(filter=FieldFilter('horario_utc', '<', fim))
+        consulta = consulta.order_by('horario_utc').order_by(FieldPath.document_id()).limit(tamanho_pagina)
+
+        ultimo = None
+        while True:
+            pagina = (consulta.start_after(ultimo) if ultimo is not None else consulta).get()
+            for doc in pagina:
+                yield doc.id, doc.to_dict()
+            if len(pagina) < tamanho_pagina:
+                return
+            ultimo = pagina[-1]
+
+    def listar_gravados(self, desde, tamanho_pagina=TAMANHO_PAGINA):
+        # Gera (doc_id, registro) com gravado_em >= desde (datetime), na ordem de gravação.
+        # Registros gravados antes de o campo existir não aparecem.
+        consulta = self.db.collection(self.colecao)
+        from google.cloud.firestore import FieldFilter, FieldPath
+
+        consulta = (consulta.where(filter=FieldFilter('gravado_em', '>=', desde))
+                    .order_by('gravado_em').order_by(FieldPath.document_id()).limit(tamanho_pagina))
+        ultimo = None
+        while True:
+            pagina = (consulta.start_after(ultimo) if ultimo is not None else consulta).get()
+            for doc in pagina:
+                yield doc.id, doc.to_dict()
+            if len(pagina) < tamanho_pagina:
+                return
+            ultimo = pagina[-1]
+
+    def paginas_por_id(self, apos=None, tamanho_pagina=TAMANHO_PAGINA):
+        # Percorre a coleção inteira em ordem de ID de documento (inclusive registros sem
+        # horario_utc), gerando listas de (doc_id, registro). 'apos' retoma de um checkpoint.
+        colecao = self.db.collection(self.colecao)  # Antes do import: self.db termina de carregar o módulo
+        from google.cloud.firestore import FieldPath
+
+        consulta = colecao.order_by(FieldPath.document_id()).limit(tamanho_pagina)
+        while True:
+            pagina = (consulta.start_after({'__name__': apos}) if apos is not None else consulta).get()
+            if pagina:
+                yield [(doc.id, doc.to_dict()) for doc in pagina]
+            if len(pagina) < tamanho_pagina:
+                return
+            apos = pagina[-1].id
+
+    def atualizar_lote(self, itens):
+        # itens: lista de (doc_id, campos). Mescla os campos nos documentos existentes.
+        registros_ref = self.db.collection(self.colecao)
+        for i in range(0, len(itens), LIMITE_LOTE_FIRESTORE):
+            lote = self.db.batch()
+            for doc_id, campos in itens[i:i + LIMITE_LOTE_FIRESTORE]:
+                lote.update(registros_ref.document(doc_id), campos)
+            lote.commit()
+
+    def remover_lote(self, doc_ids):
+        registros_ref = self.db.collection(self.colecao)
+        for i in range(0, len(doc_ids), LIMITE_LOTE_FIRESTORE):
+            lote = self.db.batch()
+            for doc_id in doc_ids[i:i + LIMITE_LOTE_FIRESTORE]:
+                lote.delete(registros_ref.document(doc_id))
+            lote.commit()
+
+    def existentes(self, doc_ids):
+        # Conjunto dos doc_ids que já existem na coleção, numa leitura em lote
+        if not doc_ids:
+            return set()
+        registros_ref = self.db.collection(self.colecao)
+        documentos = self.db.get_all([registros_ref.document(doc_id) for doc_id in doc_ids], field_paths=['horario'])
+        return {doc.id for doc in documentos if doc.exists}
+
+    def carregar_estado(self, nome):
+        doc = self.db.collection('estado_indices').document(nome).get()
+        return doc.to_dict() if doc.exists else None
+
+    def salvar_estado(self, nome, dados):
+        self.db.collection('estado_indices').document(nome).set(dados)
+
+    def salvar_agregados(self, dias, nome_estado=None, estado=None):
+        # dias: {'AAAA-MM-DD': dados}; cada dia substitui o documento inteiro. O estado
+        # opcional vai no último WriteBatch, junto com os dias (atomicamente se couber em um).
+        agregados_ref = self.db.collection('agregados_diarios')
+        itens = [(agregados_ref.document(dia), dict(dados, dia=dia)) for dia, dados in dias.items()]
+        if nome_estado is not None:
+            itens.append((self.db.collection('estado_indices').document(nome_estado), estado))
+        for i in range(0, len(itens), LIMITE_LOTE_FIRESTORE):
+            lote = self.db.batch()
+            for doc_ref, dados in itens[i:i + LIMITE_LOTE_FIRESTORE]:
+                lote.set(doc_ref, dados)
+            lote.commit()
+
+    def carregar_agregados(self, inicio=None, fim=None):
+        # Dias entre inicio e fim ('AAAA-MM-DD', inclusivos) -> {dia: dados}
+        consulta = self.db.collection('agregados_diarios')  # Antes do import: self.db termina de carregar o módulo
+        from google.cloud.firestore import FieldFilter
+
+        if inicio is not None:
+            consulta = consulta.where(filter=FieldFilter('dia', '>=', inicio))
+        if fim is not None:
+            consulta = consulta.where(filter=FieldFilter('dia', '<=', fim))
+        agregados = {}
+        for doc in consulta.stream():
+            dados = doc.to_dict()
+            dados.pop('dia', None)
+            agregados[doc.id] = dados
+        return agregados
+
+
+class ArmazenamentoSQLite:
+    nome = 'sqlite'
+    inicializado = True
+
+    def __init__(self, caminho=':memory:', colecao='registros'):
+        self.colecao = colecao
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        if caminho != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.colecao} (
+                id TEXT PRIMARY KEY,
+                horario TEXT,
+                dados TEXT NOT NULL,
+                horario_utc TEXT,
+                gravado_em TEXT
+            )
+        ''')
+        # Bancos criados antes de horario_utc/gravado_em existirem ganham as colunas aqui
+        colunas = {linha[1] for linha in self._conn.execute(f'PRAGMA table_info({self.colecao})')}
+        for coluna in ('horario_utc', 'gravado_em'):
+            if coluna not in colunas:
+                self._conn.execute(f'ALTER TABLE {self.colecao} ADD COLUMN {coluna} TEXT')
+        self._conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.colecao}_horario_utc ON {self.colecao} (horario_utc, id)')
+        self._conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.colecao}_gravado_em ON {self.colecao} (gravado_em, id)')
+        # Equivalentes locais dos índices compostos de firestore.indexes.json
+        for campo in ('placa', 'placa_canonica', 'Transportadora'):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.colecao}_{campo.lower()}_utc "
+                               f"ON {self.colecao} (json_extract(dados, '$.{campo}'), horario_utc, id)")
+        self._conn.execute('CREATE TABLE IF NOT EXISTS estado_indices (nome TEXT PRIMARY KEY, dados TEXT NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS agregados_diarios (dia TEXT PRIMARY KEY, dados TEXT NOT NULL)')
+
+    def _linha(self, doc_id, registro):
+        momento, gravado_em = registro.get('horario_utc'), registro.get('gravado_em')
+        return (doc_id, registro.get('horario'), serializar(registro),
+                texto_utc(momento) if isinstance(momento, datetime) else None,
+                texto_utc(gravado_em) if isinstance(gravado_em, datetime) else None)
+
+    def adicionar(self, registro, doc_id=None):
+        doc_id = doc_id or uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                f'INSERT OR REPLACE INTO {self.colecao} (id, horario, dados, horario_utc, gravado_em) VALUES (?, ?, ?, ?, ?)',
+                self._linha(doc_id, registro),
+            )
+        return doc_id
+
+    def adicionar_lote(self, itens):
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    f'INSERT OR REPLACE INTO {self.colecao} (id, horario, dados, horario_utc, gravado_em) VALUES (?, ?, ?, ?, ?)',
+                    [self._linha(doc_id, registro) for doc_id, registro in itens],
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def listar(self, inicio=None, fim=None, filtros=None, tamanho_pagina=TAMANHO_PAGINA):
+        # Mesma paginação por cursor (horario_utc, id) do Firestore. horario_utc é
+        # guardado como texto de largura fixa, então a ordem do texto é a ordem do tempo.
+        condicoes, parametros = ['horario_utc IS NOT NULL'], []
+        for campo, valor in (filtros or {}).items():
+            condicoes.append(f"json_extract(dados, '$.{campo}') = ?")
+            parametros.append(valor)
+        if inicio is not None:
+            condicoes.append('horario_utc >= ?')
+            parametros.append(texto_utc(inicio))
+        if fim is not None:
+            condicoes.append('horario_utc < ?')
+            parametros.append(texto_utc(fim))
+
+        ultimo = None
+        while True:
+            filtro = list(condicoes)
+            valores = list(parametros)
+            if ultimo is not None:
+                filtro.append('(horario_utc > ? OR (horario_utc = ? AND id > ?))')
+                valores += [ultimo[0], ultimo[0], ultimo[1]]
+            with self._lock:
+                pagina = self._conn.execute(
+                    f"SELECT id, horario_utc, dados FROM {self.colecao} WHERE {' AND '.join(filtro)} "
+                    f"ORDER BY horario_utc, id LIMIT ?",
+                    valores + [tamanho_pagina],
+                ).fetchall()
+            for doc_id, _, dados in pagina:
+                yield doc_id, desserializar(dados)
+            if len(pagina) < tamanho_pagina:
+                return
+            ultimo = (pagina[-1][1], pagina[-1][0])
+
+    def listar_gravados(self, desde, tamanho_pagina=TAMANHO_PAGINA):
+        ultimo = (texto_utc(desde), '')
+        while True:
+            with self._lock:
+                pagina = self._conn.execute(
+                    f"SELECT id, gravado_em, dados FROM {self.colecao} "
+                    f"WHERE gravado_em > ? OR (gravado_em = ? AND id > ?) ORDER BY gravado_em, id LIMIT ?",
+                    (ultimo[0], ultimo[0], ultimo[1], tamanho_pagina),
+                ).fetchall()
+            for doc_id, _, dados in pagina:
+                yield doc_id, desserializar(dados)
+            if len(pagina) < tamanho_pagina:
+                return
+            ultimo = (pagina[-1][1], pagina[-1][0])
+
+    def paginas_por_id(self, apos=None, tamanho_pagina=TAMANHO_PAGINA):
+        while True:
+            with self._lock:
+                pagina = self._conn.execute(
+                    f'SELECT id, dados FROM {self.colecao} WHERE id > ? ORDER BY id LIMIT ?',
+                    (apos or '', tamanho_pagina),
+                ).fetchall()
+            if pagina:
+                yield [(doc_id, desserializar(dados)) for doc_id, dados in pagina]
+            if len(pagina) < tamanho_pagina:
+                return
+            apos = pagina[-1][0]
+
+    def atualizar_lote(self, itens):
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                for doc_id, campos in itens:
+                    linha = self._conn.execute(f'SELECT dados FROM {self.colecao} WHERE id = ?', (doc_id,)).fetchone()
+                    if linha is None:
+                        raise KeyError(f'Documento {doc_id} não existe')
+                    registro = dict(desserializar(linha[0]), **campos)
+                    _, horario, dados, horario_utc, gravado_em = self._linha(doc_id, registro)
+                    self._conn.execute(
+                        f'UPDATE {self.colecao} SET horario = ?, dados = ?, horario_utc = ?, gravado_em = ? WHERE id = ?',
+                        (horario, dados, horario_utc, gravado_em, doc_id),
+                    )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def remover_lote(self, doc_ids):
+        with self._lock:
+            self._conn.executemany(f'DELETE FROM {self.colecao} WHERE id = ?', [(doc_id,) for doc_id in doc_ids])
+
+    def existentes(self, doc_ids):
+        encontrados = set()
+        with self._lock:
+            for i in range(0, len(doc_ids), LIMITE_LOTE_FIRESTORE):
+                bloco = doc_ids[i:i + LIMITE_LOTE_FIRESTORE]
+                marcadores = ', '.join('?' * len(bloco))
+                linhas = self._conn.execute(f'SELECT id FROM {self.colecao} WHERE id IN ({marcadores})', bloco)
+                encontrados.update(linha[0] for linha in linhas)
+        return encontrados
+
+    def carregar_estado(self, nome):
+        with self._lock:
+            linha = self._conn.execute('SELECT dados FROM estado_indices WHERE nome = ?', (nome,)).fetchone()
+        return desserializar(linha[0]) if linha else None
+
+    def salvar_estado(self, nome, dados):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO estado_indices (nome, dados) VALUES (?, ?)',
+                               (nome, serializar(dados)))
+
+    def salvar_agregados(self, dias, nome_estado=None, estado=None):
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany('INSERT OR REPLACE INTO agregados_diarios (dia, dados) VALUES (?, ?)',
+                                       [(dia, serializar(dados)) for dia, dados in dias.items()])
+                if nome_estado is not None:
+                    self._conn.execute('INSERT OR REPLACE INTO estado_indices (nome, dados) VALUES (?, ?)',
+                                       (nome_estado, serializar(estado)))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def carregar_agregados(self, inicio=None, fim=None):
+        with self._lock:
+            linhas = self._conn.execute('SELECT dia, dados FROM agregados_diarios WHERE dia >= ? AND dia <= ?',
+                                        (inicio or '', fim or '\uffff')).fetchall()
+        return {dia: desserializar(dados) for dia, dados in linhas}
+
+
+# --- Partições por site ---
+# A coleção única 'registros' recebe as gravações de todos os pátios, com horario_utc
+# sempre crescente: é o padrão de "hotspot" do Firestore e limita a taxa de gravação
+# da coleção. ArmazenamentoParticionado manda cada registro para a partição do seu
+# 'site'; registros sem site (geofence desligado) ficam na partição padrão, que é a
+# coleção original. O texto 'horario', também crescente e nunca consultado, não é
+# indexado (fieldOverrides de firestore.indexes.json; os índices compostos valem para
+# todas as coleções chamadas 'registros', inclusive as partições). Até
+# migrar_particoes.py rodar, os registros antigos de cada site também estão lá, então
+# toda consulta inclui a partição padrão.
+#
+# listar() sem filtro de site lê todas as partições ao mesmo tempo (uma thread por
+# partição, algumas páginas à frente) e intercala os resultados por (horario_utc, id)
+# com heapq.merge, mantendo a ordem e a memória constante de listar(). Um documento
+# presente em duas partições (migração em andamento) sai uma vez só.
+#
+# estado_indices e agregados_diarios continuam na partição padrão. As partições são os
+# sites de sites.json mais as criadas por gravações de outros sites neste processo; um
+# site retirado de sites.json some das consultas até voltar à configuração.
+
+PAGINAS_ANTECIPADAS = 2  # Páginas lidas à frente por partição em listar()
+
+
+class _Falha:
+    def __init__(self, erro):
+        self.erro = erro
+
+
+_FIM = object()
+
+
+def _antecipar(gerador, tamanho):
+    # Consome 'gerador' numa thread própria, até 'tamanho' itens à frente de quem lê. A
+    # thread começa já, antes do primeiro next(), para as partições serem lidas juntas.
+    fila = queue.Queue(tamanho)
+    parar = threading.Event()
+
+    def colocar(item):
+        while not parar.is_set():
+            try:
+                fila.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produzir():
+        try:
+            for item in gerador:
+                if not colocar(item):
+                    return
+            colocar(_FIM)
+        except Exception as e:
+            colocar(_Falha(e))
+        finally:
+            gerador.close()
+
+    threading.Thread(target=produzir, name='listar-particao', daemon=True).start()
+
+    def consumir():
+        try:
+            while True:
+                item = fila.get()
+                if item is _FIM:
+                    return
+                if isinstance(item, _Falha):
+                    raise item.erro
+                yield item
+        finally:
+            parar.set()  # Quem lê desistiu (ou terminou): libera a thread
+
+    return consumir()
+
+
+def _chave_ordem(item):
+    return texto_utc(item[1]['horario_utc']), item[0]
+
+
+class ArmazenamentoParticionado:
+    def __init__(self, padrao, criar_particao, sites=()):
+        # criar_particao(site) -> backend da partição do site
+        self.padrao = padrao
+        self.nome = padrao.nome
+        self._criar_particao = criar_particao
+        self._particoes = {}
+        self._lock = threading.Lock()
+        for site in sites:
+            self.particao(site)
+
+    @property
+    def inicializado(self):
+        return self.padrao.inicializado
+
+    def particao(self, site):
+        if not site:
+            return self.padrao
+        if '/' in site:
+            raise ValueError(f"Site inválido para partição: '{site}'")
+        with self._lock:
+            particao = self._particoes.get(site)
+            if particao is None:
+                particao = self._particoes[site] = self._criar_particao(site)
+            return particao
+
+    def particoes(self):
+        # [(site, backend)], a partição padrão primeiro com site ''
+        with self._lock:
+            return [('', self.padrao)] + sorted(self._particoes.items())
+
+    def adicionar(self, registro, doc_id=None):
+        return self.particao(registro.get('site')).adicionar(registro, doc_id)
+
+    def adicionar_lote(self, itens):
+        grupos = {}
+        for doc_id, registro in itens:
+            grupos.setdefault(registro.get('site'), []).append((doc_id, registro))
+        for site, grupo in grupos.items():
+            self.particao(site).adicionar_lote(grupo)
+
+    def listar(self, inicio=None, fim=None, filtros=None, tamanho_pagina=TAMANHO_PAGINA):
+        filtros = dict(filtros or {})
+        site = filtros.pop('site', None)
+        if site is not None:
+            # Só a partição do site e os registros dele ainda não migrados da partição padrão
+            with self._lock:
+                particao = self._particoes.get(site)
+            fontes = [self.padrao.listar(inicio, fim, dict(filtros, site=site), tamanho_pagina)]
+            if particao is not None:
+                fontes.append(particao.listar(inicio, fim, filtros, tamanho_pagina))
+        else:
+            fontes = [particao.listar(inicio, fim, filtros, tamanho_pagina) for _, particao in self.particoes()]
+
+        if len(fontes) == 1:
+            yield from fontes[0]
+            return
+        antecipadas = [_antecipar(fonte, tamanho_pagina * PAGINAS_ANTECIPADAS) for fonte in fontes]
+        try:
+            anterior = None
+            for item in heapq.merge(*antecipadas, key=_chave_ordem):
+                chave = _chave_ordem(item)
+                if chave != anterior:
+                    yield item
+                anterior = chave
+        finally:
+            for antecipada in antecipadas:
+                antecipada.close()
+
+    def listar_gravados(self, desde, tamanho_pagina=TAMANHO_PAGINA):
+        # Partição por partição, sem intercalar: quem lê (a cauda do índice de ocupação) não
+        # depende da ordem. Cópias ainda não removidas da partição padrão aparecem duas vezes.
+        for _, particao in self.particoes():
+            yield from particao.listar_gravados(desde, tamanho_pagina)
+
+    # IDs fora da partição padrão levam o site na frente ('site/doc_id'), para que
+    # paginas_por_id() tenha um checkpoint único e atualizar_lote() ache a partição.
+
+    def _separar_id(self, doc_id):
+        site, separador, resto = doc_id.partition('/')
+        return (site, resto) if separador else ('', doc_id)
+
+    def paginas_por_id(self, apos=None, tamanho_pagina=TAMANHO_PAGINA):
+        site_apos, id_apos = self._separar_id(apos) if apos else ('', None)
+        for site, particao in self.particoes():
+            if site < site_apos:
+                continue
+            prefixo = f'{site}/' if site else ''
+            for pagina in particao.paginas_por_id(apos=id_apos if site == site_apos else None,
+                                                  tamanho_pagina=tamanho_pagina):
+                yield [(prefixo + doc_id, registro) for doc_id, registro in pagina]
+
+    def atualizar_lote(self, itens):
+        grupos = {}
+        for doc_id, campos in itens:
+            site, doc_id = self._separar_id(doc_id)
+            grupos.setdefault(site, []).append((doc_id, campos))
+        for site, grupo in grupos.items():
+            self.particao(site).atualizar_lote(grupo)
+
+    def existentes(self, doc_ids):
+        # O registro pode estar na partição do site ou ainda na padrão, antes da migração
+        encontrados = set()
+        for _, particao in self.particoes():
+            encontrados |= particao.existentes(doc_ids)
+        return encontrados
+
+    def carregar_estado(self, nome):
+        return self.padrao.carregar_estado(nome)
+
+    def salvar_estado(self, nome, dados):
+        self.padrao.salvar_estado(nome, dados)
+
+    def salvar_agregados(self, dias, nome_estado=None, estado=None):
+        self.padrao.salvar_agregados(dias, nome_estado, estado)
+
+    def carregar_agregados(self, inicio=None, fim=None):
+        return self.padrao.carregar_agregados(inicio, fim)
+
+
+def tabela_do_site(site):
+    return 'registros_site_' + re.sub(r'[^a-z0-9_]', '_', site.lower())
+
+
+def criar_armazenamento():
+    backend = os.environ.get('STORAGE_BACKEND', 'firestore').lower()
+    if backend == 'sqlite':
+        caminho = os.environ.get('SQLITE_PATH', ':memory:')
+        print(f"Armazenamento local SQLite em uso ({caminho}).")
+        padrao = ArmazenamentoSQLite(caminho)
+        # Cada partição abre a própria conexão; com ':memory:' cada uma é um banco separado
+        criar_particao = lambda site: ArmazenamentoSQLite(caminho, colecao=tabela_do_site(site))
+    elif backend == 'firestore':
+        credenciais = credenciais_firestore()
+        padrao = ArmazenamentoFirestore(fabrica=lambda: inicializar_firestore(credenciais))
+        # As partições usam o mesmo cliente, criado no primeiro acesso a qualquer uma delas
+        criar_particao = lambda site: ArmazenamentoFirestore(colecao=f'sites/{site}/registros',
+                                                             fabrica=lambda: padrao.db)
+    else:
+        print(f"ERRO CRÍTICO: STORAGE_BACKEND '{backend}' desconhecido. Use 'firestore' ou 'sqlite'.")
+        exit(1)
+
+    if os.environ.get('PARTICIONAR_POR_SITE', '0') != '1':
+        return padrao
+    from geofence import carregar_sites
+    sites = [str(site['id']) for site in carregar_sites()]
+    print(f"Registros particionados por site: {', '.join(sites)}.")
+    return ArmazenamentoParticionado(padrao, criar_particao, sites)
@@ -0,0 +1,135 @@
+import argparse
+import csv
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from armazenamento import criar_armazenamento
+from hodometro import TOLERANCIA_KM, VELOCIDADE_MAXIMA_KMH, avaliar_leitura
+from horarios import agora_utc, horario_utc_de
+from placas import placa_do_registro
+from recalcular_agregados import dividir_em_blocos, meia_noite_utc
+
+# --- Auditoria da quilometragem no histórico de registros ---
+# Lê o histórico em blocos de dias em paralelo (como recalcular_agregados.py) e compara
+# cada leitura com a leitura anterior da mesma placa, com as mesmas regras do app
+# (hodometro.avaliar_leitura). Cada bloco devolve as anomalias internas e a primeira e a
+# última leitura de cada placa; os blocos são emendados em ordem, comparando a última
+# leitura de uma placa num bloco com a primeira no bloco seguinte.
+#
+# Diferente do app, aqui toda leitura vira referência para a seguinte: um dígito a mais
+# aparece como 'salto' seguido de 'regrediu', o que facilita achar a leitura errada.
+#
+# Uso (mesmas variáveis de ambiente do app, ex: FIREBASE_SERVICE_ACCOUNT_KEY):
+#   python auditar_hodometro.py --inicio 2024-01-01 --saida anomalias.csv
+
+COLUNAS = ['placa', 'doc_id', 'horario', 'km', 'km_anterior', 'horario_anterior', 'horas', 'motivo']
+
+
+def comparar(anterior, leitura, velocidade_maxima, tolerancia_km):
+    # anterior/leitura: (utc, doc_id, km, horario). Retorna a linha da anomalia ou None.
+    motivo = avaliar_leitura(anterior[2], anterior[0], leitura[2], leitura[0], velocidade_maxima, tolerancia_km)
+    if motivo is None:
+        return None
+    return {'doc_id': leitura[1], 'horario': leitura[3], 'km': leitura[2], 'km_anterior': anterior[2],
+            'horario_anterior': anterior[3], 'horas': round((leitura[0] - anterior[0]).total_seconds() / 3600, 1),
+            'motivo': motivo}
+
+
+def processar_bloco(armazenamento, inicio, fim, velocidade_maxima, tolerancia_km):
+    # Retorna ({placa: primeira leitura}, {placa: última leitura}, {placa: [anomalias]})
+    primeiras, ultimas, anomalias = {}, {}, defaultdict(list)
+    for doc_id, registro in armazenamento.listar(inicio=inicio, fim=fim):
+        km = registro.get('quilometragem')
+        if km is None or not registro.get('placa'):
+            continue
+        placa = placa_do_registro(registro)
+        leitura = (horario_utc_de(registro), doc_id, km, registro.get('horario', ''))
+        anterior = ultimas.get(placa)
+        if anterior is None:
+            primeiras[placa] = leitura
+        else:
+            anomalia = comparar(anterior, leitura, velocidade_maxima, tolerancia_km)
+            if anomalia:
+                anomalias[placa].append(anomalia)
+        ultimas[placa] = leitura
+    return primeiras, ultimas, anomalias
+
+
+def executar(armazenamento, inicio=None, fim=None, workers=8, dias_por_bloco=7,
+             velocidade_maxima=VELOCIDADE_MAXIMA_KMH, tolerancia_km=TOLERANCIA_KM):
+    inicio_execucao = time.monotonic()
+    fim = fim or agora_utc()
+    if inicio is None:
+        primeiro = next(iter(armazenamento.listar(fim=fim, tamanho_pagina=1)), None)
+        if primeiro is None:
+            print("Nenhum registro com horario_utc encontrado.")
+            return {}
+        inicio = horario_utc_de(primeiro[1])
+
+    blocos = dividir_em_blocos(inicio, fim, dias_por_bloco)
+    if not blocos:
+        print("Intervalo vazio: --inicio precisa ser anterior a --fim.")
+        return {}
+    # O primeiro bloco começa na meia-noite do dia de 'inicio'; respeita o início pedido
+    blocos[0] = (max(blocos[0][0], inicio), blocos[0][1])
+    print(f"Auditando {len(blocos)} blocos de até {dias_por_bloco} dias com {workers} workers...")
+
+    ultimas, anomalias = {}, defaultdict(list)
+    with ThreadPoolExecutor(workers) as executor:
+        resultados = executor.map(
+            lambda b: processar_bloco(armazenamento, *b, velocidade_maxima, tolerancia_km), blocos)
+        # map() devolve os blocos na ordem do tempo, que é a ordem em que precisam ser emendados
+        for primeiras_bloco, ultimas_bloco, anomalias_bloco in resultados:
+            for placa, primeira in primeiras_bloco.items():
+                if placa in ultimas:
+                    anomalia = comparar(ultimas[placa], primeira, velocidade_maxima, tolerancia_km)
+                    if anomalia:
+                        anomalias[placa].append(anomalia)
+                anomalias[placa].extend(anomalias_bloco.get(placa, []))
+            ultimas.update(ultimas_bloco)
+
+    anomalias = {placa: lista for placa, lista in anomalias.items() if lista}
+    total = sum(len(lista) for lista in anomalias.values())
+    print(f"Concluído em {time.monotonic() - inicio_execucao:.1f}s: {total} anomalias em "
+          f"{len(anomalias)} de {len(ultimas)} veículos com quilometragem.")
+    return anomalias
+
+
+def gravar_csv(anomalias, caminho):
+    # Agrupado por veículo, os mais problemáticos primeiro
+    with open(caminho, 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=COLUNAS)
+        escritor.writeheader()
+        for placa, lista in sorted(anomalias.items(), key=lambda item: (-len(item[1]), item[0])):
+            for anomalia in lista:
+                escritor.writerow(dict(anomalia, placa=placa))
+
+
+def data_local(texto):
+    return meia_noite_utc(datetime.strptime(texto, '%Y-%m-%d').date())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lista leituras de quilometragem implausíveis por veículo.')
+    parser.add_argument('--inicio', type=data_local, help='AAAA-MM-DD (horário de São Paulo); padrão: início do histórico')
+    parser.add_argument('--fim', type=data_local, help='AAAA-MM-DD, exclusivo; padrão: agora')
+    parser.add_argument('--workers', type=int, default=8, help='blocos lidos em paralelo')
+    parser.add_argument('--dias-por-bloco', type=int, default=7)
+    parser.add_argument('--velocidade-maxima', type=float, default=VELOCIDADE_MAXIMA_KMH, help='km/h')
+    parser.add_argument('--tolerancia-km', type=float, default=TOLERANCIA_KM)
+    parser.add_argument('--saida', default='anomalias_hodometro.csv')
+    args = parser.parse_args()
+
+    anomalias = executar(criar_armazenamento(), inicio=args.inicio, fim=args.fim, workers=args.workers,
+                         dias_por_bloco=max(1, args.dias_por_bloco), velocidade_maxima=args.velocidade_maxima,
+                         tolerancia_km=args.tolerancia_km)
+    gravar_csv(anomalias, args.saida)
+    for placa, lista in sorted(anomalias.items(), key=lambda item: -len(item[1]))[:10]:
+        print(f"  {placa}: {len(lista)} anomalias ({', '.join(sorted({a['motivo'] for a in lista}))})")
+    print(f"Relatório gravado em {args.saida}.")
+
+
+if __name__ == '__main__':
+    main()
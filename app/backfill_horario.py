@@ -0,0 +1,80 @@
+import argparse
+import time
+
+from armazenamento import LIMITE_LOTE_FIRESTORE, criar_armazenamento
+from horarios import campos_tempo, local_para_utc
+from placas import canonica
+from varredura import carregar_checkpoint, com_retentativa, percorrer
+
+# --- Backfill de horario_utc / dia / semana_iso / placa_canonica nos registros antigos ---
+# Percorre a coleção em ordem de ID, calcula os campos que faltam a partir do texto
+# 'horario' (horário de São Paulo) e da 'placa' (ver placas.py) e grava em lotes de até 500 atualizações, com
+# vários lotes em paralelo e checkpoint (ver varredura.py), então uma execução
+# interrompida continua de onde parou.
+#
+# Uso (mesmas variáveis de ambiente do app, ex: FIREBASE_SERVICE_ACCOUNT_KEY):
+#   python backfill_horario.py --workers 8 --checkpoint backfill_checkpoint.json
+#   python backfill_horario.py --simular      (só conta o que seria atualizado)
+
+
+def campos_faltantes(registro):
+    # Nunca reescreve 'horario'; só completa o que não existe
+    if not registro.get('horario'):
+        return None
+    esperados = campos_tempo(local_para_utc(registro['horario']))
+    del esperados['horario']
+    if registro.get('placa'):
+        esperados['placa_canonica'] = canonica(registro['placa'])
+    faltando = {campo: valor for campo, valor in esperados.items() if campo not in registro}
+    return faltando or None
+
+
+def executar(armazenamento, caminho_checkpoint, workers=8, tamanho_lote=LIMITE_LOTE_FIRESTORE, simular=False):
+    checkpoint = carregar_checkpoint(caminho_checkpoint, ('atualizados', 'sem_horario', 'horario_invalido'))
+    inicio = time.monotonic()
+
+    def preparar(pagina):
+        itens = []
+        sem_horario = horario_invalido = 0
+        for doc_id, registro in pagina:
+            if not registro.get('horario'):
+                sem_horario += 1
+                continue
+            try:
+                campos = campos_faltantes(registro)
+            except ValueError as e:
+                # Texto fora do formato (digitado à mão, importado de planilha...): fica como está
+                print(f"Documento {doc_id} ignorado: {e}")
+                horario_invalido += 1
+                continue
+            if campos:
+                itens.append((doc_id, campos))
+        tarefa = (lambda: com_retentativa(armazenamento.atualizar_lote, itens)) if itens else None
+        return tarefa, {'atualizados': len(itens), 'sem_horario': sem_horario, 'horario_invalido': horario_invalido}
+
+    percorrer(armazenamento.paginas_por_id(apos=checkpoint['ultimo_id'], tamanho_pagina=tamanho_lote),
+              preparar, checkpoint, caminho_checkpoint, workers=workers, simular=simular,
+              progresso=lambda c: print(f"{c['lidos']} lidos, {c['atualizados']} atualizados..."),
+              intervalo_progresso=tamanho_lote * 20)
+
+    duracao = time.monotonic() - inicio
+    acao = 'seriam atualizados' if simular else 'atualizados'
+    print(f"Concluído em {duracao:.1f}s: {checkpoint['lidos']} lidos, {checkpoint['atualizados']} {acao}, "
+          f"{checkpoint['sem_horario']} sem 'horario' e {checkpoint['horario_invalido']} com 'horario' inválido (ignorados).")
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Preenche horario_utc, dia, semana_iso e placa_canonica nos registros antigos.')
+    parser.add_argument('--workers', type=int, default=8, help='lotes gravados em paralelo')
+    parser.add_argument('--tamanho-lote', type=int, default=LIMITE_LOTE_FIRESTORE)
+    parser.add_argument('--checkpoint', default='backfill_checkpoint.json')
+    parser.add_argument('--simular', action='store_true', help='não grava nada, só conta')
+    args = parser.parse_args()
+
+    executar(criar_armazenamento(), args.checkpoint, workers=args.workers,
+             tamanho_lote=min(args.tamanho_lote, LIMITE_LOTE_FIRESTORE), simular=args.simular)
+
+
+if __name__ == '__main__':
+    main()
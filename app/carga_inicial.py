@@ -0,0 +1,111 @@
+import threading
+import time
+from datetime import timedelta
+
+from horarios import agora_utc, horario_utc_de, texto_utc, utc_de_texto
+
+# --- Carga inicial dos índices em memória (sugestões, placas, hodômetro, perfis) ---
+# Uma única leitura em segundo plano dos registros de [agora - maior janela, agora) e
+# dos que ainda estão no journal do write-behind; cada registro vai para os índices
+# cuja janela o inclui (indice.aplicar()), e no fim todos ficam com indice.pronto.
+# Enquanto isso, os registros aceitos chegam pelo aplicar() da carga, que fica em
+# indices_registro no lugar dos índices e repassa a todos eles.
+#
+# Alguns índices contam ocorrências, então nenhum registro pode ser aplicado duas vezes:
+#   - uma falha no meio da leitura é repetida a partir do último registro aplicado (a
+#     listagem vem em ordem de (horario_utc, doc_id)), com espera crescente;
+#   - o journal é lido antes do armazenamento, e os registros dele são pulados na
+#     listagem: um registro gravado durante a carga aparece nos dois, mas entra uma vez só;
+#   - um registro de lote aceito durante a carga tem horário dentro da janela e chega
+#     pelos dois caminhos (aplicar() e leitura). Quem o vê primeiro fica com ele: os
+#     doc_ids desses registros são anotados, e o outro caminho os pula. Na leitura, só
+#     os gravados perto do início da carga (gravado_em) podem ter vindo por aplicar().
+
+ESPERA_INICIAL = 5
+ESPERA_MAXIMA = 300
+MARGEM_GRAVACAO = timedelta(minutes=10)
+
+
+class CargaInicial:
+    def __init__(self, armazenamento, fila_gravacao=None):
+        self._lock = threading.Lock()
+        self._armazenamento = armazenamento
+        self._fila_gravacao = fila_gravacao
+        self._indices = []     # (indice, janela, descricao)
+        self._aplicados = set()  # doc_ids disputados entre aplicar() e a leitura, durante a carga
+        self.fim = None
+        self.carregando = False
+
+    def adicionar(self, indice, janela, descricao='o índice'):
+        # janela: timedelta; descricao: para as mensagens (ex: 'o índice de placas')
+        self._indices.append((indice, janela, descricao))
+
+    def _reservar(self, doc_id):
+        # True se ninguém aplicou o registro ainda; quem chama passa a ser o dono
+        with self._lock:
+            if not self.carregando:
+                return True
+            if doc_id in self._aplicados:
+                return False
+            self._aplicados.add(doc_id)
+            return True
+
+    def _repassar(self, doc_id, registro, indices):
+        for indice in indices:
+            try:
+                indice.aplicar(doc_id, registro)
+            except Exception as e:
+                print(f"Falha ao atualizar índice {type(indice).__name__}: {e}")
+
+    def aplicar(self, doc_id, registro):
+        if (self.carregando and registro.get('horario')
+                and horario_utc_de(registro) < self.fim and not self._reservar(doc_id)):
+            return
+        self._repassar(doc_id, registro, [indice for indice, _, _ in self._indices])
+
+    def _carregar(self, doc_id, registro):
+        gravado_em = registro.get('gravado_em')
+        if gravado_em is not None and gravado_em >= self.fim - MARGEM_GRAVACAO and not self._reservar(doc_id):
+            return
+        momento = horario_utc_de(registro)
+        self._repassar(doc_id, registro, [indice for indice, janela, _ in self._indices if momento >= self.fim - janela])
+
+    def iniciar(self, espera_inicial=ESPERA_INICIAL, espera_maxima=ESPERA_MAXIMA):
+        self.fim = agora_utc()
+        self.carregando = True
+        limite = (texto_utc(self.fim), '')
+        janela = max(janela for _, janela, _ in self._indices)
+        descricoes = ', '.join(descricao for _, _, descricao in self._indices)
+
+        def carregar():
+            pendentes = None
+            ultimo = None  # (horario_utc, doc_id) do último registro aplicado da listagem
+            espera = espera_inicial
+            while True:
+                try:
+                    if pendentes is None:
+                        fila = self._fila_gravacao.pendentes() if self._fila_gravacao is not None else []
+                        pendentes = [(doc_id, registro) for doc_id, registro in fila
+                                     if (texto_utc(horario_utc_de(registro)), doc_id) < limite]
+                        ids_pendentes = {doc_id for doc_id, _ in pendentes}
+                    inicio = utc_de_texto(ultimo[0]) if ultimo else self.fim - janela
+                    for doc_id, registro in self._armazenamento.listar(inicio=inicio, fim=self.fim):
+                        chave = (texto_utc(horario_utc_de(registro)), doc_id)
+                        if (ultimo and chave <= ultimo) or doc_id in ids_pendentes:
+                            continue
+                        self._carregar(doc_id, registro)
+                        ultimo = chave
+                    for doc_id, registro in pendentes:
+                        self._carregar(doc_id, registro)
+                    for indice, _, _ in self._indices:
+                        indice.pronto = True
+                    with self._lock:
+                        self.carregando = False
+                        self._aplicados = set()
+                    return
+                except Exception as e:
+                    print(f"Falha ao carregar {descricoes}: {e}. Nova tentativa em {espera}s.")
+                    time.sleep(espera)
+                    espera = min(espera * 2, espera_maxima)
+
+        threading.Thread(target=carregar, name='carga-inicial', daemon=True).start()
@@ -0,0 +1,60 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from horarios import FORMATO_HORARIO, local_para_utc
+
+# --- Exportação de registros em streaming (CSV / NDJSON) ---
+# Os registros vêm de armazenamento.listar(), que pagina por cursor em blocos de
+# tamanho fixo, e são escritos na resposta conforme chegam: a memória usada não
+# depende do tamanho do período exportado.
+
+COLUNAS_CSV = ['id', 'horario', 'horario_utc', 'dia', 'semana_iso', 'tipo', 'nome', 'placa', 'placa_canonica', 'ordem',
+               'Transportadora', 'quilometragem', 'site', 'hodometro_alerta']
+LINHAS_POR_BLOCO = 200  # Linhas de CSV acumuladas antes de cada envio ao cliente
+FORMATO_DATA = '%Y-%m-%d'
+
+
+def ler_limite(valor, fim=False):
+    # Aceita 'AAAA-MM-DD' ou 'AAAA-MM-DD HH:MM:SS' no horário de São Paulo. Uma data
+    # sozinha como fim inclui o dia inteiro (vira o início do dia seguinte, já que o
+    # fim é exclusivo). Retorna datetime UTC, None se vazio; ValueError se inválido.
+    if not valor:
+        return None
+    valor = valor.strip().replace('T', ' ')
+    try:
+        datetime.strptime(valor, FORMATO_HORARIO)
+    except ValueError:
+        dia = datetime.strptime(valor, FORMATO_DATA)
+        if fim:
+            dia += timedelta(days=1)
+        valor = dia.strftime(FORMATO_HORARIO)
+    return local_para_utc(valor)
+
+
+def _valor_json(valor):
+    # Timestamps do Firestore e datetimes viram texto ISO 8601
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return str(valor)
+
+
+def gerar_ndjson(registros):
+    for doc_id, registro in registros:
+        yield json.dumps(dict(id=doc_id, **registro), ensure_ascii=False, default=_valor_json) + '\n'
+
+
+def gerar_csv(registros):
+    buffer = io.StringIO()
+    escritor = csv.DictWriter(buffer, fieldnames=COLUNAS_CSV, extrasaction='ignore')
+    escritor.writeheader()
+    linhas = 0
+    for doc_id, registro in registros:
+        escritor.writerow(dict(registro, id=doc_id))
+        linhas += 1
+        if linhas % LINHAS_POR_BLOCO == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,189 @@
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from armazenamento import LIMITE_LOTE_FIRESTORE, desserializar, serializar
+
+# --- Fila de gravação (write-behind) com journal local em SQLite ---
+# Cada registro é gravado primeiro em um journal append-only (SQLite em modo WAL)
+# e confirmado imediatamente ao motorista. Uma thread em segundo plano envia os
+# registros pendentes ao armazenamento (Firestore: WriteBatch de até 500 documentos).
+# Cada registro recebe um ID de documento fixo no momento em que entra no journal,
+# então reenviar um lote (após falha ou reinício) nunca duplica registros.
+
+
+class FilaGravacao:
+    def __init__(self, armazenamento, caminho_journal, tamanho_lote=LIMITE_LOTE_FIRESTORE,
+                 intervalo=0.5, espera_maxima=60.0):
+        self.armazenamento = armazenamento
+        self.tamanho_lote = min(tamanho_lote, LIMITE_LOTE_FIRESTORE)
+        self.intervalo = intervalo
+        self.espera_maxima = espera_maxima
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho_journal, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # FULL: cada commit vai para o disco antes de o registro ser confirmado ao motorista
+        # (com NORMAL, uma queda de energia pode perder os últimos commits do WAL)
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                doc_id TEXT NOT NULL,
+                dados TEXT NOT NULL,
+                criado_em REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_journal_doc_id ON journal (doc_id)')
+        # Registros no journal, mantido em memória: enfileirar() consulta a cada check-in
+        self._pendentes = self._conn.execute('SELECT COUNT(*) FROM journal').fetchone()[0]
+
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+        # Contadores expostos em /fila/status
+        self.enfileirados = 0
+        self.gravados = 0
+        self.lotes = 0
+        self.falhas = 0
+        self.ultima_latencia_flush = 0.0
+        self.soma_latencia_flush = 0.0
+        self.ultimo_erro = None
+
+    def iniciar(self):
+        # Registros que ficaram no journal de uma execução anterior são reenviados
+        # naturalmente no primeiro ciclo da thread.
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='fila-gravacao', daemon=True)
+            self._thread.start()
+
+    def parar(self, timeout=10.0):
+        self._parar.set()
+        self._acordar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def enfileirar(self, registro):
+        doc_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO journal (doc_id, dados, criado_em) VALUES (?, ?, ?)',
+                (doc_id, serializar(registro), time.time()),
+            )
+            self.enfileirados += 1
+            self._pendentes += 1
+            cheio = self._pendentes >= self.tamanho_lote
+        if cheio:
+            self._acordar.set()
+        return doc_id
+
+    def enfileirar_lote(self, itens):
+        # itens: lista de (doc_id, registro), gravados no journal numa única transação
+        agora = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    'INSERT INTO journal (doc_id, dados, criado_em) VALUES (?, ?, ?)',
+                    [(doc_id, serializar(registro), agora) for doc_id, registro in itens],
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            self.enfileirados += len(itens)
+            self._pendentes += len(itens)
+        self._acordar.set()
+        return [doc_id for doc_id, _ in itens]
+
+    def profundidade(self):
+        return self._pendentes
+
+    def estatisticas(self):
+        return {
+            'profundidade': self.profundidade(),
+            'enfileirados': self.enfileirados,
+            'gravados': self.gravados,
+            'lotes': self.lotes,
+            'falhas': self.falhas,
+            'ultima_latencia_flush_ms': round(self.ultima_latencia_flush * 1000, 2),
+            'media_latencia_flush_ms': round(self.soma_latencia_flush / self.lotes * 1000, 2) if self.lotes else 0.0,
+            'ultimo_erro': self.ultimo_erro,
+        }
+
+    def pendentes(self):
+        # Registros aceitos que ainda não chegaram ao armazenamento, em ordem de chegada
+        with self._lock:
+            linhas = self._conn.execute('SELECT doc_id, dados FROM journal ORDER BY seq').fetchall()
+        return [(doc_id, desserializar(dados)) for doc_id, dados in linhas]
+
+    def contem(self, doc_ids):
+        # Conjunto dos doc_ids que estão no journal, ainda não enviados ao armazenamento
+        encontrados = set()
+        with self._lock:
+            for i in range(0, len(doc_ids), LIMITE_LOTE_FIRESTORE):
+                bloco = doc_ids[i:i + LIMITE_LOTE_FIRESTORE]
+                marcadores = ', '.join('?' * len(bloco))
+                linhas = self._conn.execute(f'SELECT doc_id FROM journal WHERE doc_id IN ({marcadores})', bloco)
+                encontrados.update(linha[0] for linha in linhas)
+        return encontrados
+
+    def _proximo_lote(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT seq, doc_id, dados FROM journal ORDER BY seq LIMIT ?', (self.tamanho_lote,)
+            ).fetchall()
+
+    def _remover_ate(self, seq):
+        with self._lock:
+            removidos = self._conn.execute('DELETE FROM journal WHERE seq <= ?', (seq,)).rowcount
+            self._pendentes = max(0, self._pendentes - removidos)
+
+    def flush(self):
+        # Envia um lote ao armazenamento. Retorna quantos registros foram gravados.
+        linhas = self._proximo_lote()
+        if not linhas:
+            return 0
+
+        inicio = time.monotonic()
+        self.armazenamento.adicionar_lote([(doc_id, desserializar(dados)) for _, doc_id, dados in linhas])
+
+        self._remover_ate(linhas[-1][0])
+        self.ultima_latencia_flush = time.monotonic() - inicio
+        self.soma_latencia_flush += self.ultima_latencia_flush
+        self.lotes += 1
+        self.gravados += len(linhas)
+        return len(linhas)
+
+    def _loop(self):
+        tentativas = 0
+        while not self._parar.is_set():
+            try:
+                gravados = self.flush()
+                tentativas = 0
+                self.ultimo_erro = None
+            except Exception as e:
+                self.falhas += 1
+                self.ultimo_erro = str(e)
+                tentativas += 1
+                # Backoff exponencial com jitter, limitado a espera_maxima
+                espera = min(self.espera_maxima, self.intervalo * (2 ** tentativas))
+                print(f"Falha ao enviar lote ao armazenamento (tentativa {tentativas}): {e}. Nova tentativa em {espera:.1f}s.")
+                self._parar.wait(espera * random.uniform(0.5, 1.0))
+                continue
+
+            # Lote cheio: provavelmente há mais registros pendentes, segue sem esperar
+            if gravados >= self.tamanho_lote:
+                continue
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+
+        # Última tentativa de esvaziar o journal ao encerrar o processo
+        try:
+            while self.flush():
+                pass
+        except Exception as e:
+            print(f"Journal não foi totalmente enviado ao encerrar; será reenviado no próximo início: {e}")
@@ -0,0 +1,142 @@
+import os
+import json
+import math
+
+# --- Geofence dos pátios (validação de localização no servidor) ---
+# Os sites (pátios/portarias) são carregados de um JSON (SITES_CONFIG: caminho do
+# arquivo ou o próprio JSON; padrão sites.json ao lado deste arquivo). Cada site é
+# um círculo {"lat", "lon", "raio_m"} ou um polígono {"pontos": [[lat, lon], ...]}.
+#
+# Para a verificação continuar abaixo de 1 ms com muitos sites, eles são indexados
+# numa grade de células de TAMANHO_CELULA graus: cada site é registrado em todas as
+# células que sua caixa envolvente toca, e uma consulta só testa os sites da célula
+# onde a coordenada cai.
+
+TAMANHO_CELULA = 0.01  # ~1,1 km de latitude
+METROS_POR_GRAU = 111320.0
+
+SITE_PADRAO = {
+    'id': 'itapevi',
+    'nome': 'Itapevi/SP',
+    'lat': -23.516185,
+    'lon': -46.965741,
+    'raio_m': 300,
+}
+
+
+# Função para calcular distância (Haversine)
+def calcular_distancia(lat1, lon1, lat2, lon2):
+    R = 6371000 # Raio da Terra em metros
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+    a = math.sin(delta_phi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+def ponto_no_poligono(lat, lon, pontos):
+    # Ray casting no plano lat/lon (suficiente para polígonos do tamanho de um pátio)
+    dentro = False
+    j = len(pontos) - 1
+    for i in range(len(pontos)):
+        lat_i, lon_i = pontos[i]
+        lat_j, lon_j = pontos[j]
+        if (lat_i > lat) != (lat_j > lat) and \
+                lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+            dentro = not dentro
+        j = i
+    return dentro
+
+
+class Site:
+    def __init__(self, config):
+        self.id = str(config['id'])
+        self.nome = config.get('nome', self.id)
+        self.pontos = [(float(lat), float(lon)) for lat, lon in config.get('pontos', [])]
+        if self.pontos:
+            self.lat = sum(p[0] for p in self.pontos) / len(self.pontos)
+            self.lon = sum(p[1] for p in self.pontos) / len(self.pontos)
+            self.raio_m = None
+            lats = [p[0] for p in self.pontos]
+            lons = [p[1] for p in self.pontos]
+            self.caixa = (min(lats), min(lons), max(lats), max(lons))
+        else:
+            self.lat = float(config['lat'])
+            self.lon = float(config['lon'])
+            self.raio_m = float(config['raio_m'])
+            delta_lat = self.raio_m / METROS_POR_GRAU
+            delta_lon = self.raio_m / (METROS_POR_GRAU * max(math.cos(math.radians(self.lat)), 1e-6))
+            self.caixa = (self.lat - delta_lat, self.lon - delta_lon, self.lat + delta_lat, self.lon + delta_lon)
+
+    def distancia(self, lat, lon):
+        return calcular_distancia(lat, lon, self.lat, self.lon)
+
+    def contem(self, lat, lon):
+        lat_min, lon_min, lat_max, lon_max = self.caixa
+        if not (lat_min <= lat <= lat_max and lon_min <= lon <= lon_max):
+            return False
+        if self.pontos:
+            return ponto_no_poligono(lat, lon, self.pontos)
+        return self.distancia(lat, lon) <= self.raio_m
+
+
+class Geofence:
+    def __init__(self, sites, tamanho_celula=TAMANHO_CELULA):
+        self.sites = [Site(s) for s in sites]
+        self.tamanho_celula = tamanho_celula
+        self._grade = {}
+        for site in self.sites:
+            lat_min, lon_min, lat_max, lon_max = site.caixa
+            for i in range(self._celula(lat_min), self._celula(lat_max) + 1):
+                for j in range(self._celula(lon_min), self._celula(lon_max) + 1):
+                    self._grade.setdefault((i, j), []).append(site)
+
+    def _celula(self, valor):
+        return math.floor(valor / self.tamanho_celula)
+
+    def localizar(self, lat, lon):
+        # Retorna o site que contém a coordenada (o de centro mais próximo, se houver
+        # sobreposição) ou None.
+        candidatos = self._grade.get((self._celula(lat), self._celula(lon)), ())
+        encontrados = [site for site in candidatos if site.contem(lat, lon)]
+        if not encontrados:
+            return None
+        return min(encontrados, key=lambda site: site.distancia(lat, lon))
+
+    def mais_proximo(self, lat, lon):
+        # Usado só para a mensagem de erro de quem está fora: percorre todos os sites
+        site = min(self.sites, key=lambda s: s.distancia(lat, lon))
+        return site, site.distancia(lat, lon)
+
+
+def carregar_sites():
+    config = os.environ.get('SITES_CONFIG', '').strip()
+    caminho = config or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sites.json')
+    if config.startswith('['):
+        sites = json.loads(config)
+    elif os.path.exists(caminho):
+        with open(caminho, encoding='utf-8') as f:
+            sites = json.load(f)
+    elif config:
+        print(f"ERRO CRÍTICO: arquivo de sites '{config}' (SITES_CONFIG) não encontrado.")
+        exit(1)
+    else:
+        sites = [SITE_PADRAO]
+    if not sites:
+        print("ERRO CRÍTICO: nenhum site configurado para o geofence.")
+        exit(1)
+    return sites
+
+
+def ler_coordenadas(valor_lat, valor_lon):
+    # Converte os campos do formulário; retorna (lat, lon) ou None se inválidos
+    try:
+        lat = float(valor_lat)
+        lon = float(valor_lon)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):  # também descarta NaN
+        return None
+    return lat, lon
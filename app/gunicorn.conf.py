@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+
+# --- Configuração do gunicorn (lida automaticamente do diretório de trabalho, /app no contêiner) ---
+# Todos os valores podem ser trocados por variáveis de ambiente sem rebuild da imagem.
+
+
+def _cpus():
+    # CPUs que o processo pode usar de fato (respeita cpuset do contêiner)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+CPUS = _cpus()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# Um único processo por padrão: os índices em memória (pátio, sugestões, agregados,
+# deduplicação) e o canal do feed ao vivo são por processo, e com vários workers cada um
+# veria só uma parte dos registros. Instâncias têm o mesmo problema, por isso o serviço
+# roda com no máximo uma (maxScale "1" em service.yaml, ao lado do Dockerfile). A
+# concorrência vem das threads; para mais capacidade, aumente as CPUs da instância.
+workers = int(os.environ.get('GUNICORN_WORKERS', '1'))
+worker_class = 'gthread'
+
+# As requisições passam a maior parte do tempo esperando o Firestore, então cabem ~25
+# threads por CPU. Cada painel do feed ao vivo prende uma thread enquanto está conectado,
+# por isso o limite de painéis (AO_VIVO_MAXIMO_CLIENTES) entra por cima.
+threads = int(os.environ.get('GUNICORN_THREADS',
+                             25 * CPUS + int(os.environ.get('AO_VIVO_MAXIMO_CLIENTES', '50'))))
+
+# Sem preload: o app (cliente do Firestore, threads dos índices e da fila de gravação)
+# precisa ser criado dentro do worker, depois do fork. Threads e canais gRPC não
+# sobrevivem ao fork.
+preload_app = False
+
+# O Cloud Run espera 10 s entre o SIGTERM e o SIGKILL; conexões do feed ao vivo não
+# terminam sozinhas, então o desligamento não pode esperar os 30 s padrão.
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '8'))
+keepalive = 5
+
+# Heartbeat do worker em memória: em disco de overlay do contêiner ele pode travar o worker
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
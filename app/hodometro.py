@@ -0,0 +1,92 @@
+import threading
+from datetime import timedelta
+
+from horarios import horario_utc_de, texto_utc, utc_de_texto
+from placas import placa_do_registro
+
+# --- Consistência do hodômetro (quilometragem) por placa ---
+# Guarda em memória a última leitura aceita de cada placa canônica (km, horário e doc_id). Uma
+# leitura nova é implausível se for menor que a anterior ('regrediu') ou se a diferença
+# exigir uma velocidade média acima de VELOCIDADE_MAXIMA_KMH no tempo decorrido, com uma
+# folga de TOLERANCIA_KM ('salto', tipicamente um dígito a mais). A conferência é uma
+# consulta ao dicionário, feita antes de gravar.
+#
+# Leituras sinalizadas não viram referência: um erro de digitação não contamina as
+# leituras seguintes. Elas ficam como 'suspeita'; se a próxima leitura for plausível
+# em relação à suspeita (ex: hodômetro trocado), ela é aceita e passa a ser a referência.
+#
+# O índice é carregado em segundo plano com os registros dos últimos JANELA_PADRAO_DIAS
+# dias; até lá, e para placas sem histórico, nenhuma leitura é sinalizada.
+
+VELOCIDADE_MAXIMA_KMH = 120
+TOLERANCIA_KM = 50
+JANELA_PADRAO_DIAS = 180
+MODOS = ('sinalizar', 'rejeitar', 'desligado')
+
+
+def avaliar_leitura(km_anterior, momento_anterior, km, momento,
+                    velocidade_maxima=VELOCIDADE_MAXIMA_KMH, tolerancia_km=TOLERANCIA_KM):
+    # Retorna None se 'km' é plausível depois da leitura anterior, senão 'regrediu' ou 'salto'
+    if km < km_anterior:
+        return 'regrediu'
+    horas = max(0.0, (momento - momento_anterior).total_seconds() / 3600)
+    if km - km_anterior > tolerancia_km + velocidade_maxima * horas:
+        return 'salto'
+    return None
+
+
+def descrever(motivo, km, referencia):
+    # Mensagem para o motorista / resultado do lote. referencia: leitura anterior (dict)
+    if motivo == 'regrediu':
+        return (f"A quilometragem informada ({km} km) é menor que a do último registro deste veículo "
+                f"({referencia['km']} km). Confira o valor.")
+    return (f"A quilometragem informada ({km} km) é alta demais em relação ao último registro deste veículo "
+            f"({referencia['km']} km em {referencia['horario']}). Confira o valor.")
+
+
+class IndiceHodometro:
+    def __init__(self, velocidade_maxima=VELOCIDADE_MAXIMA_KMH, tolerancia_km=TOLERANCIA_KM):
+        self.velocidade_maxima = velocidade_maxima
+        self.tolerancia_km = tolerancia_km
+        self._leituras = {}  # placa -> {'km', 'utc', 'horario', 'doc_id', 'suspeita': leitura ou None}
+        self._lock = threading.Lock()
+        self.pronto = False
+
+    def _avaliar(self, leitura, km, momento):
+        return avaliar_leitura(leitura['km'], utc_de_texto(leitura['utc']), km, momento,
+                               self.velocidade_maxima, self.tolerancia_km)
+
+    def conferir(self, placa, km, momento):
+        # placa: canônica. Retorna (motivo, leitura de referência); motivo None se a leitura é plausível
+        with self._lock:
+            estado = self._leituras.get(placa)
+        if estado is None or texto_utc(momento) <= estado['utc']:
+            # Sem histórico, ou registro retroativo (sincronização em lote): nada a comparar
+            return None, None
+        motivo = self._avaliar(estado, km, momento)
+        suspeita = estado['suspeita']
+        if motivo is not None and suspeita is not None and texto_utc(momento) > suspeita['utc'] \
+                and self._avaliar(suspeita, km, momento) is None:
+            return None, None  # Confirma a leitura suspeita anterior
+        return motivo, estado if motivo is not None else None
+
+    def aplicar(self, doc_id, registro):
+        km = registro.get('quilometragem')
+        if km is None or not registro.get('placa') or not registro.get('horario'):
+            return
+        placa = placa_do_registro(registro)
+        leitura = {'km': km, 'utc': texto_utc(horario_utc_de(registro)), 'horario': registro['horario'],
+                   'doc_id': doc_id}
+        with self._lock:
+            estado = self._leituras.get(placa)
+            if estado is not None and (leitura['utc'], doc_id) <= (estado['utc'], estado['doc_id']):
+                return  # Mais antiga que a referência (carga do histórico chegando depois)
+            if estado is not None and registro.get('hodometro_alerta'):
+                estado['suspeita'] = leitura
+            else:
+                self._leituras[placa] = dict(leitura, suspeita=None)
+
+    def iniciar(self, carga, janela_dias=JANELA_PADRAO_DIAS):
+        # carga: CargaInicial do app (ver carga_inicial.py). A ordem não importa: aplicar()
+        # ignora leituras mais antigas que a referência
+        carga.adicionar(self, timedelta(days=janela_dias), 'o índice de hodômetro')
@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+import pytz
+
+# --- Horários dos registros ---
+# Cada registro guarda:
+#   horario_utc -> timestamp nativo em UTC (Timestamp no Firestore); é o campo usado
+#                  em consultas por período e na ordenação
+#   horario     -> texto no horário de São Paulo, mantido para exibição e compatibilidade
+#   dia         -> 'AAAA-MM-DD' (dia local da operação), chave de partição diária
+#   semana_iso  -> 'AAAA-Www', chave de partição semanal
+# Registros antigos só têm 'horario'; backfill_horario.py completa os demais campos.
+
+FUSO = pytz.timezone('America/Sao_Paulo')
+FORMATO_HORARIO = '%Y-%m-%d %H:%M:%S'
+FORMATO_UTC = '%Y-%m-%dT%H:%M:%S.%fZ'  # Largura fixa: ordem do texto == ordem do tempo
+
+
+def agora_utc():
+    return datetime.now(timezone.utc)
+
+
+def campos_tempo(momento):
+    local = momento.astimezone(FUSO)
+    ano, semana, _ = local.isocalendar()
+    return {
+        'horario': local.strftime(FORMATO_HORARIO),
+        'horario_utc': momento.astimezone(timezone.utc),
+        'dia': local.strftime('%Y-%m-%d'),
+        'semana_iso': f'{ano}-W{semana:02d}',
+    }
+
+
+def local_para_utc(texto):
+    # 'AAAA-MM-DD HH:MM:SS' em horário de São Paulo -> datetime UTC
+    return FUSO.localize(datetime.strptime(texto, FORMATO_HORARIO), is_dst=False).astimezone(timezone.utc)
+
+
+def ler_horario(texto):
+    # ISO 8601 com fuso ('2024-05-01T08:00:00-03:00', '...Z') ou sem fuso, que é lido
+    # como horário de São Paulo. Retorna datetime UTC; ValueError se inválido.
+    momento = datetime.fromisoformat(str(texto).strip().replace('Z', '+00:00'))
+    if momento.tzinfo is None:
+        momento = FUSO.localize(momento, is_dst=False)
+    return momento.astimezone(timezone.utc)
+
+
+def horario_utc_de(registro):
+    # Usa horario_utc quando existe; registros antigos caem no texto local
+    momento = registro.get('horario_utc')
+    if isinstance(momento, datetime):
+        return momento if momento.tzinfo else momento.replace(tzinfo=timezone.utc)
+    if isinstance(momento, str):
+        return utc_de_texto(momento)
+    return local_para_utc(registro['horario'])
+
+
+def texto_utc(momento):
+    return momento.astimezone(timezone.utc).strftime(FORMATO_UTC)
+
+
+def utc_de_texto(texto):
+    return datetime.strptime(texto, FORMATO_UTC).replace(tzinfo=timezone.utc)
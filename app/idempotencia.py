@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+
+# --- Deduplicação de envios repetidos em /registrar ---
+# Toque duplo em "Registrar" ou reenvio do navegador após timeout geram o mesmo
+# POST de novo. Cada envio aceito reserva suas chaves (o token do formulário e a
+# tupla placa/ordem/tipo) por uma janela curta, junto com o conteúdo do envio; um
+# envio que encontra qualquer uma delas reservada com o mesmo conteúdo é tratado como
+# repetição e não grava nada.
+#
+# O conteúdo existe por causa do token: num celular compartilhado, o "voltar" do
+# navegador reabre o formulário com o token do motorista anterior. Um envio com esse
+# token e outra placa/ordem/tipo é novo, e o token passa a ser dele.
+#
+# A reserva é feita antes da gravação e sob lock, então dois envios simultâneos
+# não passam os dois. Se a gravação falhar, as chaves são liberadas para que a
+# nova tentativa do motorista seja aceita.
+
+JANELA_PADRAO_SEGUNDOS = 120
+TAMANHO_MAXIMO = 10000
+
+
+class CacheDeduplicacao:
+    def __init__(self, janela=JANELA_PADRAO_SEGUNDOS, tamanho_maximo=TAMANHO_MAXIMO):
+        self.janela = janela
+        self.tamanho_maximo = tamanho_maximo
+        self._chaves = OrderedDict()  # chave -> (instante em que expira, conteúdo), em ordem de inserção
+        self._lock = threading.Lock()
+
+    def _expirar(self, agora):
+        while self._chaves:
+            chave, (expira, _) = next(iter(self._chaves.items()))
+            if expira > agora and len(self._chaves) <= self.tamanho_maximo:
+                break
+            del self._chaves[chave]
+
+    def reservar(self, chaves, conteudo=None):
+        # Retorna True se o envio é novo (e reserva as chaves), False se é repetição
+        agora = time.monotonic()
+        with self._lock:
+            self._expirar(agora)
+            for chave in chaves:
+                reserva = self._chaves.get(chave)
+                if reserva is not None and reserva[1] == conteudo:
+                    return False
+            for chave in chaves:
+                self._chaves.pop(chave, None)  # Reinsere no fim, na ordem de expiração
+                self._chaves[chave] = (agora + self.janela, conteudo)
+            self._expirar(agora)  # Respeita tamanho_maximo
+            return True
+
+    def liberar(self, chaves):
+        with self._lock:
+            for chave in chaves:
+                self._chaves.pop(chave, None)
+
+    def __len__(self):
+        return len(self._chaves)
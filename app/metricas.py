@@ -0,0 +1,217 @@
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+# --- Métricas no formato texto do Prometheus ---
+# Implementação mínima (sem dependência externa): contadores, medidores e
+# histogramas com rótulos, todos protegidos por lock e baratos de atualizar.
+# GET /metrics chama exportar(), que também consulta os coletores registrados
+# (funções que leem o estado da fila de gravação, do índice de ocupação etc.).
+
+BALDES_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(nomes, valores):
+    if not nomes:
+        return ''
+    return '{' + ','.join(f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)) + '}'
+
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nome, descricao, rotulos=()):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **rotulos):
+        chave = tuple(rotulos.get(n, '') for n in self.rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def valor(self, **rotulos):
+        return self._valores.get(tuple(rotulos.get(n, '') for n in self.rotulos), 0)
+
+    def linhas(self):
+        with self._lock:
+            itens = sorted(self._valores.items())
+        return [f'{self.nome}{_rotulos(self.rotulos, chave)} {valor}' for chave, valor in itens]
+
+
+class Medidor(Contador):
+    tipo = 'gauge'
+
+    def dec(self, valor=1, **rotulos):
+        self.inc(-valor, **rotulos)
+
+    def definir(self, valor, **rotulos):
+        chave = tuple(rotulos.get(n, '') for n in self.rotulos)
+        with self._lock:
+            self._valores[chave] = valor
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nome, descricao, rotulos=(), baldes=BALDES_PADRAO):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self.baldes = tuple(baldes)
+        self._series = {}  # rótulos -> [contagens por balde..., soma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **rotulos):
+        chave = tuple(rotulos.get(n, '') for n in self.rotulos)
+        indice = bisect_left(self.baldes, valor)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [0] * (len(self.baldes) + 2)
+            if indice < len(self.baldes):
+                serie[indice] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    @contextmanager
+    def medir(self, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **rotulos)
+
+    def linhas(self):
+        with self._lock:
+            series = sorted((chave, list(serie)) for chave, serie in self._series.items())
+        saida = []
+        for chave, serie in series:
+            acumulado = 0
+            for limite, contagem in zip(self.baldes, serie):
+                acumulado += contagem
+                saida.append(f'{self.nome}_bucket{_rotulos(self.rotulos + ("le",), chave + (limite,))} {acumulado}')
+            saida.append(f'{self.nome}_bucket{_rotulos(self.rotulos + ("le",), chave + ("+Inf",))} {serie[-1]}')
+            saida.append(f'{self.nome}_sum{_rotulos(self.rotulos, chave)} {serie[-2]}')
+            saida.append(f'{self.nome}_count{_rotulos(self.rotulos, chave)} {serie[-1]}')
+        return saida
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = []
+        self._coletores = []
+
+    def adicionar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nome, descricao, rotulos=()):
+        return self.adicionar(Contador(nome, descricao, rotulos))
+
+    def medidor(self, nome, descricao, rotulos=()):
+        return self.adicionar(Medidor(nome, descricao, rotulos))
+
+    def histograma(self, nome, descricao, rotulos=(), baldes=BALDES_PADRAO):
+        return self.adicionar(Histograma(nome, descricao, rotulos, baldes))
+
+    def coletor(self, funcao):
+        # funcao() é chamada a cada exportação; usada para medidores lidos de outro estado
+        self._coletores.append(funcao)
+        return funcao
+
+    def exportar(self):
+        for coletor in self._coletores:
+            try:
+                coletor()
+            except Exception as e:
+                print(f"Falha em coletor de métricas {coletor.__name__}: {e}")
+        saida = []
+        for metrica in self._metricas:
+            saida.append(f'# HELP {metrica.nome} {metrica.descricao}')
+            saida.append(f'# TYPE {metrica.nome} {metrica.tipo}')
+            saida.extend(metrica.linhas())
+        return '\n'.join(saida) + '\n'
+
+
+REGISTRO = Registro()
+
+# --- Métricas do app ---
+requisicoes = REGISTRO.contador('motoristas_http_requisicoes_total', 'Requisições HTTP por rota, método e status.',
+                                ('rota', 'metodo', 'status'))
+duracao_requisicao = REGISTRO.histograma('motoristas_http_duracao_segundos', 'Latência das requisições por rota.',
+                                         ('rota', 'metodo'))
+em_andamento = REGISTRO.medidor('motoristas_http_em_andamento', 'Requisições sendo processadas agora.')
+duracao_gravacao = REGISTRO.histograma('motoristas_gravacao_duracao_segundos',
+                                       'Tempo da gravação de um registro (armazenamento ou journal).', ('destino',))
+erros_armazenamento = REGISTRO.contador('motoristas_armazenamento_erros_total',
+                                        'Falhas ao gravar registros no armazenamento.', ('destino',))
+deduplicacao = REGISTRO.contador('motoristas_deduplicacao_total',
+                                  'Envios válidos de /registrar por resultado: novo ou repetido (gravação evitada).',
+                                  ('resultado',))
+falhas_validacao = REGISTRO.contador('motoristas_validacao_falhas_total',
+                                     'Registros recusados na validação (/registrar e lote), por motivo.', ('motivo',))
+alertas_hodometro = REGISTRO.contador('motoristas_hodometro_alertas_total',
+                                      'Leituras de quilometragem implausíveis, por motivo e ação tomada.',
+                                      ('motivo', 'acao'))
+recusas_admissao = REGISTRO.contador('motoristas_admissao_recusas_total',
+                                     'Requisições recusadas pelo controle de admissão, por rota e motivo.',
+                                     ('rota', 'motivo'))
+consultas_perfil = REGISTRO.contador('motoristas_perfil_consultas_total',
+                                     'Consultas ao cache de perfis para preencher o formulário, por resultado.',
+                                     ('resultado',))
+registros_lote = REGISTRO.contador('motoristas_lote_registros_total',
+                                   'Itens recebidos em /api/registros/lote, por resultado.', ('resultado',))
+
+
+# --- Amostrador de requisições lentas (opcional) ---
+# Com PERFIL_LENTO_MS definido, uma thread coleta a pilha das threads que estão
+# atendendo requisições a cada 'intervalo' segundos. Quando uma requisição passa do
+# limite, as pilhas mais frequentes dela são impressas no log.
+
+class AmostradorLento:
+    def __init__(self, limite_ms, intervalo=0.01, profundidade=15, top=5):
+        self.limite = limite_ms / 1000
+        self.intervalo = intervalo
+        self.profundidade = profundidade
+        self.top = top
+        self._ativas = {}  # thread id -> Counter de pilhas
+        self._lock = threading.Lock()
+        threading.Thread(target=self._loop, name='amostrador-lento', daemon=True).start()
+
+    def iniciar_requisicao(self):
+        with self._lock:
+            self._ativas[threading.get_ident()] = Counter()
+
+    def finalizar_requisicao(self, descricao, duracao):
+        with self._lock:
+            amostras = self._ativas.pop(threading.get_ident(), None)
+        if amostras and duracao >= self.limite:
+            total = sum(amostras.values())
+            print(f"Requisição lenta ({duracao * 1000:.0f} ms): {descricao}. Pilhas mais frequentes ({total} amostras):")
+            for pilha, contagem in amostras.most_common(self.top):
+                print(f"  {contagem}/{total} amostras:\n" + ''.join(traceback.format_list(list(pilha))))
+
+    def _loop(self):
+        while True:
+            time.sleep(self.intervalo)
+            with self._lock:
+                ativas = list(self._ativas.items())
+            if not ativas:
+                continue
+            frames = sys._current_frames()
+            for thread_id, amostras in ativas:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    pilha = tuple(traceback.extract_stack(frame, limit=self.profundidade))
+                    amostras[tuple((f.filename, f.lineno, f.name, f.line) for f in pilha)] += 1
@@ -0,0 +1,91 @@
+import argparse
+import time
+
+from armazenamento import LIMITE_LOTE_FIRESTORE, ArmazenamentoParticionado, criar_armazenamento
+from varredura import carregar_checkpoint, com_retentativa, percorrer
+
+# --- Migração da coleção única 'registros' para as partições por site ---
+# Percorre a partição padrão (a coleção original) em ordem de ID e copia cada registro
+# com 'site' para a partição do site, com o mesmo ID. Com --remover, apaga da coleção
+# original os registros já copiados; sem ele, as consultas do app ignoram a cópia
+# duplicada até a remoção. Registros sem site ficam onde estão.
+#
+# Copiar de novo é inofensivo (set() com o mesmo ID), e o checkpoint guarda o último ID
+# cujo lote (e todos os anteriores) já foi concluído (ver varredura.py). Cópia e remoção
+# têm checkpoints separados: o checkpoint guarda o modo e uma execução no outro modo é
+# recusada, porque retomar a cópia com --remover não removeria o que já foi copiado.
+#
+# Uso (mesmas variáveis de ambiente do app, com PARTICIONAR_POR_SITE=1):
+#   python migrar_particoes.py --workers 8
+#   python migrar_particoes.py --remover      (checkpoint migracao_remocao_checkpoint.json)
+#   python migrar_particoes.py --simular      (só conta o que seria copiado)
+
+
+def migrar_pagina(armazenamento, grupos, remover):
+    # grupos: {site: [(doc_id, registro)]}. Só remove da origem depois de todas as cópias.
+    for site, itens in grupos.items():
+        com_retentativa(armazenamento.particao(site).adicionar_lote, itens)
+    doc_ids = [doc_id for itens in grupos.values() for doc_id, _ in itens]
+    if remover:
+        com_retentativa(armazenamento.padrao.remover_lote, doc_ids)
+    return {'copiados': len(doc_ids), 'removidos': len(doc_ids) if remover else 0}
+
+
+def executar(armazenamento, caminho_checkpoint, workers=8, tamanho_lote=LIMITE_LOTE_FIRESTORE,
+             remover=False, simular=False):
+    modo = 'mover' if remover else 'copiar'
+    checkpoint = carregar_checkpoint(caminho_checkpoint, ('copiados', 'removidos', 'sem_site'), modo=modo)
+    # Retomar uma cópia com --remover pularia a remoção de tudo que já foi copiado
+    if checkpoint['modo'] != modo:
+        print(f"ERRO CRÍTICO: o checkpoint {caminho_checkpoint} é de uma execução no modo '{checkpoint['modo']}'. "
+              f"Use outro --checkpoint para o modo '{modo}'.")
+        exit(1)
+    inicio = time.monotonic()
+
+    def preparar(pagina):
+        grupos = {}
+        sem_site = 0
+        for doc_id, registro in pagina:
+            if registro.get('site'):
+                grupos.setdefault(registro['site'], []).append((doc_id, registro))
+            else:
+                sem_site += 1
+        tarefa = (lambda: migrar_pagina(armazenamento, grupos, remover)) if grupos else None
+        contagens = {'sem_site': sem_site}
+        if simular:
+            contagens['copiados'] = sum(len(itens) for itens in grupos.values())
+        return tarefa, contagens
+
+    percorrer(armazenamento.padrao.paginas_por_id(apos=checkpoint['ultimo_id'], tamanho_pagina=tamanho_lote),
+              preparar, checkpoint, caminho_checkpoint, workers=workers, simular=simular,
+              progresso=lambda c: print(f"{c['lidos']} lidos, {c['copiados']} copiados, {c['removidos']} removidos..."),
+              intervalo_progresso=tamanho_lote * 20)
+
+    duracao = time.monotonic() - inicio
+    acao = 'seriam copiados' if simular else 'copiados'
+    print(f"Concluído em {duracao:.1f}s: {checkpoint['lidos']} lidos, {checkpoint['copiados']} {acao} "
+          f"para as partições, {checkpoint['removidos']} removidos da coleção original, "
+          f"{checkpoint['sem_site']} sem 'site' (ficam na coleção original).")
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Copia (ou move) os registros da coleção única para as partições por site.')
+    parser.add_argument('--workers', type=int, default=8, help='lotes gravados em paralelo')
+    parser.add_argument('--tamanho-lote', type=int, default=LIMITE_LOTE_FIRESTORE)
+    parser.add_argument('--checkpoint', help='padrão: migracao_checkpoint.json, ou migracao_remocao_checkpoint.json com --remover')
+    parser.add_argument('--remover', action='store_true', help='apaga da coleção original o que já foi copiado')
+    parser.add_argument('--simular', action='store_true', help='não grava nada, só conta')
+    args = parser.parse_args()
+
+    armazenamento = criar_armazenamento()
+    if not isinstance(armazenamento, ArmazenamentoParticionado):
+        print("ERRO CRÍTICO: defina PARTICIONAR_POR_SITE=1 para migrar para as partições por site.")
+        exit(1)
+    caminho_checkpoint = args.checkpoint or ('migracao_remocao_checkpoint.json' if args.remover else 'migracao_checkpoint.json')
+    executar(armazenamento, caminho_checkpoint, workers=args.workers,
+             tamanho_lote=min(args.tamanho_lote, LIMITE_LOTE_FIRESTORE), remover=args.remover, simular=args.simular)
+
+
+if __name__ == '__main__':
+    main()
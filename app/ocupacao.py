@@ -0,0 +1,139 @@
+import threading
+import time
+from datetime import timedelta
+
+from horarios import agora_utc, horario_utc_de, texto_utc, utc_de_texto
+from placas import canonica, placa_do_registro
+
+# --- Índice de ocupação do pátio (veículos que estão dentro agora) ---
+# Mantido em memória, por placa canônica (ver placas.py): uma Entrada coloca o veículo no pátio
+# e uma Saída o retira. É atualizado a cada registro aceito em /registrar e, na
+# inicialização, reconstruído a partir do último snapshot salvo no armazenamento
+# mais os registros posteriores a ele (a "cauda" da coleção). Sem snapshot, lê só
+# os últimos JANELA_PADRAO_DIAS dias em vez da coleção inteira.
+#
+# A cauda é lida pela ordem de gravação (gravado_em, ver armazenamento.py), não pelo
+# horário: um registro de lote (tablet offline) gravado depois do snapshot tem horário
+# anterior ao cursor e ficaria de fora de uma leitura a partir dele. A leitura começa
+# MARGEM_CAUDA antes do snapshot, para cobrir registros aceitos enquanto ele era
+# salvo; reaplicar um registro é inofensivo pela regra abaixo. Snapshots de antes do
+# campo (sem 'salvo_em') usam a cauda a partir do cursor.
+#
+# Eventos são ordenados por (horario_utc, doc_id), a mesma ordem de listar(); um evento
+# mais antigo que o último já aplicado para a placa é ignorado, então a reconstrução
+# em segundo plano pode rodar enquanto novos registros chegam.
+
+JANELA_PADRAO_DIAS = 3
+MARGEM_CAUDA = timedelta(minutes=10)
+NOME_ESTADO = 'ocupacao'
+VERSAO_ESTADO = 2  # Snapshots de outra versão são descartados e o índice é refeito pela janela
+
+
+class IndiceOcupacao:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dentro = {}          # placa -> dados da entrada
+        self._ultimo_evento = {}   # placa -> (horario_utc em texto, doc_id) do último evento aplicado
+        self.cursor = None         # maior (horario_utc em texto, doc_id) aplicado
+        self.pronto = False
+        self._alterado = False
+
+    def aplicar(self, doc_id, registro):
+        if not registro.get('placa') or not registro.get('horario'):
+            return
+        placa = placa_do_registro(registro)
+        chave = (texto_utc(horario_utc_de(registro)), doc_id)
+        with self._lock:
+            ultimo = self._ultimo_evento.get(placa)
+            if ultimo is not None and chave <= ultimo:
+                return
+            self._ultimo_evento[placa] = chave
+            if registro.get('tipo') == 'Entrada':
+                self._dentro[placa] = {
+                    'placa': registro['placa'],
+                    'placa_canonica': placa,
+                    'nome': registro.get('nome'),
+                    'transportadora': registro.get('Transportadora'),
+                    'site': registro.get('site'),
+                    'entrada': registro['horario'],
+                    'entrada_utc': chave[0],
+                    'doc_id': doc_id,
+                }
+            else:
+                self._dentro.pop(placa, None)
+            if self.cursor is None or chave > self.cursor:
+                self.cursor = chave
+            self._alterado = True
+
+    def veiculos(self, site=None, agora=None):
+        agora = agora or agora_utc()
+        with self._lock:
+            dentro = [dict(v) for v in self._dentro.values() if site is None or v['site'] == site]
+        for veiculo in dentro:
+            entrada = utc_de_texto(veiculo['entrada_utc'])
+            veiculo['permanencia_min'] = max(0, int((agora - entrada).total_seconds() // 60))
+        return sorted(dentro, key=lambda v: v['entrada_utc'])
+
+    def total(self):
+        with self._lock:
+            return len(self._dentro)
+
+    # --- Snapshot e reconstrução ---
+
+    def _estado(self):
+        with self._lock:
+            self._alterado = False
+            return {'versao': VERSAO_ESTADO, 'salvo_em': texto_utc(agora_utc()),
+                    'cursor': list(self.cursor) if self.cursor else None,
+                    'dentro': list(self._dentro.values())}
+
+    def _restaurar(self, estado):
+        with self._lock:
+            self.cursor = tuple(estado['cursor']) if estado.get('cursor') else None
+            for veiculo in estado.get('dentro', []):
+                # Snapshots de antes da placa canônica não têm o campo
+                placa = veiculo.setdefault('placa_canonica', canonica(veiculo['placa']))
+                self._dentro[placa] = veiculo
+                self._ultimo_evento[placa] = (veiculo['entrada_utc'], veiculo['doc_id'])
+
+    def reconstruir(self, armazenamento, fila_gravacao=None, janela_dias=JANELA_PADRAO_DIAS):
+        estado = armazenamento.carregar_estado(NOME_ESTADO)
+        if estado and estado.get('versao') == VERSAO_ESTADO and estado.get('cursor'):
+            self._restaurar(estado)
+            if estado.get('salvo_em'):
+                cauda = armazenamento.listar_gravados(utc_de_texto(estado['salvo_em']) - MARGEM_CAUDA)
+            else:
+                cauda = armazenamento.listar(inicio=utc_de_texto(estado['cursor'][0]))
+        else:
+            cauda = armazenamento.listar(inicio=agora_utc() - timedelta(days=janela_dias))
+
+        for doc_id, registro in cauda:
+            self.aplicar(doc_id, registro)
+        # Registros aceitos pelo modo write-behind que ainda não chegaram ao armazenamento
+        if fila_gravacao is not None:
+            for doc_id, registro in fila_gravacao.pendentes():
+                self.aplicar(doc_id, registro)
+        self.pronto = True
+
+    def salvar(self, armazenamento):
+        if self.pronto and self._alterado:
+            armazenamento.salvar_estado(NOME_ESTADO, self._estado())
+
+    def iniciar(self, armazenamento, fila_gravacao=None, janela_dias=JANELA_PADRAO_DIAS, intervalo_snapshot=60):
+        # Reconstrói em segundo plano e depois salva um snapshot a cada intervalo_snapshot segundos
+        def loop():
+            # Reaplicar eventos é inofensivo, então uma reconstrução que falhou no meio é só repetida
+            while not self.pronto:
+                try:
+                    self.reconstruir(armazenamento, fila_gravacao, janela_dias)
+                except Exception as e:
+                    print(f"Falha ao reconstruir o índice de ocupação do pátio: {e}. Nova tentativa em {intervalo_snapshot}s.")
+                    time.sleep(intervalo_snapshot)
+            while True:
+                time.sleep(intervalo_snapshot)
+                try:
+                    self.salvar(armazenamento)
+                except Exception as e:
+                    print(f"Falha ao salvar snapshot do índice de ocupação: {e}")
+
+        threading.Thread(target=loop, name='indice-ocupacao', daemon=True).start()
@@ -0,0 +1,56 @@
+import gzip
+import hashlib
+
+# --- Páginas estáticas pré-comprimidas ---
+# O HTML é gerado uma única vez na inicialização e guardado já comprimido em gzip
+# (e brotli, se o pacote 'brotli' estiver instalado), com um ETag forte por
+# codificação. Cada requisição só escolhe o corpo certo ou responde 304.
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele servimos gzip ou sem compressão
+    brotli = None
+
+CACHE_PADRAO = 86400  # 1 dia
+
+
+class PaginaEstatica:
+    def __init__(self, html, content_type='text/html; charset=utf-8', max_age=CACHE_PADRAO):
+        corpo = html.encode('utf-8') if isinstance(html, str) else html
+        self.content_type = content_type
+        self.max_age = max_age
+
+        hash_corpo = hashlib.sha256(corpo).hexdigest()[:32]
+        # codificação -> (corpo, etag). O ETag muda por codificação porque os bytes mudam.
+        self.variantes = {'identity': (corpo, f'"{hash_corpo}"')}
+        self.variantes['gzip'] = (gzip.compress(corpo, compresslevel=9, mtime=0), f'"{hash_corpo}-gz"')
+        if brotli is not None:
+            self.variantes['br'] = (brotli.compress(corpo, quality=11), f'"{hash_corpo}-br"')
+        self.etags = {etag for _, etag in self.variantes.values()}
+
+    def escolher_codificacao(self, accept_encoding):
+        aceitas = {parte.split(';')[0].strip().lower() for parte in (accept_encoding or '').split(',')
+                   if not parte.strip().endswith(';q=0')}
+        for codificacao in ('br', 'gzip'):
+            if codificacao in aceitas and codificacao in self.variantes:
+                return codificacao
+        return 'identity'
+
+    def resposta(self, response_class, request, cache=True):
+        codificacao = self.escolher_codificacao(request.headers.get('Accept-Encoding'))
+        corpo, etag = self.variantes[codificacao]
+        headers = {'Vary': 'Accept-Encoding'}
+
+        if cache:
+            headers['ETag'] = etag
+            headers['Cache-Control'] = f'public, max-age={self.max_age}'
+            if_none_match = request.headers.get('If-None-Match', '')
+            if if_none_match.strip() == '*' or any(
+                    tag.strip().removeprefix('W/') in self.etags for tag in if_none_match.split(',')):
+                return response_class(status=304, headers=headers)
+        else:
+            headers['Cache-Control'] = 'no-store'
+
+        if codificacao != 'identity':
+            headers['Content-Encoding'] = codificacao
+        return response_class(corpo, status=200, headers=headers, content_type=self.content_type)
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from horarios import agora_utc, horario_utc_de, texto_utc
+from placas import canonica, placa_do_registro
+
+# --- Perfis de motorista/veículo para preencher o formulário de registro ---
+# Para cada placa canônica, o nome, a placa como foi digitada e a transportadora do
+# último registro. Cada registro aceito atualiza o perfil na hora (é um dos
+# indices_registro do app), então a consulta é só memória: nunca lê o armazenamento
+# durante a requisição.
+#
+# É um LRU limitado a TAMANHO_MAXIMO placas; um perfil cujo último registro tem mais
+# de TTL_PADRAO_DIAS dias não é usado (o motorista pode ter trocado de transportadora).
+# Na inicialização, os registros dos últimos TTL_PADRAO_DIAS dias e os que ainda estão no
+# journal do write-behind são carregados em segundo plano.
+
+TAMANHO_MAXIMO = 20000
+TTL_PADRAO_DIAS = 30
+CAMPOS_PERFIL = ('nome', 'placa', 'Transportadora')
+
+
+class CachePerfis:
+    def __init__(self, tamanho_maximo=TAMANHO_MAXIMO, ttl_dias=TTL_PADRAO_DIAS):
+        self.tamanho_maximo = tamanho_maximo
+        self.ttl = timedelta(days=ttl_dias)
+        self._perfis = OrderedDict()  # placa canônica -> perfil, do menos para o mais recente
+        self._lock = threading.Lock()
+        self.pronto = False
+
+    def aplicar(self, doc_id, registro):
+        if not registro.get('placa') or not registro.get('horario'):
+            return
+        placa = placa_do_registro(registro)
+        perfil = {campo: registro.get(campo) for campo in CAMPOS_PERFIL}
+        perfil['utc'] = texto_utc(horario_utc_de(registro))
+        with self._lock:
+            atual = self._perfis.get(placa)
+            if atual is not None and atual['utc'] > perfil['utc']:
+                return  # Registro mais antigo que o perfil (carga do histórico chegando depois)
+            self._perfis[placa] = perfil
+            self._perfis.move_to_end(placa)
+            if len(self._perfis) > self.tamanho_maximo:
+                self._perfis.popitem(last=False)
+
+    def buscar(self, placa):
+        # Perfil da placa (qualquer formato) ou None se não há perfil ou ele expirou
+        chave = canonica(placa)
+        limite = texto_utc(agora_utc() - self.ttl)
+        with self._lock:
+            perfil = self._perfis.get(chave)
+            if perfil is None:
+                return None
+            if perfil['utc'] < limite:
+                del self._perfis[chave]
+                return None
+            self._perfis.move_to_end(chave)
+            return {campo: perfil[campo] for campo in CAMPOS_PERFIL}
+
+    def __len__(self):
+        return len(self._perfis)
+
+    def iniciar(self, carga):
+        # carga: CargaInicial do app (ver carga_inicial.py). A ordem não importa: aplicar()
+        # ignora registros mais antigos que o perfil
+        carga.adicionar(self, self.ttl, 'o cache de perfis')
@@ -0,0 +1,143 @@
+import re
+import threading
+from datetime import timedelta
+
+
+# --- Placa canônica e busca aproximada de placas ---
+# A mesma placa aparece de várias formas: no formato antigo (ABC1234), no Mercosul
+# (ABC1D34: o 5º caractere vira letra, 0->A, 1->B, ..., 9->J) e com O/0 e I/1 trocados
+# na digitação. canonica() leva todas para uma chave única no formato antigo, trocando
+# O/I por 0/1 nas posições de número e 0/1 por O/I nas de letra. É essa chave
+# ('placa_canonica' no registro) que os índices usam para juntar o histórico do veículo;
+# 'placa' continua guardando o que foi digitado. Placas fora do padrão brasileiro
+# (7 caracteres, LLLNxNN) ficam como estão.
+#
+# No 5º caractere, I é o 8 do Mercosul (não um 1 digitado errado) e O é tratado como 0;
+# uma placa Mercosul nova com O nessa posição se confunde com a de 0/A, caso raro e aceito.
+#
+# IndicePlacas guarda as placas canônicas conhecidas numa árvore BK (distância de
+# edição), para achar em milissegundos as placas a 1 ou 2 caracteres de distância de
+# uma placa digitada, sem percorrer os registros.
+
+JANELA_PADRAO_DIAS = 365
+DISTANCIA_MAXIMA = 2
+LIMITE_PADRAO = 10
+
+RE_NAO_PLACA = re.compile(r'[^A-Z0-9]')
+RE_PADRAO = re.compile(r'[A-Z]{3}[0-9][A-Z0-9][0-9]{2}')
+PARA_LETRA = str.maketrans('01', 'OI')
+PARA_NUMERO = str.maketrans('OI', '01')
+MERCOSUL_PARA_NUMERO = str.maketrans('ABCDEFGHIJ', '0123456789')
+
+
+def canonica(placa):
+    placa = RE_NAO_PLACA.sub('', (placa or '').upper())
+    if len(placa) != 7:
+        return placa
+    candidata = (placa[:3].translate(PARA_LETRA) + placa[3].translate(PARA_NUMERO)
+                 + placa[4].translate(MERCOSUL_PARA_NUMERO).replace('O', '0')
+                 + placa[5:].translate(PARA_NUMERO))
+    return candidata if RE_PADRAO.fullmatch(candidata) else placa
+
+
+def placa_do_registro(registro):
+    # Registros anteriores à placa canônica não têm o campo; canonica() é idempotente
+    return registro.get('placa_canonica') or canonica(registro.get('placa'))
+
+
+def distancia(a, b, limite=None):
+    # Distância de Levenshtein; com limite, para assim que passar dele (retorna limite + 1)
+    if len(a) < len(b):
+        a, b = b, a
+    if limite is not None and len(a) - len(b) > limite:
+        return limite + 1
+    anterior = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        atual = [i]
+        for j, cb in enumerate(b, 1):
+            atual.append(min(anterior[j] + 1, atual[j - 1] + 1, anterior[j - 1] + (ca != cb)))
+        if limite is not None and min(atual) > limite:
+            return limite + 1
+        anterior = atual
+    return anterior[-1]
+
+
+class ArvoreBK:
+    def __init__(self):
+        self._raiz = None  # [valor, {distancia: filho}]
+        self.tamanho = 0
+
+    def adicionar(self, valor):
+        if self._raiz is None:
+            self._raiz = [valor, {}]
+            self.tamanho = 1
+            return True
+        no = self._raiz
+        while True:
+            d = distancia(valor, no[0])
+            if d == 0:
+                return False
+            filho = no[1].get(d)
+            if filho is None:
+                no[1][d] = [valor, {}]
+                self.tamanho += 1
+                return True
+            no = filho
+
+    def buscar(self, valor, distancia_maxima):
+        # Lista de (distancia, valor) com distancia <= distancia_maxima
+        resultado = []
+        pendentes = [self._raiz] if self._raiz is not None else []
+        while pendentes:
+            no = pendentes.pop()
+            d = distancia(valor, no[0])
+            if d <= distancia_maxima:
+                resultado.append((d, no[0]))
+            # Desigualdade triangular: só filhos a d ± distancia_maxima podem ter candidatos
+            for aresta, filho in no[1].items():
+                if d - distancia_maxima <= aresta <= d + distancia_maxima:
+                    pendentes.append(filho)
+        return resultado
+
+
+class IndicePlacas:
+    def __init__(self):
+        self._arvore = ArvoreBK()
+        self._registros = {}  # placa canônica -> quantidade de registros
+        self._variantes = {}  # placa canônica -> {placa digitada: quantidade}
+        self._lock = threading.Lock()
+        self.pronto = False
+
+    def aplicar(self, doc_id, registro):
+        placa = registro.get('placa')
+        if not placa:
+            return
+        chave = placa_do_registro(registro)
+        with self._lock:
+            if chave not in self._registros:
+                self._arvore.adicionar(chave)
+                self._registros[chave] = 0
+                self._variantes[chave] = {}
+            self._registros[chave] += 1
+            variantes = self._variantes[chave]
+            variantes[placa] = variantes.get(placa, 0) + 1
+
+    def total(self):
+        with self._lock:
+            return self._arvore.tamanho
+
+    def semelhantes(self, placa, distancia_maxima=1, limite=LIMITE_PADRAO):
+        # Placas conhecidas próximas da digitada: as mais próximas primeiro e, empatadas, as mais frequentes
+        chave = canonica(placa)
+        if not chave:
+            return []
+        with self._lock:
+            encontradas = self._arvore.buscar(chave, min(distancia_maxima, DISTANCIA_MAXIMA))
+            encontradas.sort(key=lambda item: (item[0], -self._registros[item[1]], item[1]))
+            return [{'placa_canonica': valor, 'distancia': d, 'registros': self._registros[valor],
+                     'variantes': sorted(self._variantes[valor], key=self._variantes[valor].get, reverse=True)}
+                    for d, valor in encontradas[:limite]]
+
+    def iniciar(self, carga, janela_dias=JANELA_PADRAO_DIAS):
+        # carga: CargaInicial do app (ver carga_inicial.py)
+        carga.adicionar(self, timedelta(days=janela_dias), 'o índice de placas')
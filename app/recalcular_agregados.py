@@ -0,0 +1,87 @@
+import argparse
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from agregados import NOME_ESTADO, VERSAO_ESTADO, Agregador
+from armazenamento import criar_armazenamento
+from horarios import FUSO, agora_utc, horario_utc_de, texto_utc
+
+# --- Recálculo dos agregados diários a partir da coleção de registros ---
+# Divide o histórico em blocos de dias (horário de São Paulo) e lê vários blocos em
+# paralelo com listar(). Cada bloco é agregado à parte; depois os blocos são emendados
+# em ordem, o que completa a permanência das placas que entraram num bloco e saíram
+# no seguinte. Grava todos os dias e um estado com 'geracao' nova: o app em execução
+# percebe no próximo snapshot e recarrega a partir daqui.
+#
+# Registros sem horario_utc não aparecem em listar(); rode backfill_horario.py antes.
+#
+# Uso (mesmas variáveis de ambiente do app, ex: FIREBASE_SERVICE_ACCOUNT_KEY):
+#   python recalcular_agregados.py --workers 8 --dias-por-bloco 7
+
+
+def meia_noite_utc(dia):
+    return FUSO.localize(datetime.combine(dia, datetime.min.time()), is_dst=False).astimezone(timezone.utc)
+
+
+def dividir_em_blocos(primeiro, fim, dias_por_bloco):
+    # Intervalos [inicio, fim) em UTC, alinhados à meia-noite de São Paulo, cobrindo primeiro..fim
+    blocos = []
+    dia = primeiro.astimezone(FUSO).date()
+    inicio = meia_noite_utc(dia)
+    while inicio < fim:
+        dia += timedelta(days=dias_por_bloco)
+        proximo = min(meia_noite_utc(dia), fim)
+        blocos.append((inicio, proximo))
+        inicio = proximo
+    return blocos
+
+
+def processar_bloco(armazenamento, inicio, fim):
+    bloco = Agregador(blocos=True)
+    for _, registro in armazenamento.listar(inicio=inicio, fim=fim):
+        bloco.aplicar(registro)
+    return bloco
+
+
+def executar(armazenamento, workers=8, dias_por_bloco=7):
+    inicio_execucao = time.monotonic()
+    # Tudo antes deste instante é recalculado; o app reaplica o que vier depois
+    fim = agora_utc()
+    primeiro = next(iter(armazenamento.listar(fim=fim, tamanho_pagina=1)), None)
+    total = Agregador()
+    if primeiro is None:
+        print("Nenhum registro com horario_utc encontrado.")
+    else:
+        blocos = dividir_em_blocos(horario_utc_de(primeiro[1]), fim, dias_por_bloco)
+        print(f"Recalculando {len(blocos)} blocos de até {dias_por_bloco} dias com {workers} workers...")
+        with ThreadPoolExecutor(workers) as executor:
+            # map() devolve os blocos na ordem do tempo, que é a ordem em que precisam ser emendados
+            for i, bloco in enumerate(executor.map(lambda b: processar_bloco(armazenamento, *b), blocos), 1):
+                total.emendar(bloco)
+                if i % 50 == 0:
+                    print(f"{i}/{len(blocos)} blocos...")
+
+    total.podar_abertas(fim)
+    estado = {'versao': VERSAO_ESTADO, 'geracao': uuid.uuid4().hex,
+              'cursor': [texto_utc(fim), ''], 'abertas': total.abertas}
+    armazenamento.salvar_agregados(total.dias, NOME_ESTADO, estado)
+
+    registros = sum(sum(dados['total'].values()) for dados in total.dias.values())
+    print(f"Concluído em {time.monotonic() - inicio_execucao:.1f}s: {registros} registros em "
+          f"{len(total.dias)} dias, {len(total.abertas)} entradas em aberto.")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refaz os agregados diários a partir de todos os registros.')
+    parser.add_argument('--workers', type=int, default=8, help='blocos lidos em paralelo')
+    parser.add_argument('--dias-por-bloco', type=int, default=7)
+    args = parser.parse_args()
+
+    executar(criar_armazenamento(), workers=args.workers, dias_por_bloco=max(1, args.dias_por_bloco))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import timedelta
+from heapq import nlargest
+
+
+# --- Sugestões (autocomplete) de motorista, placa e transportadora ---
+# Para cada campo há um array ordenado dos valores já vistos (busca de prefixo com
+# bisect) e a frequência de cada valor, usada para ordenar as sugestões. As
+# respostas dos prefixos mais pedidos ficam num LRU; quando um valor novo chega,
+# só as entradas do LRU que são prefixos dele são descartadas.
+#
+# O índice é montado em segundo plano com os registros dos últimos JANELA_PADRAO_DIAS
+# dias e atualizado a cada registro aceito.
+
+JANELA_PADRAO_DIAS = 180
+TAMANHO_LRU = 2048
+LIMITE_PADRAO = 8
+LIMITE_MAXIMO = 20  # O LRU guarda o top LIMITE_MAXIMO de cada prefixo e corta conforme o pedido
+
+# Nome do campo na API -> campo do registro
+CAMPOS = {'motorista': 'nome', 'placa': 'placa', 'transportadora': 'Transportadora'}
+
+
+def normalizar_prefixo(campo, prefixo):
+    prefixo = (prefixo or '').upper().strip()
+    if campo == 'placa':
+        return re.sub(r'[^A-Z0-9]', '', prefixo)
+    return re.sub(r'\s+', ' ', prefixo)
+
+
+class IndicePrefixo:
+    def __init__(self, tamanho_lru=TAMANHO_LRU):
+        self._valores = []        # ordenado, sem repetição
+        self._frequencia = {}
+        self._lru = OrderedDict()  # prefixo -> top LIMITE_MAXIMO sugestões
+        self.tamanho_lru = tamanho_lru
+        self._lock = threading.Lock()
+
+    def adicionar(self, valor):
+        with self._lock:
+            if valor in self._frequencia:
+                self._frequencia[valor] += 1
+            else:
+                self._frequencia[valor] = 1
+                insort(self._valores, valor)
+            # A ordem pode ter mudado para qualquer prefixo deste valor
+            for tamanho in range(1, len(valor) + 1):
+                self._lru.pop(valor[:tamanho], None)
+
+    def buscar(self, prefixo, limite=LIMITE_PADRAO):
+        with self._lock:
+            if prefixo in self._lru:
+                self._lru.move_to_end(prefixo)
+                return self._lru[prefixo][:limite]
+            inicio = bisect_left(self._valores, prefixo)
+            fim = bisect_left(self._valores, prefixo + '\uffff')
+            resultado = nlargest(LIMITE_MAXIMO, self._valores[inicio:fim],
+                                 key=lambda v: (self._frequencia[v], -len(v)))
+            self._lru[prefixo] = resultado
+            if len(self._lru) > self.tamanho_lru:
+                self._lru.popitem(last=False)
+            return resultado[:limite]
+
+
+class Sugestoes:
+    def __init__(self):
+        self.indices = {campo: IndicePrefixo() for campo in CAMPOS}
+        self.pronto = False
+
+    def aplicar(self, doc_id, registro):
+        for campo, campo_registro in CAMPOS.items():
+            valor = registro.get(campo_registro)
+            if valor:
+                self.indices[campo].adicionar(valor)
+
+    def buscar(self, campo, prefixo, limite=LIMITE_PADRAO):
+        prefixo = normalizar_prefixo(campo, prefixo)
+        if not prefixo:
+            return []
+        return self.indices[campo].buscar(prefixo, limite)
+
+    def iniciar(self, carga, janela_dias=JANELA_PADRAO_DIAS):
+        # carga: CargaInicial do app (ver carga_inicial.py)
+        carga.adicionar(self, timedelta(days=janela_dias), 'o índice de sugestões')
@@ -0,0 +1,122 @@
+import re
+
+from geofence import ler_coordenadas
+from horarios import agora_utc, campos_tempo, ler_horario
+from placas import canonica
+
+# --- Normalização e validação de registros ---
+# Mesmas regras para o formulário de /registrar e para a sincronização em lote de
+# /api/registros/lote. Cada falha tem um motivo (chave curta, usada na métrica de
+# falhas de validação) e a mensagem mostrada ao usuário.
+
+RE_NAO_PLACA = re.compile(r'[^A-Z0-9]')
+RE_ESPACOS = re.compile(r'\s+')
+TIPOS = ('Entrada', 'Saída')
+
+MENSAGENS = {
+    'nome_vazio': "O Nome do Motorista é obrigatório.",
+    'placa_vazia': "A Placa do Veículo é obrigatória e não pode estar vazia.",
+    'ordem_vazia': "A Ordem de Coleta é obrigatória e não pode estar vazia.",
+    'transportadora_vazia': "A Transportadora é obrigatória.",
+    'tipo_invalido': "O Tipo deve ser Entrada ou Saída.",
+    'quilometragem_negativa': "A quilometragem deve ser um número positivo.",
+    'quilometragem_invalida': "A quilometragem deve ser um número válido (apenas números inteiros).",
+    'localizacao_ausente': "Localização não informada. Volte à página inicial e permita o acesso à localização.",
+    'horario_ausente': "O horário do registro é obrigatório.",
+    'horario_invalido': "O horário deve estar no formato ISO 8601 (ex: 2024-05-01T08:00:00-03:00).",
+    'horario_fora_do_intervalo': "O horário está no futuro ou é antigo demais para ser aceito.",
+}
+
+
+def _texto(valor):
+    return '' if valor is None else str(valor)
+
+
+def normalizar_placa(valor):
+    return RE_NAO_PLACA.sub('', _texto(valor).upper())
+
+
+def normalizar_ordem(valor):
+    return RE_ESPACOS.sub('', _texto(valor).strip().upper())
+
+
+def normalizar(dados):
+    # dados: request.form ou um item JSON. Retorna os campos limpos (quilometragem ainda texto).
+    return {
+        'nome': _texto(dados.get('nome')).upper().strip(),
+        'placa': normalizar_placa(dados.get('placa')),
+        'ordem': normalizar_ordem(dados.get('ordem')),
+        'tipo': _texto(dados.get('tipo')),
+        'Transportadora': _texto(dados.get('Transportadora')).upper().strip(),
+        'quilometragem': _texto(dados.get('quilometragem')).strip(),
+    }
+
+
+def validar(campos, geofence=None, latitude=None, longitude=None):
+    # Retorna (motivo, mensagem, site); motivo None quando o registro é válido.
+    # Com geofence, as coordenadas são obrigatórias e precisam cair em algum pátio.
+    if not campos['nome']:
+        motivo = 'nome_vazio'
+    elif not campos['placa']:
+        motivo = 'placa_vazia'
+    elif not campos['ordem']:
+        motivo = 'ordem_vazia'
+    elif not campos['Transportadora']:
+        motivo = 'transportadora_vazia'
+    elif campos['tipo'] not in TIPOS:
+        motivo = 'tipo_invalido'
+    else:
+        motivo = None
+
+    if motivo is None and campos['quilometragem']:
+        try:
+            if int(campos['quilometragem']) < 0:
+                motivo = 'quilometragem_negativa'
+        except ValueError:
+            motivo = 'quilometragem_invalida'
+    if motivo is not None:
+        return motivo, MENSAGENS[motivo], None
+
+    site = None
+    if geofence is not None:
+        coordenadas = ler_coordenadas(latitude, longitude)
+        if coordenadas is None:
+            return 'localizacao_ausente', MENSAGENS['localizacao_ausente'], None
+        site = geofence.localizar(*coordenadas)
+        if site is None:
+            _, distancia = geofence.mais_proximo(*coordenadas)
+            return 'fora_da_area', f"Você está fora da área permitida. Distância: {distancia:.0f} metros.", None
+    return None, None, site
+
+
+def validar_horario(valor, minimo, maximo):
+    # Horário informado pelo cliente (sincronização em lote). Retorna (motivo, mensagem, datetime UTC).
+    if valor is None or valor == '':
+        return 'horario_ausente', MENSAGENS['horario_ausente'], None
+    try:
+        momento = ler_horario(valor)
+    except (TypeError, ValueError):
+        return 'horario_invalido', MENSAGENS['horario_invalido'], None
+    if not minimo <= momento <= maximo:
+        return 'horario_fora_do_intervalo', MENSAGENS['horario_fora_do_intervalo'], None
+    return None, None, momento
+
+
+def montar_registro(campos, momento, site=None):
+    # Registro gravado: campos normalizados + placa_canonica + horario, horario_utc, dia e semana_iso de 'momento'.
+    # gravado_em é o horário do servidor ao aceitar o registro (difere de 'momento' nos de lote).
+    registro = {
+        'nome': campos['nome'],
+        'placa': campos['placa'],
+        'placa_canonica': canonica(campos['placa']),
+        'ordem': campos['ordem'],
+        'tipo': campos['tipo'],
+        'Transportadora': campos['Transportadora'],
+    }
+    registro.update(campos_tempo(momento))
+    registro['gravado_em'] = agora_utc()
+    if campos['quilometragem']:
+        registro['quilometragem'] = int(campos['quilometragem'])
+    if site is not None:
+        registro['site'] = site.id
+    return registro
@@ -0,0 +1,81 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Varredura da coleção em ordem de ID, com lotes em paralelo e checkpoint ---
+# Base dos scripts de manutenção (backfill_horario.py, migrar_particoes.py). Cada página
+# lida vira uma tarefa executada em paralelo; as tarefas são concluídas na ordem de
+# leitura, e o checkpoint guarda o último ID cuja página (e todas as anteriores) já foi
+# concluída, então uma execução interrompida continua de onde parou.
+#
+# preparar(pagina) devolve (tarefa, contagens): tarefa é uma função sem argumentos (ou
+# None) que grava a página e pode devolver mais contagens; as contagens são somadas no
+# checkpoint quando a página é concluída.
+
+
+def carregar_checkpoint(caminho, contadores, **extras):
+    # Campos que faltam num checkpoint salvo (ex: de uma versão anterior) ficam com o padrão
+    checkpoint = dict({'ultimo_id': None, 'lidos': 0}, **{contador: 0 for contador in contadores}, **extras)
+    if caminho and os.path.exists(caminho):
+        with open(caminho, encoding='utf-8') as f:
+            checkpoint.update(json.load(f))
+    return checkpoint
+
+
+def salvar_checkpoint(caminho, checkpoint):
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(temporario, caminho)
+
+
+def com_retentativa(funcao, *args, tentativas=5):
+    for tentativa in range(1, tentativas + 1):
+        try:
+            return funcao(*args)
+        except Exception as e:
+            if tentativa == tentativas:
+                raise
+            espera = min(30, 2 ** tentativa)
+            print(f"Falha ao gravar lote ({e}); tentativa {tentativa}/{tentativas}, nova tentativa em {espera}s.")
+            time.sleep(espera)
+
+
+def percorrer(paginas, preparar, checkpoint, caminho_checkpoint, workers=8, simular=False,
+              progresso=None, intervalo_progresso=10000):
+    # paginas: gerador de listas de (doc_id, registro), já retomando de checkpoint['ultimo_id']
+    if checkpoint['ultimo_id']:
+        print(f"Retomando após o documento {checkpoint['ultimo_id']} ({checkpoint['lidos']} já lidos).")
+
+    # Páginas em andamento, na ordem de leitura: (último ID da página, contagens, future)
+    em_andamento = deque()
+    proximo_aviso = checkpoint['lidos'] + intervalo_progresso
+
+    def concluir_primeiro():
+        ultimo_id, contagens, futuro = em_andamento.popleft()
+        extras = futuro.result()  # Propaga a falha e interrompe sem avançar o checkpoint
+        checkpoint['ultimo_id'] = ultimo_id
+        for contador, valor in dict(contagens, **(extras or {})).items():
+            checkpoint[contador] = checkpoint.get(contador, 0) + valor
+        if caminho_checkpoint and not simular:
+            salvar_checkpoint(caminho_checkpoint, checkpoint)
+
+    with ThreadPoolExecutor(workers) as executor:
+        for pagina in paginas:
+            tarefa, contagens = preparar(pagina)
+            contagens = dict(contagens, lidos=len(pagina))
+            futuro = executor.submit(tarefa if tarefa is not None and not simular else lambda: None)
+            em_andamento.append((pagina[-1][0], contagens, futuro))
+
+            # Limita a leitura antecipada para não acumular páginas em memória
+            while em_andamento and (em_andamento[0][2].done() or len(em_andamento) >= workers * 2):
+                concluir_primeiro()
+            if progresso and checkpoint['lidos'] >= proximo_aviso:
+                progresso(checkpoint)
+                proximo_aviso = checkpoint['lidos'] + intervalo_progresso
+
+        while em_andamento:
+            concluir_primeiro()
+    return checkpoint
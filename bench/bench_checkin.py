@@ -0,0 +1,378 @@
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Benchmark / teste de carga do fluxo de check-in ---
+# Executa uma mistura realista de requisições (páginas estáticas, GET do formulário,
+# POSTs válidos e inválidos em /registrar) contra o app, usando um Firestore falso
+# com latência configurável, e grava os resultados em JSON para comparar execuções.
+#
+# Exemplos (a partir da raiz do repositório):
+#   python bench/bench_checkin.py --modo cliente --requisicoes 2000 --latencia-ms 40
+#   python bench/bench_checkin.py --modo gunicorn --concorrencia 16 --latencia-ms 40
+#   python bench/bench_checkin.py --saida atual.json --comparar base.json
+#
+# Modos:
+#   cliente  -> Flask test client no mesmo processo (mede também alocações por requisição)
+#   gunicorn -> processo gunicorn real (bench/gunicorn_bench.py), requisições HTTP via rede local
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIR_APP = os.path.join(RAIZ, 'app')
+DIR_BENCH = os.path.dirname(os.path.abspath(__file__))
+
+# Cenário -> peso na mistura de requisições
+MISTURA = {
+    'index': 20,
+    'pergunta': 15,
+    'form_entrada': 25,
+    'post_valido': 30,
+    'post_invalido': 10,
+}
+
+# Cenário -> status HTTP esperado; qualquer outro conta como erro (inclusive 429/503 do
+# controle de admissão). POST inválido devolve o formulário com a mensagem, com 200.
+STATUS_ESPERADO = {
+    'index': 200,
+    'pergunta': 200,
+    'form_entrada': 200,
+    'post_valido': 200,
+    'post_invalido': 200,
+}
+
+NOMES = ['JOAO DA SILVA', 'MARIA SOUZA', 'CARLOS PEREIRA', 'ANA LIMA', 'PEDRO ALVES']
+TRANSPORTADORAS = ['TRANSPORTES X', 'RODOLOG', 'EXPRESSO SUL', 'CARGAS BR']
+# Todas as requisições saem do mesmo IP: sem isso, o controle de admissão do app
+# (app.py, admissao.py) recusaria quase todos os POSTs e o bench mediria só o 429
+AMBIENTE_BENCH = {
+    'ADMISSAO_REGISTRAR_POR_MINUTO': '0',
+    'ADMISSAO_REGISTRAR_EM_ANDAMENTO': '0',
+    'ADMISSAO_LOTE_POR_MINUTO': '0',
+    'ADMISSAO_LOTE_EM_ANDAMENTO': '0',
+    'ADMISSAO_LATENCIA_MAXIMA_MS': '0',
+}
+
+# Ponto dentro do pátio padrão (app/sites.json), para os POSTs passarem pelo geofence
+LAT_PATIO, LON_PATIO = -23.516185, -46.965741
+
+
+def placa_aleatoria(rnd):
+    letras = ''.join(rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(3))
+    return f"{letras}-{rnd.randint(1000, 9999)}"
+
+
+def montar_requisicao(cenario, rnd):
+    # Retorna (método, caminho, dados do formulário ou None)
+    if cenario == 'index':
+        return 'GET', '/', None
+    if cenario == 'pergunta':
+        return 'GET', '/pergunta', None
+    if cenario == 'form_entrada':
+        return 'GET', '/registrar?tipo=Entrada', None
+
+    tipo = rnd.choice(['Entrada', 'Saída'])
+    dados = {
+        'nome': rnd.choice(NOMES),
+        'placa': placa_aleatoria(rnd),
+        'ordem': f"ord {rnd.randint(1, 99999)}",
+        'tipo': tipo,
+        'Transportadora': rnd.choice(TRANSPORTADORAS),
+        'quilometragem': str(rnd.randint(0, 900000)),
+        'latitude': str(LAT_PATIO + rnd.uniform(-0.001, 0.001)),
+        'longitude': str(LON_PATIO + rnd.uniform(-0.001, 0.001)),
+    }
+    if cenario == 'post_invalido':
+        # Alterna entre as falhas de validação mais comuns
+        falha = rnd.choice(['nome', 'placa', 'quilometragem'])
+        if falha == 'quilometragem':
+            dados['quilometragem'] = '12a'
+        else:
+            dados[falha] = ''
+    return 'POST', '/registrar?' + urllib.parse.urlencode({'tipo': tipo}), dados
+
+
+def sortear_cenarios(total, semente):
+    rnd = random.Random(semente)
+    cenarios = list(MISTURA)
+    pesos = [MISTURA[c] for c in cenarios]
+    return [(c, montar_requisicao(c, rnd)) for c in rnd.choices(cenarios, pesos, k=total)]
+
+
+def percentil(valores_ordenados, p):
+    if not valores_ordenados:
+        return 0.0
+    indice = min(len(valores_ordenados) - 1, int(round(p / 100 * (len(valores_ordenados) - 1))))
+    return valores_ordenados[indice]
+
+
+def resumir(latencias, duracao_total, erros):
+    # latencias: dict cenário -> lista de segundos
+    todas = sorted(v for lista in latencias.values() for v in lista)
+
+    def bloco(valores):
+        valores = sorted(valores)
+        return {
+            'requisicoes': len(valores),
+            'p50_ms': round(percentil(valores, 50) * 1000, 3),
+            'p95_ms': round(percentil(valores, 95) * 1000, 3),
+            'p99_ms': round(percentil(valores, 99) * 1000, 3),
+            'media_ms': round(sum(valores) / len(valores) * 1000, 3) if valores else 0.0,
+        }
+
+    resumo = bloco(todas)
+    resumo['requisicoes_por_segundo'] = round(len(todas) / duracao_total, 1) if duracao_total else 0.0
+    resumo['erros'] = erros
+    resumo['por_cenario'] = {c: bloco(v) for c, v in sorted(latencias.items())}
+    return resumo
+
+
+# --- Modo cliente (Flask test client) ---
+
+def carregar_app(latencia_ms, jitter_ms):
+    os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+    for nome, valor in AMBIENTE_BENCH.items():
+        os.environ.setdefault(nome, valor)
+    sys.path.insert(0, DIR_APP)
+    sys.path.insert(0, DIR_BENCH)
+    import app as modulo_app
+    from armazenamento import ArmazenamentoFirestore
+    from fake_firestore import FirestoreFalso
+
+    falso = FirestoreFalso(latencia_ms, jitter_ms)
+    modulo_app.armazenamento = ArmazenamentoFirestore(falso)
+    if modulo_app.fila_gravacao is not None:
+        modulo_app.fila_gravacao.armazenamento = modulo_app.armazenamento
+    return modulo_app.app
+
+
+def executar_cliente(flask_app, requisicoes, concorrencia):
+    latencias = {c: [] for c in MISTURA}
+    erros = 0
+    lock = threading.Lock()
+
+    def executar(item):
+        nonlocal erros
+        cenario, (metodo, caminho, dados) = item
+        cliente = flask_app.test_client()
+        inicio = time.perf_counter()
+        resposta = cliente.open(caminho, method=metodo, data=dados)
+        resposta.get_data()
+        duracao = time.perf_counter() - inicio
+        with lock:
+            latencias[cenario].append(duracao)
+            if resposta.status_code != STATUS_ESPERADO[cenario]:
+                erros += 1
+
+    inicio = time.perf_counter()
+    if concorrencia <= 1:
+        for item in requisicoes:
+            executar(item)
+    else:
+        with ThreadPoolExecutor(concorrencia) as executor:
+            list(executor.map(executar, requisicoes))
+    return latencias, time.perf_counter() - inicio, erros
+
+
+def medir_alocacoes(flask_app, semente, amostras=50):
+    # Pico de memória alocada (tracemalloc) por requisição, em cada cenário
+    cliente = flask_app.test_client()
+    resultado = {}
+    rnd = random.Random(semente)
+    tracemalloc.start()
+    try:
+        for cenario in MISTURA:
+            picos = []
+            blocos = []
+            for _ in range(amostras):
+                metodo, caminho, dados = montar_requisicao(cenario, rnd)
+                tracemalloc.reset_peak()
+                antes, _ = tracemalloc.get_traced_memory()
+                snapshot_antes = tracemalloc.take_snapshot()
+                cliente.open(caminho, method=metodo, data=dados).get_data()
+                _, pico = tracemalloc.get_traced_memory()
+                snapshot_depois = tracemalloc.take_snapshot()
+                picos.append(pico - antes)
+                blocos.append(sum(max(0, d.count_diff) for d in snapshot_depois.compare_to(snapshot_antes, 'filename')))
+            resultado[cenario] = {
+                'pico_bytes_medio': int(sum(picos) / len(picos)),
+                'blocos_retidos_medio': round(sum(blocos) / len(blocos), 1),
+            }
+    finally:
+        tracemalloc.stop()
+    return resultado
+
+
+# --- Modo gunicorn (processo real) ---
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def iniciar_gunicorn(porta, latencia_ms, jitter_ms, args_extras):
+    env = dict(AMBIENTE_BENCH, **os.environ)
+    env.setdefault('STORAGE_BACKEND', 'sqlite')
+    env['BENCH_LATENCIA_MS'] = str(latencia_ms)
+    env['BENCH_JITTER_MS'] = str(jitter_ms)
+    comando = [sys.executable, '-m', 'gunicorn', '--chdir', DIR_APP,
+               '-c', os.path.join(DIR_BENCH, 'gunicorn_bench.py'),
+               '--bind', f'127.0.0.1:{porta}', *args_extras, 'app:app']
+    processo = subprocess.Popen(comando, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    limite = time.time() + 30
+    while time.time() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f"gunicorn encerrou durante a inicialização (código {processo.returncode})")
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{porta}/pergunta', timeout=1).read()
+            return processo
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.1)
+    processo.terminate()
+    raise RuntimeError("gunicorn não respondeu em 30s")
+
+
+def executar_gunicorn(porta, requisicoes, concorrencia):
+    latencias = {c: [] for c in MISTURA}
+    erros = 0
+    lock = threading.Lock()
+    base = f'http://127.0.0.1:{porta}'
+
+    def executar(item):
+        nonlocal erros
+        cenario, (metodo, caminho, dados) = item
+        corpo = urllib.parse.urlencode(dados).encode() if dados is not None else None
+        req = urllib.request.Request(base + caminho, data=corpo, method=metodo)
+        inicio = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resposta:
+                resposta.read()
+                status = resposta.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except (urllib.error.URLError, ConnectionError):
+            status = None
+        falhou = status != STATUS_ESPERADO[cenario]
+        duracao = time.perf_counter() - inicio
+        with lock:
+            latencias[cenario].append(duracao)
+            if falhou:
+                erros += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max(1, concorrencia)) as executor:
+        list(executor.map(executar, requisicoes))
+    return latencias, time.perf_counter() - inicio, erros
+
+
+# --- Comparação entre execuções ---
+
+def comparar(atual, base, tolerancia):
+    # Retorna a lista de regressões (métrica, valor base, valor atual)
+    regressoes = []
+    for metrica in ('p50_ms', 'p95_ms', 'p99_ms'):
+        if base[metrica] and atual[metrica] > base[metrica] * (1 + tolerancia):
+            regressoes.append((metrica, base[metrica], atual[metrica]))
+    if base['requisicoes_por_segundo'] and \
+            atual['requisicoes_por_segundo'] < base['requisicoes_por_segundo'] * (1 - tolerancia):
+        regressoes.append(('requisicoes_por_segundo', base['requisicoes_por_segundo'], atual['requisicoes_por_segundo']))
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do fluxo de check-in (/, /pergunta, /registrar).')
+    parser.add_argument('--modo', choices=['cliente', 'gunicorn'], default='cliente')
+    parser.add_argument('--requisicoes', type=int, default=1000)
+    parser.add_argument('--aquecimento', type=int, default=50, help='requisições descartadas antes de medir')
+    parser.add_argument('--concorrencia', type=int, default=1)
+    parser.add_argument('--latencia-ms', type=float, default=30.0, help='latência injetada no Firestore falso')
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--gunicorn-args', default='', help='argumentos extras para o gunicorn, ex: "--workers 2"')
+    parser.add_argument('--sem-alocacoes', action='store_true', help='não mede alocações (modo cliente)')
+    parser.add_argument('--saida', default='bench_resultados.json')
+    parser.add_argument('--comparar', help='arquivo JSON de uma execução anterior para detectar regressões')
+    parser.add_argument('--tolerancia', type=float, default=0.10, help='piora relativa aceita ao comparar (0.10 = 10%%)')
+    args = parser.parse_args()
+
+    aquecimento = sortear_cenarios(args.aquecimento, args.semente + 1)
+    requisicoes = sortear_cenarios(args.requisicoes, args.semente)
+    alocacoes = None
+
+    if args.modo == 'cliente':
+        flask_app = carregar_app(args.latencia_ms, args.jitter_ms)
+        executar_cliente(flask_app, aquecimento, args.concorrencia)
+        latencias, duracao, erros = executar_cliente(flask_app, requisicoes, args.concorrencia)
+        if not args.sem_alocacoes:
+            alocacoes = medir_alocacoes(flask_app, args.semente)
+    else:
+        porta = porta_livre()
+        processo = iniciar_gunicorn(porta, args.latencia_ms, args.jitter_ms, args.gunicorn_args.split())
+        try:
+            executar_gunicorn(porta, aquecimento, args.concorrencia)
+            latencias, duracao, erros = executar_gunicorn(porta, requisicoes, args.concorrencia)
+        finally:
+            processo.terminate()
+            processo.wait(10)
+
+    resultado = {
+        'configuracao': {
+            'modo': args.modo,
+            'requisicoes': args.requisicoes,
+            'concorrencia': args.concorrencia,
+            'latencia_ms': args.latencia_ms,
+            'jitter_ms': args.jitter_ms,
+            'semente': args.semente,
+            'gunicorn_args': args.gunicorn_args,
+            'mistura': MISTURA,
+        },
+        'ambiente': {
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'data': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'resumo': resumir(latencias, duracao, erros),
+        'alocacoes': alocacoes,
+    }
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+    resumo = resultado['resumo']
+    print(f"{args.modo}: {resumo['requisicoes']} requisições, {resumo['requisicoes_por_segundo']} req/s, "
+          f"p50 {resumo['p50_ms']} ms, p95 {resumo['p95_ms']} ms, p99 {resumo['p99_ms']} ms, erros {resumo['erros']}")
+    for cenario, bloco in resumo['por_cenario'].items():
+        print(f"  {cenario:14s} n={bloco['requisicoes']:5d}  p50 {bloco['p50_ms']:8.3f} ms  "
+              f"p95 {bloco['p95_ms']:8.3f} ms  p99 {bloco['p99_ms']:8.3f} ms")
+    if alocacoes:
+        for cenario, bloco in alocacoes.items():
+            print(f"  {cenario:14s} pico {bloco['pico_bytes_medio']:8d} bytes/req")
+    print(f"Resultados gravados em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)['resumo']
+        regressoes = comparar(resumo, base, args.tolerancia)
+        for metrica, antes, depois in regressoes:
+            print(f"REGRESSÃO {metrica}: {antes} -> {depois}")
+        if regressoes:
+            sys.exit(1)
+        print("Nenhuma regressão acima da tolerância.")
+
+
+if __name__ == '__main__':
+    main()
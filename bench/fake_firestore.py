@@ -0,0 +1,76 @@
+import threading
+import time
+import uuid
+
+# --- Firestore falso para benchmarks ---
+# Imita a parte do cliente do Firestore usada por ArmazenamentoFirestore
+# (collection().add(), collection().document().set() e batch()) guardando tudo
+# em memória, com uma latência artificial por round trip para simular a rede.
+
+
+class _DocumentoFalso:
+    def __init__(self, db, colecao, doc_id):
+        self._db = db
+        self._colecao = colecao
+        self.id = doc_id
+
+    def set(self, dados):
+        self._db._round_trip()
+        self._db._gravar(self._colecao, self.id, dados)
+
+
+class _ColecaoFalsa:
+    def __init__(self, db, nome):
+        self._db = db
+        self._nome = nome
+
+    def document(self, doc_id=None):
+        return _DocumentoFalso(self._db, self._nome, doc_id or uuid.uuid4().hex)
+
+    def add(self, dados):
+        doc = self.document()
+        doc.set(dados)
+        return time.time(), doc
+
+
+class _LoteFalso:
+    def __init__(self, db):
+        self._db = db
+        self._operacoes = []
+
+    def set(self, doc, dados):
+        self._operacoes.append((doc, dados))
+
+    def commit(self):
+        self._db._round_trip()
+        for doc, dados in self._operacoes:
+            self._db._gravar(doc._colecao, doc.id, dados)
+
+
+class FirestoreFalso:
+    def __init__(self, latencia_ms=0.0, jitter_ms=0.0):
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.documentos = {}
+        self.round_trips = 0
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        atraso = self.latencia_ms
+        if self.jitter_ms:
+            # Jitter determinístico o suficiente para comparar execuções
+            atraso += (self.round_trips % 10) / 10 * self.jitter_ms
+        if atraso > 0:
+            time.sleep(atraso / 1000)
+
+    def _gravar(self, colecao, doc_id, dados):
+        with self._lock:
+            self.documentos[(colecao, doc_id)] = dict(dados)
+
+    def collection(self, nome):
+        return _ColecaoFalsa(self, nome)
+
+    def batch(self):
+        return _LoteFalso(self)
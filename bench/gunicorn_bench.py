@@ -0,0 +1,21 @@
+import os
+import sys
+
+# --- Configuração do gunicorn usada por bench_checkin.py --modo gunicorn ---
+# Depois que cada worker carrega o app, troca o armazenamento por um
+# ArmazenamentoFirestore apontando para o Firestore falso com latência injetada
+# (BENCH_LATENCIA_MS / BENCH_JITTER_MS).
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def post_worker_init(worker):
+    from armazenamento import ArmazenamentoFirestore
+    from fake_firestore import FirestoreFalso
+
+    modulo_app = sys.modules['app']
+    falso = FirestoreFalso(float(os.environ.get('BENCH_LATENCIA_MS', '0')),
+                           float(os.environ.get('BENCH_JITTER_MS', '0')))
+    modulo_app.armazenamento = ArmazenamentoFirestore(falso)
+    if modulo_app.fila_gravacao is not None:
+        modulo_app.fila_gravacao.armazenamento = modulo_app.armazenamento
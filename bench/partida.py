@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# --- Orçamento de tempo de import e de partida a frio ---
+# Mede o que uma instância nova do Cloud Run paga antes de atender:
+#   import  -> `import app` num processo Python novo (o trabalho de cada worker ao subir),
+#              com o backend SQLite e com o Firestore. No Firestore a credencial é falsa:
+#              o cliente só é criado no primeiro uso, fora do import, então não entra na conta.
+#   partida -> do início do gunicorn (app/gunicorn.conf.py) até /saude responder 200 e
+#              até a primeira página (/) responder; e quanto o gunicorn leva para encerrar.
+# As medianas são comparadas com os orçamentos; termina com código 1 se algum estourar.
+#
+# Exemplos (a partir da raiz do repositório):
+#   python bench/partida.py
+#   python bench/partida.py --repeticoes 10 --orcamento-import-ms 400 --saida partida.json
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIR_APP = os.path.join(RAIZ, 'app')
+
+CODIGO_IMPORT = (
+    "import json, time\n"
+    "inicio = time.perf_counter()\n"
+    "import app\n"
+    "print(json.dumps({'import_ms': (time.perf_counter() - inicio) * 1000}))\n"
+)
+CREDENCIAL_FALSA = json.dumps({'type': 'service_account', 'project_id': 'bench'})
+
+
+def ambiente(backend):
+    env = dict(os.environ, STORAGE_BACKEND=backend)
+    if backend == 'firestore':
+        env['FIREBASE_SERVICE_ACCOUNT_KEY'] = CREDENCIAL_FALSA
+    return env
+
+
+def medir_import(backend):
+    saida = subprocess.run([sys.executable, '-c', CODIGO_IMPORT], cwd=DIR_APP, env=ambiente(backend),
+                           capture_output=True, text=True, timeout=60)
+    if saida.returncode != 0:
+        raise RuntimeError(f"import app falhou ({backend}):\n{saida.stderr}")
+    # O app imprime mensagens de inicialização; o resultado é a última linha
+    return json.loads(saida.stdout.strip().splitlines()[-1])['import_ms']
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def esperar(url, limite):
+    while time.perf_counter() < limite:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as resposta:
+                resposta.read()
+                return True
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.005)
+    return False
+
+
+def medir_partida(backend):
+    porta = porta_livre()
+    comando = [sys.executable, '-m', 'gunicorn', '--chdir', DIR_APP, '-c', os.path.join(DIR_APP, 'gunicorn.conf.py'),
+               '--bind', f'127.0.0.1:{porta}', 'app:app']
+    inicio = time.perf_counter()
+    processo = subprocess.Popen(comando, env=ambiente(backend), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not esperar(f'http://127.0.0.1:{porta}/saude', inicio + 30):
+            raise RuntimeError("gunicorn não respondeu /saude em 30s")
+        saude_ms = (time.perf_counter() - inicio) * 1000
+        esperar(f'http://127.0.0.1:{porta}/', inicio + 30)
+        primeira_pagina_ms = (time.perf_counter() - inicio) * 1000
+    finally:
+        fim = time.perf_counter()
+        processo.terminate()
+        processo.wait(30)
+    return {'saude_ms': saude_ms, 'primeira_pagina_ms': primeira_pagina_ms,
+            'encerramento_ms': (time.perf_counter() - fim) * 1000}
+
+
+def mediana(valores):
+    return round(statistics.median(valores), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mede tempo de import e partida a frio e compara com orçamentos.')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--backend', choices=['sqlite', 'firestore'], default='sqlite',
+                        help='backend usado na medição de partida (o import mede os dois)')
+    parser.add_argument('--orcamento-import-ms', type=float, default=500.0)
+    parser.add_argument('--orcamento-partida-ms', type=float, default=1500.0,
+                        help='até /saude responder 200')
+    parser.add_argument('--saida', default='partida_resultados.json')
+    args = parser.parse_args()
+
+    imports = {backend: [medir_import(backend) for _ in range(args.repeticoes)] for backend in ('sqlite', 'firestore')}
+    partidas = [medir_partida(args.backend) for _ in range(args.repeticoes)]
+
+    resultado = {
+        'configuracao': {'repeticoes': args.repeticoes, 'backend_partida': args.backend,
+                         'orcamento_import_ms': args.orcamento_import_ms,
+                         'orcamento_partida_ms': args.orcamento_partida_ms},
+        'ambiente': {
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'data': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'import_ms': {backend: {'mediana': mediana(valores), 'max': round(max(valores), 1)}
+                      for backend, valores in imports.items()},
+        'partida_ms': {campo: {'mediana': mediana([p[campo] for p in partidas]),
+                               'max': round(max(p[campo] for p in partidas), 1)}
+                       for campo in ('saude_ms', 'primeira_pagina_ms', 'encerramento_ms')},
+    }
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+    estouros = []
+    for backend, bloco in resultado['import_ms'].items():
+        print(f"import app ({backend:9s}) mediana {bloco['mediana']:7.1f} ms  max {bloco['max']:7.1f} ms  "
+              f"(orçamento {args.orcamento_import_ms:.0f} ms)")
+        if bloco['mediana'] > args.orcamento_import_ms:
+            estouros.append(f"import ({backend})")
+    for campo, bloco in resultado['partida_ms'].items():
+        print(f"partida {campo:18s} mediana {bloco['mediana']:7.1f} ms  max {bloco['max']:7.1f} ms")
+    if resultado['partida_ms']['saude_ms']['mediana'] > args.orcamento_partida_ms:
+        estouros.append('partida até /saude')
+    print(f"(orçamento de partida até /saude: {args.orcamento_partida_ms:.0f} ms)")
+
+    if estouros:
+        print(f"ORÇAMENTO ESTOURADO: {', '.join(estouros)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os módulos do app são importados pelo nome, a partir de app/ (como no contêiner)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
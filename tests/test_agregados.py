@@ -0,0 +1,117 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from agregados import Agregador, IndiceAgregados
+from armazenamento import ArmazenamentoSQLite
+from horarios import FUSO, agora_utc
+from recalcular_agregados import dividir_em_blocos
+from validacao import montar_registro
+
+INICIO = datetime(2024, 3, 1, 3, 0, tzinfo=timezone.utc)  # meia-noite em São Paulo
+
+
+def registro(placa, tipo, momento, transportadora='TRANSPORTES X'):
+    campos = {'nome': 'MOTORISTA', 'placa': placa, 'ordem': '1', 'tipo': tipo,
+              'Transportadora': transportadora, 'quilometragem': None}
+    return montar_registro(campos, momento, None)
+
+
+def historico(semente, dias=20, placas=15):
+    # Entradas e saídas em ordem de horário; inclui estadias que atravessam a meia-noite,
+    # saídas sem entrada e reentradas sem saída
+    rnd = random.Random(semente)
+    registros = []
+    momento = INICIO
+    fim = INICIO + timedelta(days=dias)
+    while momento < fim:
+        momento += timedelta(minutes=rnd.randint(5, 240))
+        placa = f'ABC{rnd.randint(1000, 1000 + placas)}'
+        tipo = rnd.choice(['Entrada', 'Entrada', 'Saída', 'Saída', 'Saída'])
+        registros.append(registro(placa, tipo, momento, rnd.choice(['TRANSPORTES X', 'RODOLOG'])))
+    return registros
+
+
+@pytest.mark.parametrize('semente', [1, 2, 3])
+@pytest.mark.parametrize('dias_por_bloco', [1, 3, 7])
+def test_emendar_igual_passada_sequencial(semente, dias_por_bloco):
+    registros = historico(semente)
+    sequencial = Agregador()
+    for r in registros:
+        sequencial.aplicar(r)
+
+    total = Agregador()
+    for inicio, fim in dividir_em_blocos(INICIO, registros[-1]['horario_utc'] + timedelta(seconds=1), dias_por_bloco):
+        bloco = Agregador(blocos=True)
+        for r in registros:
+            if inicio <= r['horario_utc'] < fim:
+                bloco.aplicar(r)
+        total.emendar(bloco)
+
+    assert total.dias == sequencial.dias
+    assert total.abertas == sequencial.abertas
+    assert any(d['permanencia']['contagem'] for d in sequencial.dias.values())
+
+
+class FilaFalsa:
+    def __init__(self, pendentes):
+        self._pendentes = pendentes
+
+    def pendentes(self):
+        return list(self._pendentes)
+
+
+def test_reconstruir_nao_conta_de_novo_o_journal_ja_no_snapshot():
+    armazenamento = ArmazenamentoSQLite()
+    indice = IndiceAgregados()
+    indice.reconstruir(armazenamento)
+    agora = agora_utc()
+    dia = agora.astimezone(FUSO).strftime('%Y-%m-%d')
+
+    # Aceito pelo write-behind e contado, mas ainda no journal quando o snapshot é salvo
+    primeiro = registro('ABC1234', 'Entrada', agora + timedelta(seconds=1))
+    indice.aplicar('d1', primeiro)
+    indice.salvar(armazenamento)
+
+    segundo = registro('XYZ9876', 'Entrada', agora + timedelta(seconds=2))
+    novo = IndiceAgregados()
+    novo.reconstruir(armazenamento, FilaFalsa([('d1', primeiro), ('d2', segundo)]))
+    assert novo.resumo(dia, dia)['entradas'] == 2
+
+
+def test_segunda_instancia_nao_sobrescreve_os_dias_da_primeira():
+    armazenamento = ArmazenamentoSQLite()
+    agora = agora_utc()
+    dia = agora.astimezone(FUSO).strftime('%Y-%m-%d')
+    primeira, segunda = IndiceAgregados(), IndiceAgregados()
+    primeira.reconstruir(armazenamento)
+    segunda.reconstruir(armazenamento)
+
+    for doc_id, indice, momento in [('d1', primeira, agora + timedelta(seconds=1)),
+                                    ('d2', segunda, agora + timedelta(seconds=2))]:
+        r = registro(f'ABC{doc_id}', 'Entrada', momento)
+        armazenamento.adicionar(r, doc_id)
+        indice.aplicar(doc_id, r)
+    primeira.salvar(armazenamento)
+    segunda.salvar(armazenamento)  # Estado recente da primeira: não grava
+    assert armazenamento.carregar_agregados()[dia]['total'] == {'Entrada': 1}
+
+    # A primeira parou: a segunda recarrega do estado dela, inclui o próprio registro e assume
+    segunda.validade = timedelta(0)
+    segunda.salvar(armazenamento)
+    assert armazenamento.carregar_agregados()[dia]['total'] == {'Entrada': 2}
+
+
+def test_registros_atrasados_nao_desfazem_a_entrada_aberta():
+    agregador = Agregador()
+    agregador.aplicar(registro('ABC1234', 'Entrada', INICIO + timedelta(hours=13)))
+    # Lote atrasado: Entrada e Saída anteriores à Entrada que está aberta
+    agregador.aplicar(registro('ABC1234', 'Saída', INICIO + timedelta(hours=11)))
+    agregador.aplicar(registro('ABC1234', 'Entrada', INICIO + timedelta(hours=10)))
+    agregador.aplicar(registro('ABC1234', 'Saída', INICIO + timedelta(hours=15)))
+
+    permanencia = agregador.dias['2024-03-01']['permanencia']
+    assert permanencia['contagem'] == 1
+    assert permanencia['soma_min'] == 120
+    assert agregador.abertas == {}
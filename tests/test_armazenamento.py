@@ -0,0 +1,79 @@
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from armazenamento import ArmazenamentoParticionado, ArmazenamentoSQLite, tabela_do_site
+from horarios import texto_utc
+from validacao import montar_registro
+
+INICIO = datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def registro(site, momento, placa='ABC1234'):
+    campos = {'nome': 'MOTORISTA', 'placa': placa, 'ordem': '1', 'tipo': 'Entrada',
+              'Transportadora': 'TRANSPORTES X', 'quilometragem': None}
+    return montar_registro(campos, momento, SimpleNamespace(id=site) if site else None)
+
+
+@pytest.fixture
+def particionado():
+    # Um banco por partição, como coleções separadas no Firestore
+    return ArmazenamentoParticionado(ArmazenamentoSQLite(), lambda site: ArmazenamentoSQLite(colecao=tabela_do_site(site)),
+                                     sites=['itapevi', 'barueri'])
+
+
+def popular(armazenamento, semente, quantidade=300):
+    # Horários repetidos entre partições (o desempate é o doc_id) e, na partição padrão,
+    # cópias ainda não removidas de registros já migrados para a partição do site
+    rnd = random.Random(semente)
+    itens = []
+    for i in range(quantidade):
+        site = rnd.choice(['itapevi', 'barueri', None])
+        momento = INICIO + timedelta(minutes=rnd.randint(0, 120))
+        itens.append((f'{rnd.randint(0, 10 ** 6):07d}-{i}', registro(site, momento, placa=f'ABC{1000 + i % 50}')))
+    armazenamento.adicionar_lote(itens)
+    copias = [(doc_id, r) for doc_id, r in itens if r.get('site')][:80]
+    armazenamento.padrao.adicionar_lote(copias)
+    return {doc_id: r for doc_id, r in itens}
+
+
+def chave(doc_id, r):
+    return texto_utc(r['horario_utc']), doc_id
+
+
+@pytest.mark.parametrize('tamanho_pagina', [1, 7, 500])
+def test_listar_intercala_em_ordem_sem_duplicar(particionado, tamanho_pagina):
+    registros = popular(particionado, semente=tamanho_pagina)
+    listados = list(particionado.listar(tamanho_pagina=tamanho_pagina))
+    assert [doc_id for doc_id, _ in listados] == sorted(registros, key=lambda d: chave(d, registros[d]))
+
+
+def test_listar_intervalo_e_filtros(particionado):
+    registros = popular(particionado, semente=1)
+    inicio, fim = INICIO + timedelta(minutes=30), INICIO + timedelta(minutes=90)
+    listados = list(particionado.listar(inicio=inicio, fim=fim, filtros={'placa_canonica': 'ABC1007'}, tamanho_pagina=5))
+    esperados = sorted((d for d, r in registros.items()
+                        if inicio <= r['horario_utc'] < fim and r['placa_canonica'] == 'ABC1007'),
+                       key=lambda d: chave(d, registros[d]))
+    assert [doc_id for doc_id, _ in listados] == esperados
+
+
+def test_listar_por_site_inclui_nao_migrados(particionado):
+    registros = popular(particionado, semente=2)
+    # Registro do site que ainda só existe na partição padrão (migração não rodou)
+    particionado.padrao.adicionar(registro('itapevi', INICIO + timedelta(minutes=200)), 'so-na-padrao')
+    registros['so-na-padrao'] = registro('itapevi', INICIO + timedelta(minutes=200))
+
+    listados = list(particionado.listar(filtros={'site': 'itapevi'}, tamanho_pagina=4))
+    esperados = sorted((d for d, r in registros.items() if r.get('site') == 'itapevi'),
+                       key=lambda d: chave(d, registros[d]))
+    assert [doc_id for doc_id, _ in listados] == esperados
+    assert all(r['site'] == 'itapevi' for _, r in listados)
+
+
+def test_existentes_procura_em_todas_as_particoes(particionado):
+    particionado.adicionar(registro('itapevi', INICIO), 'no-site')
+    particionado.adicionar(registro(None, INICIO), 'na-padrao')
+    assert particionado.existentes(['no-site', 'na-padrao', 'inexistente']) == {'no-site', 'na-padrao'}
@@ -0,0 +1,68 @@
+import time
+from datetime import timedelta
+
+from armazenamento import ArmazenamentoSQLite
+from carga_inicial import CargaInicial
+from horarios import agora_utc
+from validacao import montar_registro
+
+
+def registro(placa, momento):
+    campos = {'nome': 'MOTORISTA', 'placa': placa, 'ordem': '1', 'tipo': 'Entrada',
+              'Transportadora': 'TRANSPORTES X', 'quilometragem': None}
+    return montar_registro(campos, momento, None)
+
+
+class IndiceContador:
+    def __init__(self):
+        self.aplicados = []
+        self.pronto = False
+
+    def aplicar(self, doc_id, registro):
+        self.aplicados.append(doc_id)
+
+
+class ArmazenamentoComLote(ArmazenamentoSQLite):
+    # Um lote com horário antigo é aceito (gravado e publicado) no meio da leitura
+    def __init__(self, lote):
+        super().__init__()
+        self.lote = lote
+        self.carga = None
+
+    def listar(self, inicio=None, fim=None, filtros=None, tamanho_pagina=1):
+        for i, item in enumerate(super().listar(inicio, fim, filtros, tamanho_pagina=1)):
+            yield item
+            if i == 0:
+                doc_id, r = self.lote
+                self.adicionar(r, doc_id)
+                self.carga.aplicar(doc_id, r)
+
+
+def esperar(indices):
+    for _ in range(200):
+        if all(indice.pronto for indice in indices):
+            return
+        time.sleep(0.01)
+    raise AssertionError('carga não terminou')
+
+
+def test_uma_leitura_para_todas_as_janelas_sem_aplicar_duas_vezes():
+    agora = agora_utc()
+    armazenamento = ArmazenamentoComLote(('lote', registro('LOT0001', agora - timedelta(hours=2))))
+    armazenamento.adicionar(registro('ABC1234', agora - timedelta(days=20)), 'antigo')
+    armazenamento.adicionar(registro('XYZ9876', agora - timedelta(days=5)), 'medio')
+    armazenamento.adicionar(registro('DEF5678', agora - timedelta(hours=5)), 'recente')
+
+    longo, curto = IndiceContador(), IndiceContador()
+    carga = armazenamento.carga = CargaInicial(armazenamento)
+    carga.adicionar(longo, timedelta(days=30))
+    carga.adicionar(curto, timedelta(days=1))
+    carga.iniciar()
+    esperar([longo, curto])
+
+    assert sorted(longo.aplicados) == ['antigo', 'lote', 'medio', 'recente']
+    assert sorted(curto.aplicados) == ['lote', 'recente']
+
+    # Depois da carga, aplicar() só repassa
+    carga.aplicar('novo', registro('NOV0001', agora_utc()))
+    assert longo.aplicados.count('novo') == curto.aplicados.count('novo') == 1
@@ -0,0 +1,83 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from armazenamento import ArmazenamentoSQLite
+from fila_gravacao import FilaGravacao
+from validacao import montar_registro
+
+MOMENTO = datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def registro(placa):
+    campos = {'nome': 'MOTORISTA', 'placa': placa, 'ordem': '1', 'tipo': 'Entrada',
+              'Transportadora': 'TRANSPORTES X', 'quilometragem': None}
+    return montar_registro(campos, MOMENTO, None)
+
+
+class ArmazenamentoInstavel(ArmazenamentoSQLite):
+    def __init__(self, falhas):
+        super().__init__()
+        self.falhas = falhas
+
+    def adicionar_lote(self, itens):
+        if self.falhas:
+            self.falhas -= 1
+            raise RuntimeError('armazenamento indisponível')
+        super().adicionar_lote(itens)
+
+
+def ids_gravados(armazenamento):
+    return sorted(doc_id for doc_id, _ in armazenamento.listar())
+
+
+def test_journal_sobrevive_ao_reinicio_e_e_enviado(tmp_path):
+    caminho = str(tmp_path / 'journal.db')
+    armazenamento = ArmazenamentoSQLite()
+
+    # Processo que aceitou os registros e caiu antes de enviá-los (sem iniciar a thread)
+    fila = FilaGravacao(armazenamento, caminho)
+    ids = [fila.enfileirar(registro('ABC1234'))] + fila.enfileirar_lote([('fixo-1', registro('XYZ9876'))])
+    fila._conn.close()
+
+    reiniciada = FilaGravacao(armazenamento, caminho)
+    assert reiniciada.profundidade() == 2
+    assert [doc_id for doc_id, _ in reiniciada.pendentes()] == ids
+    assert reiniciada.contem(['fixo-1', 'outro']) == {'fixo-1'}
+    assert reiniciada.pendentes()[0][1]['horario_utc'] == MOMENTO
+
+    assert reiniciada.flush() == 2
+    assert reiniciada.profundidade() == 0
+    assert reiniciada.pendentes() == []
+    assert ids_gravados(armazenamento) == sorted(ids)
+
+
+def test_falha_no_envio_mantem_o_journal_e_reenvio_nao_duplica(tmp_path):
+    armazenamento = ArmazenamentoInstavel(falhas=1)
+    fila = FilaGravacao(armazenamento, str(tmp_path / 'journal.db'))
+    doc_id = fila.enfileirar(registro('ABC1234'))
+
+    with pytest.raises(RuntimeError):
+        fila.flush()
+    assert fila.profundidade() == 1
+    assert fila.flush() == 1
+    assert fila.flush() == 0
+    assert ids_gravados(armazenamento) == [doc_id]
+
+
+def test_thread_esvazia_o_journal_com_retentativa(tmp_path):
+    armazenamento = ArmazenamentoInstavel(falhas=2)
+    fila = FilaGravacao(armazenamento, str(tmp_path / 'journal.db'), intervalo=0.01, espera_maxima=0.05)
+    fila.enfileirar_lote([(f'd{i}', registro(f'ABC{1000 + i}')) for i in range(3)])
+    fila.iniciar()
+    try:
+        for _ in range(200):
+            if fila.profundidade() == 0:
+                break
+            time.sleep(0.01)
+    finally:
+        fila.parar()
+    assert ids_gravados(armazenamento) == ['d0', 'd1', 'd2']
+    estatisticas = fila.estatisticas()
+    assert (estatisticas['falhas'], estatisticas['gravados'], estatisticas['ultimo_erro']) == (2, 3, None)
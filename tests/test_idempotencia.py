@@ -0,0 +1,48 @@
+import time
+
+from idempotencia import CacheDeduplicacao
+
+
+def test_mesmo_envio_com_o_mesmo_token_e_repeticao():
+    cache = CacheDeduplicacao(janela=60)
+    envio = ('ABC1234', '1', 'Entrada')
+    assert cache.reservar([('token', 't1'), ('envio',) + envio], conteudo=envio)
+    assert not cache.reservar([('token', 't1'), ('envio',) + envio], conteudo=envio)
+    # Mesmo conteúdo por outra chave (toque duplo que gerou outro token)
+    assert not cache.reservar([('token', 't2'), ('envio',) + envio], conteudo=envio)
+
+
+def test_token_reaproveitado_com_outro_conteudo_passa_a_ser_do_novo_envio():
+    # "Voltar" do navegador num celular compartilhado: o token do motorista anterior
+    # chega com outra placa
+    cache = CacheDeduplicacao(janela=60)
+    anterior = ('ABC1234', '1', 'Entrada')
+    novo = ('XYZ9876', '2', 'Entrada')
+    assert cache.reservar([('token', 't1'), ('envio',) + anterior], conteudo=anterior)
+    assert cache.reservar([('token', 't1'), ('envio',) + novo], conteudo=novo)
+
+    # O token agora é do novo envio: repeti-lo é repetição, e o anterior continua reservado
+    assert not cache.reservar([('token', 't1'), ('envio',) + novo], conteudo=novo)
+    assert not cache.reservar([('token', 't3'), ('envio',) + anterior], conteudo=anterior)
+    # O envio anterior com o token reatribuído não é mais repetição pelo token, só pela tupla
+    assert cache.reservar([('token', 't1')], conteudo=anterior)
+
+
+def test_liberar_e_expirar():
+    cache = CacheDeduplicacao(janela=0.05)
+    envio = ('ABC1234', '1', 'Entrada')
+    assert cache.reservar([('envio',) + envio], conteudo=envio)
+    cache.liberar([('envio',) + envio])
+    assert cache.reservar([('envio',) + envio], conteudo=envio)
+    time.sleep(0.06)
+    assert cache.reservar([('envio',) + envio], conteudo=envio)
+    assert len(cache) == 1
+
+
+def test_tamanho_maximo_descarta_as_mais_antigas():
+    cache = CacheDeduplicacao(janela=60, tamanho_maximo=3)
+    for i in range(5):
+        assert cache.reservar([('token', str(i))], conteudo=i)
+    assert len(cache) == 3
+    assert cache.reservar([('token', '0')], conteudo=0)
+    assert not cache.reservar([('token', '4')], conteudo=4)
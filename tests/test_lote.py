@@ -0,0 +1,116 @@
+import os
+from datetime import timedelta
+
+import pytest
+
+# O app lê a configuração no import: SQLite em memória e sem limite de taxa por IP
+os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+os.environ.setdefault('SECRET_KEY', 'teste')
+os.environ.setdefault('ADMISSAO_LOTE_POR_MINUTO', '0')
+
+import app as modulo_app  # noqa: E402
+from fila_gravacao import FilaGravacao  # noqa: E402
+from horarios import agora_utc  # noqa: E402
+from idempotencia import CacheDeduplicacao  # noqa: E402
+
+LAT_PATIO, LON_PATIO = -23.516185, -46.965741
+
+
+def item(id_local, placa='ABC1234', ordem='1', tipo='Entrada', minutos_atras=30, **extras):
+    return dict({'id': id_local, 'horario': (agora_utc() - timedelta(minutes=minutos_atras)).isoformat(),
+                 'nome': 'MOTORISTA', 'placa': placa, 'ordem': ordem, 'tipo': tipo,
+                 'Transportadora': 'TRANSPORTES X', 'latitude': LAT_PATIO, 'longitude': LON_PATIO}, **extras)
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    # Cache de deduplicação novo por teste; trocá-lo de novo no meio do teste simula o fim da janela
+    monkeypatch.setattr(modulo_app, 'deduplicacao', CacheDeduplicacao())
+    return modulo_app.app.test_client()
+
+
+def enviar(cliente, dispositivo, itens):
+    return cliente.post('/api/registros/lote', json={'dispositivo': dispositivo, 'registros': itens})
+
+
+def status(resposta):
+    return [resultado['status'] for resultado in resposta.get_json()['resultados']]
+
+
+def test_reenvio_com_id_fixo_ja_gravado_volta_repetido(cliente, monkeypatch):
+    itens = [item('1', placa='LOT1001'), item('2', placa='LOT1002')]
+    assert status(enviar(cliente, 'tablet-armazenamento', itens)) == ['gravado', 'gravado']
+
+    # Depois da janela de deduplicação, o reenvio é achado no armazenamento (existentes)
+    monkeypatch.setattr(modulo_app, 'deduplicacao', CacheDeduplicacao())
+    resposta = enviar(cliente, 'tablet-armazenamento', itens + [item('3', placa='LOT1003')])
+    assert status(resposta) == ['repetido', 'repetido', 'gravado']
+    assert resposta.get_json()['repetido'] == 2
+
+
+def test_reenvio_ainda_no_journal_volta_repetido(cliente, monkeypatch, tmp_path):
+    # Fila sem a thread de envio: o que foi enfileirado continua no journal
+    fila = FilaGravacao(modulo_app.armazenamento, str(tmp_path / 'journal.db'))
+    monkeypatch.setattr(modulo_app, 'fila_gravacao', fila)
+    itens = [item('1', placa='LOT2001')]
+    assert status(enviar(cliente, 'tablet-journal', itens)) == ['gravado']
+    assert fila.profundidade() == 1
+
+    monkeypatch.setattr(modulo_app, 'deduplicacao', CacheDeduplicacao())
+    assert status(enviar(cliente, 'tablet-journal', itens)) == ['repetido']
+    assert fila.profundidade() == 1
+
+
+def test_falha_na_consulta_libera_as_chaves(cliente, monkeypatch):
+    def indisponivel(doc_ids):
+        raise RuntimeError('armazenamento indisponível')
+
+    itens = [item('1', placa='LOT3001')]
+    with monkeypatch.context() as m:
+        m.setattr(modulo_app.armazenamento, 'existentes', indisponivel)
+        resposta = enviar(cliente, 'tablet-falha', itens)
+    assert status(resposta) == ['falha']
+    assert 'armazenamento indisponível' in resposta.get_json()['resultados'][0]['mensagem']
+
+    # As chaves foram liberadas: a nova tentativa grava em vez de voltar como repetida
+    assert status(enviar(cliente, 'tablet-falha', itens)) == ['gravado']
+
+
+def test_falha_na_gravacao_libera_as_chaves(cliente, monkeypatch):
+    def indisponivel(itens):
+        raise RuntimeError('armazenamento indisponível')
+
+    itens = [item('1', placa='LOT4001'), {'placa': 'SEM ID', 'horario': None}]
+    with monkeypatch.context() as m:
+        m.setattr(modulo_app.armazenamento, 'adicionar_lote', indisponivel)
+        assert status(enviar(cliente, 'tablet-gravacao', itens)) == ['falha', 'invalido']
+    assert status(enviar(cliente, 'tablet-gravacao', itens[:1])) == ['gravado']
+
+
+def test_lote_acima_do_maximo_volta_413(cliente, monkeypatch):
+    monkeypatch.setattr(modulo_app, 'LOTE_MAXIMO', 2)
+    resposta = enviar(cliente, 'tablet-413', [item(str(i), placa=f'LOT500{i}') for i in range(3)])
+    assert resposta.status_code == 413
+
+
+def test_itens_invalidos_nao_impedem_os_validos(cliente):
+    itens = [
+        'não é objeto',
+        item('1', placa=''),
+        item('2', placa='LOT6002', minutos_atras=60 * 24 * (modulo_app.LOTE_IDADE_MAXIMA_DIAS + 1)),
+        item('3', placa='LOT6003', horario='ontem'),
+        item('4', placa='LOT6004', latitude=-22.9, longitude=-43.2),
+        item('5', placa='LOT6005'),
+        item('6', placa='LOT6005'),  # Mesma placa/ordem/tipo do anterior no mesmo lote
+    ]
+    resposta = enviar(cliente, 'tablet-invalidos', itens)
+    assert resposta.status_code == 200
+    corpo = resposta.get_json()
+    assert status(resposta) == ['invalido'] * 5 + ['gravado', 'repetido']
+    assert [r.get('motivo') for r in corpo['resultados'][:4]] == [
+        'item_invalido', 'placa_vazia', 'horario_fora_do_intervalo', 'horario_invalido']
+    assert (corpo['recebidos'], corpo['gravado'], corpo['invalido'], corpo['repetido']) == (7, 1, 5, 1)
+
+
+def test_corpo_sem_lista_volta_400(cliente):
+    assert cliente.post('/api/registros/lote', json={'registros': 'x'}).status_code == 400
@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from armazenamento import ArmazenamentoSQLite
+from horarios import agora_utc
+from ocupacao import IndiceOcupacao
+from validacao import montar_registro
+
+
+def registro(placa, tipo, momento):
+    campos = {'nome': 'MOTORISTA', 'placa': placa, 'ordem': '1', 'tipo': tipo,
+              'Transportadora': 'TRANSPORTES X', 'quilometragem': None}
+    return montar_registro(campos, momento, None)
+
+
+def test_reconstruir_inclui_lote_atrasado_gravado_depois_do_snapshot():
+    armazenamento = ArmazenamentoSQLite()
+    agora = agora_utc()
+    indice = IndiceOcupacao()
+    indice.reconstruir(armazenamento)
+    for doc_id, r in [('d1', registro('ABC1234', 'Entrada', agora - timedelta(days=10))),
+                      ('d2', registro('XYZ9876', 'Entrada', agora - timedelta(minutes=5)))]:
+        armazenamento.adicionar(r, doc_id)
+        indice.aplicar(doc_id, r)
+    indice.salvar(armazenamento)
+
+    # Lote de um tablet que ficou offline: horário bem anterior ao cursor, gravado depois do
+    # snapshot e antes de uma queda do servidor
+    armazenamento.adicionar(registro('ABC1234', 'Saída', agora - timedelta(days=9)), 'd3')
+    armazenamento.adicionar(registro('DEF5678', 'Entrada', agora - timedelta(days=20)), 'd4')
+
+    novo = IndiceOcupacao()
+    novo.reconstruir(armazenamento)
+    assert [v['placa'] for v in novo.veiculos()] == ['DEF5678', 'XYZ9876']
+
+
+def test_listar_gravados_segue_a_ordem_de_gravacao():
+    armazenamento = ArmazenamentoSQLite()
+    agora = agora_utc()
+    antigo = registro('ABC1234', 'Entrada', agora - timedelta(days=5))
+    antigo['gravado_em'] = agora - timedelta(hours=1)
+    armazenamento.adicionar(antigo, 'antigo')
+    armazenamento.adicionar(registro('XYZ9876', 'Entrada', agora - timedelta(days=9)), 'lote')
+    armazenamento.adicionar(registro('DEF5678', 'Entrada', agora), 'novo')
+
+    ids = [doc_id for doc_id, _ in armazenamento.listar_gravados(agora - timedelta(minutes=1), tamanho_pagina=1)]
+    assert ids == ['lote', 'novo']
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+from placas import ArvoreBK, canonica, distancia
+
+
+@pytest.mark.parametrize('digitada, esperada', [
+    ('ABC1234', 'ABC1234'),   # formato antigo
+    ('abc-1234', 'ABC1234'),  # minúsculas e hífen
+    ('ABC1D34', 'ABC1334'),   # Mercosul: D no 5º caractere é o 3
+    ('ABC1A34', 'ABC1034'),
+    ('ABC1J34', 'ABC1934'),
+    ('0BC1234', 'OBC1234'),   # 0 digitado no lugar de O nas letras
+    ('A1C1234', 'AIC1234'),   # 1 digitado no lugar de I nas letras
+    ('ABCI234', 'ABC1234'),   # I digitado no lugar de 1 nos números
+    ('ABC12O4', 'ABC1204'),   # O digitado no lugar de 0 nos números
+    ('ABC1O34', 'ABC1034'),   # O no 5º caractere é tratado como 0
+    ('ABC1I34', 'ABC1834'),   # I no 5º caractere é o 8 do Mercosul
+    ('1BC1D3O', 'IBC1330'),   # tudo junto
+    ('ABC12', 'ABC12'),       # fora do padrão: fica como está
+    ('ABC1Z34', 'ABC1Z34'),   # Z não é letra do Mercosul
+    ('', ''),
+    (None, ''),
+])
+def test_canonica(digitada, esperada):
+    assert canonica(digitada) == esperada
+
+
+def test_canonica_junta_antiga_e_mercosul():
+    assert canonica('ABC-1234') == canonica('ABC1C34') == canonica('abc1c34')
+
+
+def test_canonica_idempotente():
+    for placa in ('ABC1D34', '0BC1I34', 'ABC12', 'ABC1Z34'):
+        assert canonica(canonica(placa)) == canonica(placa)
+
+
+def test_distancia():
+    assert distancia('ABC1234', 'ABC1234') == 0
+    assert distancia('ABC1234', 'ABD1234') == 1
+    assert distancia('ABC1234', 'ABC123') == 1
+    assert distancia('ABC1234', 'XYZ9876', limite=2) == 3
+
+
+def placas_aleatorias(quantidade, semente):
+    rnd = random.Random(semente)
+    letras = 'ABCDEFGH'
+    return [''.join(rnd.choice(letras) for _ in range(3)) + str(rnd.randint(1000, 1199)) for _ in range(quantidade)]
+
+
+def test_arvore_bk_buscar_igual_forca_bruta():
+    placas = sorted(set(placas_aleatorias(800, 1)))
+    arvore = ArvoreBK()
+    for placa in placas:
+        assert arvore.adicionar(placa)
+    assert not arvore.adicionar(placas[0])
+    assert arvore.tamanho == len(placas)
+
+    for consulta in placas_aleatorias(30, 2) + placas[:5]:
+        distancias = [(distancia(consulta, placa), placa) for placa in placas]
+        for distancia_maxima in (0, 1, 2):
+            esperado = sorted(item for item in distancias if item[0] <= distancia_maxima)
+            assert sorted(arvore.buscar(consulta, distancia_maxima)) == esperado
+
+
+def test_arvore_bk_vazia():
+    assert ArvoreBK().buscar('ABC1234', 2) == []